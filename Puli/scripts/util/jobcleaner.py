@@ -8,6 +8,10 @@ The cleaning is done in 2 times:
 
 This process is done twice, a first time to clean folder_nodes a second time for the task_nodes
 It is usually called from the server itself and croned to execute every day at 7:00
+
+The dispatcher can now archive the old jobs itself (CORE.ARCHIVE_ENABLED, see octopus.dispatcher.archiver): this
+script is only needed for the servers where it is disabled. The ids sent to /tasks/delete/ are queued and archived
+by batches during the next cycles.
 """
 
 from optparse import OptionParser
@@ -34,6 +34,8 @@ from puliclient.jobs import CommandDone
 
 from octopus.core.http import Request
 from octopus.core.communication.requestmanager import RequestManager
+from octopus.core.communication.channel import ChannelClient
+from octopus.core.timers import TimerQueue
 from octopus.core.enums.command import *
 
 EXEC, POSTEXEC = "execute", "postExecute"
@@ -175,6 +177,9 @@ class CommandWatcher(object):
         self.arguments = arguments
         self.runner = runner
 
+        # Persistent local channel to the worker, updates fall back to http requests if it is not usable
+        self.channel = ChannelClient(os.environ.get("PULI_WORKER_CHANNEL"))
+
         self.completion = 0.0
         self.message = "loading command script"
         self.stats = {}
@@ -272,6 +277,9 @@ class CommandWatcher(object):
         if self.workerPort is "0":
             return
 
+        if self.channel.send({"type": "update", "id": self.id, "status": status}):
+            return
+
         dct = json.dumps({"id": self.id, "status": status})
         headers = {}
         headers['Content-Length'] = len(dct)
@@ -292,6 +300,9 @@ class CommandWatcher(object):
             return
 
         # logger.debug('Updating msg and errorInfos : %s,%s' % (msg, str(errorInfos)))
+        if self.channel.send({"type": "validation", "id": self.id, "validatorMessage": msg, "errorInfos": errorInfos}):
+            return
+
         dct = json.dumps({"id": self.id, "validatorMessage": msg, "errorInfos": errorInfos})
         headers = {}
         headers['Content-Length'] = len(dct)
@@ -305,7 +316,11 @@ class CommandWatcher(object):
         if self.workerPort is "0":
             return
 
-        body = json.dumps({"id": self.id, "status": status, "completion": self.completion, "message": self.message, "stats" : self.stats})
+        data = {"id": self.id, "status": status, "completion": self.completion, "message": self.message, "stats" : self.stats}
+        if self.channel.send(dict(data, type="update")):
+            return
+
+        body = json.dumps(data)
 
         headers = {}
         headers['Content-Length'] = len(body)
@@ -320,7 +335,7 @@ class CommandWatcher(object):
             elif response.status == 404:
                 logger.debug("Command is not registered anymore on the worker")
             else:
-                logger("Unexpected response to status update request: %d %s" % (response.status, response.reason))
+                logger.warning("Unexpected response to status update request: %d %s" % (response.status, response.reason))
 
         def onError(request, error):
             logger.debug("Update request failed: %s", error)
@@ -332,8 +347,9 @@ class CommandWatcher(object):
         while retry and not request.done:
             request.call(conn, onResponse, onError)
             conn.close()
-            time.sleep(delay)
-            delay = max(2.0 * delay, 30.0)
+            if not request.done:
+                time.sleep(delay)
+                delay = min(2.0 * delay, 30.0)
 
     ## Updates the completion of the command.
     #
@@ -367,13 +383,14 @@ class CommandWatcher(object):
         if self.statsHasChanged and self.stats is not {}:
             data["stats"] = self.stats
 
-        dct = json.dumps( data )
-        headers = {}
-        headers['Content-Length'] = len(dct)
-        try:
-            self.requestManager.put("/commands/%d/" % self.id, dct, headers)
-        except http.BadStatusLine:
-            logger.debug('Updating completion has failed with a BadStatusLine error')
+        if not self.channel.send(dict(data, type="update", id=self.id)):
+            dct = json.dumps( data )
+            headers = {}
+            headers['Content-Length'] = len(dct)
+            try:
+                self.requestManager.put("/commands/%d/" % self.id, dct, headers)
+            except http.BadStatusLine:
+                logger.debug('Updating completion has failed with a BadStatusLine error')
 
         # Reset update flags
         self.messageHasChanged = False
@@ -386,6 +403,8 @@ class CommandWatcher(object):
         """
         | Sends a request to release a license for the current node
         | A request releases only one token, i.e. a tuple (RN, license)
+        | If the worker channel is available, the release is delegated to the worker.
+        | Otherwise a request is sent directly to the server:
         | The command watcher will make several attempts (with 200ms delay btw each)
         | Request detail:
         |   -url: http://server:port/licenses/<licenseName>
@@ -398,6 +417,10 @@ class CommandWatcher(object):
         if self.workerPort is "0":
             return
 
+        if self.channel.send({"type": "license", "id": self.id, "licenseName": licenseName}):
+            logger.info("License release sent to the worker: %s" % licenseName)
+            return True
+
         try:
             body = json.dumps({"rns":self.workerFullName})
             url = "http://%s/licenses/%s" % (self.serverFullName, licenseName)
@@ -439,18 +462,17 @@ class CommandWatcher(object):
     def execScriptChecker(self):
         logger.debug("Checking Execution...")
 
-        timeOut = self.job.scriptTimeOut
-
-        while not(self.threadList[EXEC].stopped):
-            tmpTime = time.time()
-
-            if self.workerPort is not 0:
-                self.updateCommandCompletion()
+        # Periodic updates and script timeout are deadlines, the checker wakes up as soon as one is reached
+        # or as soon as the runner thread ends.
+        execThread = self.threadList[EXEC]
+        timers = TimerQueue()
+        if self.workerPort is not 0:
+            timers.schedulePeriodic(self.intervalTimeExec, self.updateCommandCompletion, first=0)
+        if self.job.scriptTimeOut is not None:
+            timers.schedule(self.job.scriptTimeOut, self.onScriptTimeOut)
 
-            if timeOut is not None:
-                if timeOut < 0:
-                    logger.error("Script timeout reached.")
-                    self.finalState = CMD_TIMEOUT
+        while not(execThread.stopped) and execThread.isAlive():
+            timers.run()
 
             if self.finalState in [CMD_ERROR, CMD_CANCELED, CMD_TIMEOUT]:
                 try:
@@ -460,10 +482,7 @@ class CommandWatcher(object):
                     pass
                 break
 
-            time.sleep(self.intervalTimeExec)
-
-            if timeOut is not None:
-                timeOut -= time.time() - tmpTime
+            execThread.join(timers.timeUntilNext(default=self.intervalTimeExec))
 
         if self.threadList[EXEC].stopped == COMMAND_STOPPED:
             ''' Manually stopped from CommandRunner'''
@@ -482,12 +501,19 @@ class CommandWatcher(object):
                 logger.error(line)
             self.finalState = CMD_ERROR
             self.runnerErrorInExec = str(self.threadList[EXEC].errorInfo)
+        elif self.threadList[EXEC].stopped == COMMAND_RUNNING and not self.threadList[EXEC].isAlive():
+            logger.error("Runner thread has exited unexpectedly.")
+            self.finalState = CMD_ERROR
         else:
             logger.debug("No more threads to check")
 
         if self.workerPort is not 0:
             self.updateCommandStatusAndCompletion(self.finalState, True)
 
+    def onScriptTimeOut(self):
+        logger.error("Script timeout reached.")
+        self.finalState = CMD_TIMEOUT
+
     ## Kills all processes launched by the command.
     #
     def killCommand(self):
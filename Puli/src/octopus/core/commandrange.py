@@ -0,0 +1,99 @@
+'''
+Decomposition of a frame range in commands, shared by the client (puliclient.jobs.DefaultTaskDecomposer) and the
+dispatcher.
+
+A task decomposed with the default behaviour can be submitted in a compact form: instead of the list of its
+commands, the task representation holds a "commandRange" entry, e.g.
+    {"start": 1, "end": 20000, "packetSize": 10, "framesList": ""}
+and the commands are expanded by the dispatcher when the graph is registered. Each command has the arguments of
+the task with its own "start" and "end" values, and is named "<taskName>_<start>_<end>".
+'''
+
+START_LABEL = "start"
+END_LABEL = "end"
+PACKETSIZE_LABEL = "packetSize"
+FRAMESLIST_LABEL = "framesList"
+
+
+def iterPackets(start, end, packetSize, framesList=""):
+    '''
+    Yields the (packetStart, packetEnd) tuples of a frame range, frames are grouped by "packetSize".
+
+    :param start: Integer representing the first frame
+    :param end: Integer representing the last frame
+    :param packetSize: The number of frames to process in each command
+    :param framesList: A string representing a list of frames or frame ranges separated by commas, e.g. "1,5-10".
+                       If given, start and end are ignored.
+    '''
+    packetSize = int(packetSize)
+    if len(framesList) != 0:
+        for frame in framesList.split(","):
+            if "-" in frame:
+                frameList = frame.split("-")
+                for packet in _iterRangePackets(int(frameList[0]), int(frameList[1]), packetSize):
+                    yield packet
+            else:
+                yield int(frame), int(frame)
+    else:
+        for packet in _iterRangePackets(int(start), int(end), packetSize):
+            yield packet
+
+
+def _iterRangePackets(start, end, packetSize):
+    length = end - start + 1
+    fullPacketCount, lastPacketCount = divmod(length, packetSize)
+
+    if length < packetSize:
+        yield start, end
+    else:
+        for i in xrange(fullPacketCount):
+            packetStart = start + i * packetSize
+            yield packetStart, packetStart + packetSize - 1
+        if lastPacketCount:
+            yield start + fullPacketCount * packetSize, end
+
+
+def getCommandRange(arguments):
+    '''
+    Returns the command range of a task decomposed with the default behaviour, or None if its arguments do not
+    define a frame range.
+    '''
+    if arguments is None:
+        return None
+    if not (all(key in arguments for key in (START_LABEL, END_LABEL, PACKETSIZE_LABEL)) or FRAMESLIST_LABEL in arguments):
+        return None
+    return {
+        'start': arguments.get(START_LABEL, 1),
+        'end': arguments.get(END_LABEL, 1),
+        'packetSize': arguments.get(PACKETSIZE_LABEL, 1),
+        'framesList': arguments.get(FRAMESLIST_LABEL, ""),
+    }
+
+
+def iterCommands(taskName, taskArguments, commandRange):
+    '''
+    Yields the (description, arguments) of the commands of a task given in the compact form.
+    '''
+    for (packetStart, packetEnd) in iterPackets(commandRange['start'], commandRange['end'], commandRange['packetSize'], commandRange['framesList']):
+        arguments = taskArguments.copy()
+        arguments[START_LABEL] = packetStart
+        arguments[END_LABEL] = packetEnd
+        yield "%s_%s_%s" % (taskName, packetStart, packetEnd), arguments
+
+
+def countCommands(commandRange):
+    '''
+    Returns the number of commands of a command range, without creating them.
+
+    :raise ValueError: if the range is invalid
+    '''
+    try:
+        packetSize = int(commandRange['packetSize'])
+        if packetSize <= 0:
+            raise ValueError("Invalid packet size: %r" % commandRange['packetSize'])
+        count = 0
+        for packet in iterPackets(commandRange['start'], commandRange['end'], packetSize, commandRange['framesList']):
+            count += 1
+        return count
+    except (KeyError, TypeError, AttributeError), e:
+        raise ValueError("Invalid command range %r: %s" % (commandRange, e))
@@ -0,0 +1,229 @@
+"""
+Persistent local channel between a worker and its command watchers.
+
+Messages are small JSON dicts sent over a unix domain socket. Each message is framed with a 4 bytes
+big-endian length header so that several updates can be streamed on the same connection:
+
+    [ size ][ json body ][ size ][ json body ] ...
+
+The worker runs a ChannelServer listening on a socket file, each command watcher holds a ChannelClient
+connected for the whole life of the command. If the channel cannot be used, the caller is expected to fall
+back to the HTTP webservice of the worker.
+"""
+
+import os
+import errno
+import select
+import socket
+import struct
+import logging
+from threading import Thread
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+LOGGER = logging.getLogger("channel")
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class ChannelError(Exception):
+    '''Raised when an invalid frame is received on a channel.'''
+
+
+def encodeFrame(message):
+    '''Returns the framed representation of a message (i.e. a json serializable dict).'''
+    body = json.dumps(message)
+    return HEADER.pack(len(body)) + body
+
+
+class FrameDecoder(object):
+    '''Incremental decoder: accumulates raw data and returns every complete message received so far.'''
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (size,) = HEADER.unpack_from(self.buffer, offset)
+            if size > MAX_FRAME_SIZE:
+                raise ChannelError("Frame too large: %d bytes" % size)
+            end = offset + HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            messages.append(json.loads(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            self.buffer = self.buffer[offset:]
+        return messages
+
+
+class ChannelClient(object):
+    '''
+    Client side of the channel, used by the command watcher.
+    The connection is opened lazily and reopened once if the worker has closed it.
+    '''
+
+    def __init__(self, path, timeout=2.0):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+
+    @property
+    def enabled(self):
+        return bool(self.path) and hasattr(socket, "AF_UNIX")
+
+    def connect(self):
+        self.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+    def send(self, message):
+        '''
+        Sends a message to the worker.
+
+        :return: True if the message has been written on the socket, False if the channel is unusable and
+                 the caller needs to use another way to transmit the message.
+        '''
+        if not self.enabled:
+            return False
+
+        frame = encodeFrame(message)
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(frame)
+                return True
+            except (socket.error, EnvironmentError), e:
+                LOGGER.debug("Channel send failed (attempt %d/2): %r" % (attempt + 1, e))
+                self.close()
+        return False
+
+
+class ChannelServer(Thread):
+    '''
+    Server side of the channel, used by the worker.
+    A single thread multiplexes every command watcher connection with select and calls the given callback
+    for each decoded message. The callback is called from the channel thread, it must not block.
+    '''
+
+    def __init__(self, path, onMessage, pollInterval=1.0):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.setName("channelServer")
+        self.path = path
+        self.onMessage = onMessage
+        self.pollInterval = pollInterval
+        self.stopFlag = False
+        self.listener = None
+        self.clients = {}
+
+    def bind(self):
+        '''Creates the socket file, a stale file left by a previous worker is removed first.'''
+        try:
+            os.remove(self.path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(64)
+        listener.setblocking(0)
+        self.listener = listener
+
+    def run(self):
+        try:
+            while not self.stopFlag:
+                readers = [self.listener] + self.clients.keys()
+                try:
+                    readable, _, _ = select.select(readers, [], [], self.pollInterval)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for sock in readable:
+                    if sock is self.listener:
+                        self._accept()
+                    else:
+                        self._read(sock)
+        except Exception:
+            LOGGER.exception("Channel server stopped on unexpected error")
+        finally:
+            self._closeAll()
+
+    def stop(self):
+        self.stopFlag = True
+
+    def _accept(self):
+        try:
+            client, address = self.listener.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        client.setblocking(0)
+        self.clients[client] = FrameDecoder()
+
+    def _read(self, sock):
+        try:
+            data = sock.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ""
+
+        if not data:
+            self._drop(sock)
+            return
+
+        try:
+            messages = self.clients[sock].feed(data)
+        except (ChannelError, ValueError), e:
+            LOGGER.warning("Invalid data received on channel, closing connection: %r" % e)
+            self._drop(sock)
+            return
+
+        for message in messages:
+            try:
+                self.onMessage(message)
+            except Exception:
+                LOGGER.exception("Error while handling channel message: %r" % message)
+
+    def _drop(self, sock):
+        del self.clients[sock]
+        try:
+            sock.close()
+        except socket.error:
+            pass
+
+    def _closeAll(self):
+        for sock in self.clients.keys():
+            self._drop(sock)
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -11,13 +11,17 @@ import logging
 import logging.handlers
 
 import os
-from copy import copy
+import time
+import threading
+
+import numpy as np
 try:
     import simplejson as json
 except ImportError:
     import json
 
 from octopus.core import singletonconfig
+from octopus.core.timeseries import TimeSeriesStore
 from octopus.dispatcher import settings
 
 # 
@@ -35,11 +39,23 @@ statsLog = logging.getLogger('server_stats')
 statsLog.addHandler( hd )
 statsLog.setLevel( 1 )
 
+# The same data is appended to a time-series store, the display tools query a date range without parsing the log
+statsStore = TimeSeriesStore( os.path.join(settings.LOGDIR, "stats.tsdb") )
+
 
 class DispatcherStats():
     """
     | Class holding custom infos on the dispatcher.
-    | This data can be periodically flushed in a specific log file for later use
+    | This data is flushed in a specific log file (and the stats.tsdb store) for later use.
+    |
+    | The dispatch loop and the webservice fill the timer and counter dicts, aggregate() is called at the end of
+    | each cycle and copies them in a row of a preallocated ring buffer. A background thread drains the ring every
+    | STATS_FLUSH_INTERVAL seconds and writes the rows, the cycle never pays the formatting and file I/O cost.
+    |
+    | The ring has a single producer (the IOLoop thread) and does not need a lock: the producer fills a row, then
+    | increments writeIndex. The writer copies the rows between readIndex and writeIndex. If it is late by more
+    | than STATS_RING_SIZE cycles, the oldest rows are overwritten and counted as dropped instead of blocking the
+    | dispatcher.
     """
 
     cycleDate = 0.0
@@ -72,11 +88,28 @@ class DispatcherStats():
         'dispatch_command':0.0,
     }
 
-    accumulationBuffer = []
+    # Columns of a row of the ring, in the order of the lines of stats.log: (dict name, key, line format)
+    COLUMNS = (
+        [ ('cycleTimers', key, '%f') for key in ('update_tree', 'update_rn', 'update_dependencies', 'update_db',  # from dispatchLoop
+                                                 'compute_assignment', 'send_assignment', 'release_finishing', 'time_elapsed') ] +
+        [ ('cycleCounts', key, '%d') for key in ('incoming_requests', 'incoming_get', 'incoming_post',          # from base ressource handler
+                                                 'incoming_put', 'incoming_delete',
+                                                 'add_graphs',                                                  # from WS add graph
+                                                 'add_rns', 'update_commands',                                  # from WS rendernodes
+                                                 'num_assignments') ] +                                         # from dispatchLoop
+        [ ('assignmentTimers', key, '%f') for key in ('update_max_rn', 'dispatch_command') ]                    # from dispatchLoop in computeAssignment
+    )
+    LINE_FORMAT = ";".join( ['%f'] + [ column[2] for column in COLUMNS ] )
 
 
     def __init__( self, *args, **kwargs ):
-        pass
+        self.ring = None
+        self.writeIndex = 0
+        self.readIndex = 0
+        self.droppedRows = 0
+        self.writer = None
+        # only serializes the consumers (the writer thread and an explicit flush), the producer never waits
+        self.drainLock = threading.Lock()
 
     def _resetCounts( self ):
         for key in self.cycleCounts.keys():
@@ -85,58 +118,79 @@ class DispatcherStats():
 
     def aggregate( self ):
         """
-        | Called each cycle to store data in a buffer array
-        | Once every BUFFER_SIZE cycles, the data is dumped in stats.log for later use
+        | Called each cycle to store data in the ring buffer, the rows are written by the writer thread.
         """
+        if self.ring is None:
+            self.ring = np.zeros( (singletonconfig.get('CORE','STATS_RING_SIZE', 4096), len(self.COLUMNS) + 1), dtype=np.float64 )
+            self._startWriter()
 
-        cycleData = [ self.cycleDate, copy( self.cycleTimers ), copy(self.cycleCounts), copy( self.assignmentTimers ) ]
-        self.accumulationBuffer.append( cycleData )
+        row = [ self.cycleDate ]
+        for (dictName, key, format) in self.COLUMNS:
+            row.append( getattr(self, dictName)[key] )
+        self.ring[ self.writeIndex % len(self.ring) ] = row
+        # published once the row is complete
+        self.writeIndex += 1
 
         # Clean data for next cycle (only counts need to be cleaned, timer are overwritten)
         self._resetCounts()
 
-        # Dump to file
-        if singletonconfig.get('CORE','STATS_BUFFER_SIZE') <= len(self.accumulationBuffer):
-            self._flush()
-
         return True
 
 
-    def _flush( self ):
+    def _startWriter( self ):
+        self.writer = threading.Thread( target=self._run, name="statsWriter" )
+        self.writer.setDaemon( True )
+        self.writer.start()
+
+    def _run( self ):
+        while True:
+            time.sleep( singletonconfig.get('CORE','STATS_FLUSH_INTERVAL', 5.0) )
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger('dispatcher').exception( "Error while writing the stats" )
+
+
+    def _drain( self ):
+        """
+        Returns a copy of the rows not read yet. The rows overwritten by the producer during the copy are dropped.
+        """
+        end = self.writeIndex
+        capacity = len(self.ring)
+        start = max( self.readIndex, end - capacity )
+        indexes = np.arange( start, end ) % capacity
+        rows = self.ring[ indexes ]
+        # a row may have been overwritten while it was copied if the producer has gone round the ring meanwhile
+        overwritten = min( max( self.writeIndex - capacity + 1 - start, 0 ), end - start )
+        rows = rows[ overwritten: ]
+        start += overwritten
+        self.droppedRows += start - self.readIndex
+        self.readIndex = end
+        return rows
+
+
+    def flush( self ):
         """
-        TODO flush in a dedicated thread
+        Writes the rows of the ring in stats.log and the stats.tsdb store.
         """
-        for line in self.accumulationBuffer:
-            statsLog.log( 1,
-                "%f;%f;%f;%f;%f;%f;%f;%f;%f;%d;%d;%d;%d;%d;%d;%d;%d;%d;%f;%f" % ( 
-                line[0], 
-
-                line[1]['update_tree'],         # from dispatchLoop
-                line[1]['update_rn'],           # from dispatchLoop
-                line[1]['update_dependencies'], # from dispatchLoop
-                line[1]['update_db'],           # from dispatchLoop
-                line[1]['compute_assignment'],  # from dispatchLoop
-                line[1]['send_assignment'],     # from dispatchLoop
-                line[1]['release_finishing'],   # from dispatchLoop
-                line[1]['time_elapsed'],        # from dispatchLoop
-
-                line[2]['incoming_requests'],   # from base ressource handler
-                line[2]['incoming_get'],        # from base ressource handler
-                line[2]['incoming_post'],       # from base ressource handler
-                line[2]['incoming_put'],        # from base ressource handler
-                line[2]['incoming_delete'],     # from base ressource handler
-
-                line[2]['add_graphs'],          # from WS add graph
-                line[2]['add_rns'],             # from WS rendernodes
-                line[2]['update_commands'],     # from WS rendernodes
-                line[2]['num_assignments'],     # from dispatchLoop
-
-                line[3]['update_max_rn'],       # from dispatchLoop in computeAssignment
-                line[3]['dispatch_command'],    # from dispatchLoop in computeAssignment
-                )
-            )
-
-        self.accumulationBuffer[:]=[]
+        if self.ring is None:
+            return
+        with self.drainLock:
+            dropped = self.droppedRows
+            rows = self._drain()
+            if self.droppedRows != dropped:
+                logging.getLogger('dispatcher').warning( "Stats writer is late: %d cycles dropped" % (self.droppedRows - dropped) )
+            if not len(rows):
+                return
+
+            for row in rows.tolist():
+                statsLog.log( 1, self.LINE_FORMAT % tuple(row) )
+
+            names = [ key for (dictName, key, format) in self.COLUMNS ]
+            try:
+                statsStore.extend( [ (row[0], dict(zip(names, row[1:]))) for row in rows.tolist() ] )
+            except (IOError, OSError), e:
+                logging.getLogger('dispatcher').warning( "Impossible to write the stats in %s: %s" % (statsStore.path, e) )
 
 
 theStats = DispatcherStats()
@@ -0,0 +1,130 @@
+"""
+Deadline scheduler serviced by an application main loop.
+
+Instead of checking every object at each loop iteration (or starting a thread per delayed action), callbacks are
+registered with a deadline in a heap. The main loop only has to call run() to execute the callbacks whose
+deadline has been reached, and can use timeUntilNext() to know how long it may sleep. The cost of an iteration
+does not depend on the number of pending timers.
+
+Basic usage::
+
+    >>> timers = TimerQueue()
+    >>> timer = timers.schedule(30.0, onTimeout, commandId)
+    >>> timers.schedulePeriodic(lambda: config.WORKER_SYSINFO_DELAY, sendSysInfos)
+    >>> ...
+    >>> timer.cancel()
+    >>> while running:
+    ...     timers.run()
+    ...     time.sleep(timers.timeUntilNext(default=0.05))
+"""
+
+import time
+import heapq
+import logging
+from itertools import count
+from threading import Lock
+
+LOGGER = logging.getLogger("timers")
+
+
+class Timer(object):
+    '''A callback registered in a TimerQueue. A cancelled timer stays in the heap but is ignored.'''
+
+    def __init__(self, deadline, callback, args, interval=None):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return "Timer(deadline=%.3f, callback=%r, interval=%r, cancelled=%r)" % (self.deadline, self.callback, self.interval, self.cancelled)
+
+
+class TimerQueue(object):
+    '''
+    | Heap of timers ordered by deadline.
+    | Callbacks are executed by run(), in the thread calling it, an exception raised by a callback is logged and
+    | does not prevent the other timers to run.
+    '''
+
+    def __init__(self):
+        self.heap = []
+        self.lock = Lock()
+        self.sequence = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def scheduleAt(self, deadline, callback, *args):
+        '''Registers a callback to call once at the given timestamp.'''
+        timer = Timer(deadline, callback, args)
+        self._push(timer)
+        return timer
+
+    def schedule(self, delay, callback, *args):
+        '''Registers a callback to call once after the given delay in seconds.'''
+        return self.scheduleAt(time.time() + delay, callback, *args)
+
+    def schedulePeriodic(self, interval, callback, *args, **kwargs):
+        '''
+        Registers a callback to call every "interval" seconds. The interval can be a callable returning the delay,
+        it is evaluated after each call so that a reloaded config value is taken into account.
+
+        :param first: delay before the first call, default is the interval
+        '''
+        first = kwargs.get('first', None)
+        if first is None:
+            first = self._interval(interval)
+        timer = Timer(time.time() + first, callback, args, interval)
+        self._push(timer)
+        return timer
+
+    def timeUntilNext(self, default=None):
+        '''Returns the delay before the next deadline (0 if it is already reached), or default if there is no timer.'''
+        with self.lock:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                return default
+            return max(0.0, self.heap[0][0] - time.time())
+
+    def run(self, now=None):
+        '''
+        Executes every callback whose deadline is reached and reschedules the periodic ones.
+
+        :return: the number of callbacks executed
+        '''
+        if now is None:
+            now = time.time()
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                timer = heapq.heappop(self.heap)[2]
+                if not timer.cancelled:
+                    due.append(timer)
+
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                LOGGER.exception("Error in timer callback %r" % timer)
+            if timer.interval is not None and not timer.cancelled:
+                interval = self._interval(timer.interval)
+                timer.deadline += interval
+                if timer.deadline < now:
+                    # late (e.g. a long callback), do not try to catch up the missed calls
+                    timer.deadline = time.time() + interval
+                self._push(timer)
+        return len(due)
+
+    def _push(self, timer):
+        with self.lock:
+            # the sequence number keeps the insertion order for identical deadlines and avoids comparing timers
+            heapq.heappush(self.heap, (timer.deadline, next(self.sequence), timer))
+
+    def _interval(self, interval):
+        return interval() if callable(interval) else interval
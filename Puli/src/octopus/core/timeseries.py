@@ -0,0 +1,295 @@
+"""
+Local time-series store for the statistics of the renderfarm (usage, queue and dispatcher stats).
+
+The samples are appended to fixed-width binary columns (little-endian float64), one file per field and per day,
+read back with memory maps. A range query only opens the days of the range and finds the rows with a binary
+search on the date column: it does not depend on the size of the history. The samples of a field missing in a
+record are NaN, so the fields may change over time (e.g. one field per prod in the queue stats).
+
+The mean of each field is also rolled up by 1 minute, 15 minutes and 1 hour buckets. A bucket is computed when a
+sample of a later bucket is appended, so that long ranges are displayed without reading every raw sample.
+
+Layout of the store directory::
+
+    <path>/raw/2014-04-02/@date.f8          dates of the samples of the day (UTC)
+    <path>/raw/2014-04-02/<field>.f8        values, the field name is url-quoted
+    <path>/1m/2014-04-02/...                rollups, the date is the start of the bucket
+    <path>/15m/...
+    <path>/1h/...
+
+Basic usage::
+
+    >>> store = TimeSeriesStore("/var/log/puli/usage_stats.tsdb")
+    >>> store.append(time.time(), flatten(stats))
+    >>> resolution = store.resolutionFor(startDate, endDate, 30)
+    >>> dates, columns = store.query(startDate, endDate, prefix="rendernodes/", resolution=resolution)
+
+Existing json logs (one dict per line, as written by grab_usage_stats and grab_queue_stats) can be imported with:
+    python -m octopus.core.timeseries <log file> <store directory> [date key]
+"""
+
+import os
+import time
+import math
+import logging
+import calendar
+from urllib import quote, unquote
+
+import numpy as np
+
+LOGGER = logging.getLogger("timeseries")
+
+DAY = 86400
+# rollup intervals in seconds and name of their directory
+ROLLUPS = ((60, '1m'), (900, '15m'), (3600, '1h'))
+RAW = 'raw'
+
+DTYPE = np.dtype('<f8')
+EXTENSION = '.f8'
+# the url-quoted field names never start with '@'
+DATE_COLUMN = '@date'
+
+
+def flatten(data, prefix=''):
+    '''
+    Returns the numeric values of nested dicts by path, e.g. {"total": {"jobs": 12}} gives {"total/jobs": 12}.
+    The other values (strings, lists...) are ignored.
+    '''
+    result = {}
+    for (key, value) in data.iteritems():
+        name = prefix + unicode(key).encode('utf8')
+        if isinstance(value, dict):
+            result.update(flatten(value, name + '/'))
+        elif isinstance(value, (int, long, float)):
+            result[name] = value
+    return result
+
+
+class TimeSeriesStore(object):
+    '''
+    | Append-only store, the samples must be appended in chronological order: a sample older than the last one of
+    | its day is ignored.
+    | A single process is expected to write in a store, any number of processes can read it.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # resolution -> start of the last bucket rolled up
+        self.lastRollups = {}
+
+    ## Write
+    #
+    def append(self, date, values):
+        '''Appends a sample, values is a dict of numbers by field name (see flatten()).'''
+        self.extend([(date, values)])
+
+    def extend(self, samples):
+        '''Appends a list of (date, values) samples.'''
+        if not samples:
+            return
+        samples = sorted(samples, key=lambda sample: sample[0])
+        first = 0
+        while first < len(samples):
+            day = int(samples[first][0] // DAY)
+            last = first
+            while last < len(samples) and int(samples[last][0] // DAY) == day:
+                last += 1
+            daySamples = samples[first:last]
+            fields = set()
+            for (date, values) in daySamples:
+                fields.update(values)
+            columns = {}
+            for field in fields:
+                columns[field] = np.array([values.get(field, np.nan) for (date, values) in daySamples], dtype=DTYPE)
+            self._write(RAW, day, np.array([date for (date, values) in daySamples], dtype=DTYPE), columns)
+            first = last
+        self._rollup(samples[-1][0])
+
+    def _write(self, level, day, dates, columns):
+        dayPath = self._dayPath(level, day)
+        if not os.path.isdir(dayPath):
+            os.makedirs(dayPath)
+        datePath = os.path.join(dayPath, DATE_COLUMN + EXTENSION)
+        count = os.path.getsize(datePath) // DTYPE.itemsize if os.path.exists(datePath) else 0
+        if count:
+            lastDate = np.memmap(datePath, dtype=DTYPE, mode='r')[count - 1]
+            keep = dates > lastDate
+            if not keep.all():
+                LOGGER.warning("%d samples older than %f ignored in %s" % (len(dates) - keep.sum(), lastDate, dayPath))
+                dates = dates[keep]
+                columns = dict((field, values[keep]) for (field, values) in columns.iteritems())
+        if not len(dates):
+            return
+
+        missing = np.empty(len(dates), dtype=DTYPE)
+        missing.fill(np.nan)
+        for field in set(self._dayFields(dayPath)) | set(columns):
+            path = self._columnPath(dayPath, field)
+            size = os.path.getsize(path) // DTYPE.itemsize if os.path.exists(path) else 0
+            with open(path, 'ab') as f:
+                # a new field is filled with NaN for the previous samples, the rows of an interrupted write are dropped
+                if size > count:
+                    f.truncate(count * DTYPE.itemsize)
+                elif size < count:
+                    padding = np.empty(count - size, dtype=DTYPE)
+                    padding.fill(np.nan)
+                    f.write(padding.tostring())
+                f.write(columns.get(field, missing).astype(DTYPE).tostring())
+        # the dates are written last: the number of dates is the number of complete rows
+        with open(datePath, 'ab') as f:
+            f.truncate(count * DTYPE.itemsize)
+            f.write(dates.tostring())
+
+    ## Rollups
+    #
+    def _rollup(self, upTo):
+        '''Computes the buckets of every rollup ended before the given date.'''
+        for (resolution, level) in ROLLUPS:
+            current = math.floor(upTo / resolution) * resolution
+            last = self._lastRollup(resolution, level)
+            if last is None:
+                days = self._days(RAW)
+                if not days:
+                    continue
+                start = math.floor(self._readDates(self._dayPath(RAW, days[0]))[0] / resolution) * resolution
+            else:
+                start = last + resolution
+            if start >= current:
+                continue
+
+            dates, columns = self.query(start, current)
+            if not len(dates):
+                continue
+            buckets = np.floor(dates / resolution) * resolution
+            indexes = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+            bucketDates = buckets[indexes]
+            means = {}
+            for (field, values) in columns.iteritems():
+                valid = ~np.isnan(values)
+                sums = np.add.reduceat(np.where(valid, values, 0.0), indexes)
+                counts = np.add.reduceat(valid.astype(np.int32), indexes)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    means[field] = sums / counts
+
+            days = (bucketDates // DAY).astype(np.int64)
+            for day in np.unique(days):
+                inDay = days == day
+                self._write(level, int(day), bucketDates[inDay], dict((field, mean[inDay]) for (field, mean) in means.iteritems()))
+            self.lastRollups[resolution] = bucketDates[-1]
+
+    def _lastRollup(self, resolution, level):
+        if resolution not in self.lastRollups:
+            days = self._days(level)
+            self.lastRollups[resolution] = self._readDates(self._dayPath(level, days[-1]))[-1] if days else None
+        return self.lastRollups[resolution]
+
+    ## Read
+    #
+    def resolutionFor(self, start, end, nbPoints):
+        '''Returns the largest rollup interval giving at least nbPoints samples in the range, None for the raw samples.'''
+        step = (end - start) / float(max(nbPoints, 1))
+        best = None
+        for (resolution, level) in ROLLUPS:
+            if resolution <= step:
+                best = resolution
+        return best
+
+    def query(self, start, end, fields=None, prefix=None, resolution=None):
+        '''
+        Returns the samples dated in [start, end).
+
+        :param fields: names of the fields to read, default is every field
+        :param prefix: only reads the fields starting with this prefix
+        :param resolution: interval of a rollup (60, 900 or 3600), default is the raw samples
+        :return: a (dates, {field: values}) tuple of numpy arrays, the values missing in a sample are NaN
+        '''
+        level = RAW if resolution is None else dict(ROLLUPS)[resolution]
+        days = []
+        for day in xrange(int(start // DAY), int(math.ceil(end / float(DAY)))):
+            dayPath = self._dayPath(level, day)
+            if not os.path.isdir(dayPath):
+                continue
+            dates = self._readDates(dayPath)
+            first, last = np.searchsorted(dates, [start, end])
+            if first == last:
+                continue
+            dayFields = self._dayFields(dayPath)
+            if fields is not None:
+                dayFields = [field for field in dayFields if field in fields]
+            if prefix is not None:
+                dayFields = [field for field in dayFields if field.startswith(prefix)]
+            columns = {}
+            for field in dayFields:
+                columns[field] = np.array(np.memmap(self._columnPath(dayPath, field), dtype=DTYPE, mode='r', shape=(len(dates),))[first:last])
+            days.append((np.array(dates[first:last]), columns))
+
+        if not days:
+            return np.empty(0, dtype=DTYPE), dict((field, np.empty(0, dtype=DTYPE)) for field in fields or ())
+        allFields = set(fields or ())
+        for (dates, columns) in days:
+            allFields.update(columns)
+        result = {}
+        for field in allFields:
+            parts = []
+            for (dates, columns) in days:
+                if field in columns:
+                    parts.append(columns[field])
+                else:
+                    part = np.empty(len(dates), dtype=DTYPE)
+                    part.fill(np.nan)
+                    parts.append(part)
+            result[field] = np.concatenate(parts)
+        return np.concatenate([dates for (dates, columns) in days]), result
+
+    ## Files
+    #
+    def _dayPath(self, level, day):
+        return os.path.join(self.path, level, time.strftime("%Y-%m-%d", time.gmtime(day * DAY)))
+
+    def _days(self, level):
+        levelPath = os.path.join(self.path, level)
+        if not os.path.isdir(levelPath):
+            return []
+        return sorted(calendar.timegm(time.strptime(name, "%Y-%m-%d")) // DAY for name in os.listdir(levelPath))
+
+    def _columnPath(self, dayPath, field):
+        return os.path.join(dayPath, quote(field, safe='') + EXTENSION)
+
+    def _dayFields(self, dayPath):
+        return [unquote(name[:-len(EXTENSION)]) for name in os.listdir(dayPath)
+                if name.endswith(EXTENSION) and not name.startswith('@')]
+
+    def _readDates(self, dayPath):
+        datePath = os.path.join(dayPath, DATE_COLUMN + EXTENSION)
+        count = os.path.getsize(datePath) // DTYPE.itemsize if os.path.exists(datePath) else 0
+        if not count:
+            return np.empty(0, dtype=DTYPE)
+        return np.memmap(datePath, dtype=DTYPE, mode='r', shape=(count,))
+
+
+def importJsonLog(logPath, store, dateKey=None, batchSize=10000):
+    '''Appends the samples of a json log (one dict per line) to a store, the date is given by "date" or "requestDate".'''
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
+
+    samples = []
+    with open(logPath) as f:
+        for line in f:
+            data = json.loads(line)
+            key = dateKey or ('date' if 'date' in data else 'requestDate')
+            date = data.pop(key)
+            samples.append((date, flatten(data)))
+            if len(samples) == batchSize:
+                store.extend(samples)
+                samples = []
+    store.extend(samples)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 3:
+        print "usage: python -m octopus.core.timeseries <log file> <store directory> [date key]"
+        sys.exit(1)
+    importJsonLog(sys.argv[1], TimeSeriesStore(sys.argv[2]), *sys.argv[3:4])
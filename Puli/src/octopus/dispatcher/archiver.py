@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Archiving of the finished jobs, built in the dispatcher (it replaces the daily scripts/util/jobcleaner.py cron).
+
+Every CORE.ARCHIVE_SCAN_INTERVAL seconds, the jobs done or canceled for more than CORE.ARCHIVE_RETENTION days are
+queued (found with the finish time index of the jobs, see JobIndex.finishTime). The jobs given to /tasks/delete are
+queued too.
+
+Each dispatcher cycle archives the queued jobs until CORE.ARCHIVE_BATCH_SIZE commands have been archived (at least
+one job): the jobs are removed from the dispatch tree, and marked as archived in the database by the updateDB stage
+of the same cycle with UPDATE ... WHERE id IN (...) statements of at most CORE.DB_CHUNK_SIZE ids. Cleaning a large
+backlog is spread over many cycles instead of stalling the dispatch.
+'''
+
+import time
+import logging
+from collections import deque
+
+from octopus.core import singletonconfig
+from octopus.core.enums.node import NODE_DONE, NODE_CANCELED
+from octopus.dispatcher.model import TaskGroup
+
+LOGGER = logging.getLogger('dispatcher.archiver')
+
+ALLOWED_STATUS_VALUES = (NODE_DONE, NODE_CANCELED)
+
+
+class Archiver(object):
+    '''
+    | Called by the dispatcher at each cycle (step), on the IOLoop thread like the webservices queuing the jobs.
+    '''
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        # ids of the tasks (or taskgroups) to archive, in order
+        self.queue = deque()
+        self.queued = set()
+        self.lastScan = 0.0
+        self.archivedJobs = 0
+
+    def enqueue(self, taskIds):
+        '''Queues tasks to archive, returns the number of tasks added to the queue.'''
+        count = 0
+        for taskId in taskIds:
+            if taskId not in self.queued:
+                self.queued.add(taskId)
+                self.queue.append(taskId)
+                count += 1
+        return count
+
+    def scan(self):
+        '''Queues the jobs finished for more than the retention delay, returns the number of queued jobs.'''
+        self.lastScan = time.time()
+        limit = self.lastScan - singletonconfig.get('CORE', 'ARCHIVE_RETENTION', 7) * 86400
+        jobIndex = self.dispatcher.dispatchTree.jobIndex
+        taskIds = []
+        # only the done and canceled jobs have a finish time
+        for node in jobIndex.getNodes(jobIndex.idsBefore('finishTime', limit)):
+            task = getattr(node, 'task', None) or getattr(node, 'taskGroup', None)
+            if task is not None:
+                taskIds.append(task.id)
+        count = self.enqueue(taskIds)
+        if count:
+            LOGGER.info("%d jobs finished for more than %s days queued for archiving" % (count, singletonconfig.get('CORE', 'ARCHIVE_RETENTION', 7)))
+        return count
+
+    def step(self):
+        '''Archives a batch of queued jobs, returns the number of archived jobs.'''
+        if singletonconfig.get('CORE', 'ARCHIVE_ENABLED', False) and \
+                time.time() - self.lastScan >= singletonconfig.get('CORE', 'ARCHIVE_SCAN_INTERVAL', 600):
+            self.scan()
+        if not self.queue:
+            return 0
+
+        batchSize = singletonconfig.get('CORE', 'ARCHIVE_BATCH_SIZE', 20000)
+        tasks = self.dispatcher.dispatchTree.tasks
+        archived = 0
+        archivedCommands = 0
+        while self.queue:
+            taskId = self.queue[0]
+            task = tasks.get(taskId)
+            if task is None:
+                LOGGER.warning("Trying to archive task %s that no longer exists." % str(taskId))
+            elif not task.nodes or task.nodes.values()[0].status not in ALLOWED_STATUS_VALUES:
+                LOGGER.warning("Preventing archiving of task %s [Bad status]." % str(taskId))
+            else:
+                # the commands of a cold job are loaded back to be archived with the job
+                self.dispatcher.coldStorage.thawTask(task)
+                commandCount = self.countCommands(task)
+                if archived and archivedCommands + commandCount > batchSize:
+                    break
+                task.archive()
+                archived += 1
+                archivedCommands += commandCount
+            self.queue.popleft()
+            self.queued.discard(taskId)
+
+        self.archivedJobs += archived
+        if archived:
+            LOGGER.info("archived %d jobs (%d commands), %d jobs remaining in the queue" % (archived, archivedCommands, len(self.queue)))
+        return archived
+
+    def countCommands(self, task):
+        if isinstance(task, TaskGroup):
+            return sum(self.countCommands(child) for child in task.tasks)
+        return len(task.commands)
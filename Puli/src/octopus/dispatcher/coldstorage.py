@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Release from memory the commands of the finished jobs, the memory of the dispatcher follows the active work instead
+of the history kept until the archiving (see octopus.dispatcher.archiver).
+
+Every CORE.COLD_SCAN_INTERVAL seconds, the jobs done or canceled for more than CORE.COLD_DELAY hours are queued
+(found with the finish time index of the jobs, see JobIndex.finishTime). Each dispatcher cycle makes queued jobs
+"cold", until CORE.COLD_BATCH_SIZE commands have been released (at least one job): the Command objects of their tasks
+are removed from the tasks, the commands of the dispatch tree and the command store.
+
+The nodes of a cold job stay in the tree as its summary: name, user, tags, times, status, completion and command
+counters are unchanged for the clients and the queries, and the cycles no longer update the completion of the job
+(see FolderNode.updateCompletionAndStatus). The commands are loaded back from the database when they are needed: a
+client asks for the commands, the job is restarted or archived. A job brought back stays in memory until the next
+scan at least.
+
+The commands are read back from the database, so the cold jobs are only enabled with the database (DB_ENABLE).
+'''
+
+import time
+import logging
+from collections import deque
+
+from octopus.core import singletonconfig
+from octopus.core.enums.node import NODE_DONE, NODE_CANCELED
+from octopus.core.enums.command import isFinalStatus
+from octopus.dispatcher import settings
+from octopus.dispatcher.model import TaskGroup
+
+LOGGER = logging.getLogger('dispatcher.coldstorage')
+
+ALLOWED_STATUS_VALUES = (NODE_DONE, NODE_CANCELED)
+
+
+class ColdStorage(object):
+    '''
+    | Called by the dispatcher at each cycle (step) after the update of the database, on the IOLoop thread like the
+    | webservices bringing the commands back (thaw).
+    '''
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        # ids of the job nodes to make cold, in order
+        self.queue = deque()
+        self.queued = set()
+        # ids of the tasks of each cold job, by job node id
+        self.jobs = {}
+        self.lastScan = 0.0
+        self.releasedCommands = 0
+        self.loadedCommands = 0
+
+    def isEnabled(self):
+        return settings.DB_ENABLE and singletonconfig.get('CORE', 'COLD_ENABLED', False)
+
+    def scan(self):
+        '''Queues the jobs finished for more than the cold delay, returns the number of queued jobs.'''
+        self.lastScan = time.time()
+        limit = self.lastScan - singletonconfig.get('CORE', 'COLD_DELAY', 24) * 3600
+        count = 0
+        # only the done and canceled jobs have a finish time
+        for jobId in self.dispatcher.dispatchTree.jobIndex.idsBefore('finishTime', limit):
+            if jobId not in self.jobs and jobId not in self.queued:
+                self.queued.add(jobId)
+                self.queue.append(jobId)
+                count += 1
+        if count:
+            LOGGER.info("%d jobs finished for more than %s hours queued to be released from memory" % (count, singletonconfig.get('CORE', 'COLD_DELAY', 24)))
+        return count
+
+    def step(self):
+        '''Releases the commands of a batch of queued jobs, returns the number of jobs made cold.'''
+        if not self.isEnabled():
+            return 0
+        if time.time() - self.lastScan >= singletonconfig.get('CORE', 'COLD_SCAN_INTERVAL', 600):
+            self.scan()
+        if not self.queue:
+            return 0
+
+        batchSize = singletonconfig.get('CORE', 'COLD_BATCH_SIZE', 20000)
+        nodes = self.dispatcher.dispatchTree.nodes
+        frozen = 0
+        releasedCommands = 0
+        while self.queue:
+            jobId = self.queue[0]
+            job = nodes.get(jobId)
+            if job is not None and job.status in ALLOWED_STATUS_VALUES and jobId not in self.jobs:
+                tasks = self.getTasks(job)
+                commandCount = sum(len(task.commands) for task in tasks)
+                if frozen and releasedCommands + commandCount > batchSize:
+                    break
+                if self.freeze(job, tasks):
+                    frozen += 1
+                    releasedCommands += commandCount
+            self.queue.popleft()
+            self.queued.discard(jobId)
+
+        self.releasedCommands += releasedCommands
+        if frozen:
+            LOGGER.info("released %d commands of %d jobs, %d cold jobs, %d jobs remaining in the queue" % (releasedCommands, frozen, len(self.jobs), len(self.queue)))
+        return frozen
+
+    def freeze(self, job, tasks):
+        '''Releases the commands of the tasks of a job, returns False if a command is not finished.'''
+        for task in tasks:
+            for command in task.commands:
+                if not isFinalStatus(command.status):
+                    LOGGER.warning("Preventing release of job %d [command %d not finished]." % (job.id, command.id))
+                    return False
+
+        tree = self.dispatcher.dispatchTree
+        for task in tasks:
+            for command in task.commands:
+                del tree.commands[command.id]
+                tree.commandStore.remove(command)
+            task.commands = []
+        self.jobs[job.id] = [task.id for task in tasks]
+        job.cold = True
+        return True
+
+    def thaw(self, node):
+        '''Loads back the commands of the job of a node if it is cold, returns True if the commands were loaded.'''
+        if not self.jobs:
+            return False
+        folder = self.dispatcher.dispatchTree.jobIndex.folder
+        while node is not None and node.parent is not folder:
+            node = node.parent
+        if node is None or not node.cold:
+            return False
+
+        start = time.time()
+        tree = self.dispatcher.dispatchTree
+        tasks = [tree.tasks[taskId] for taskId in self.jobs.pop(node.id) if taskId in tree.tasks]
+        commandsByTask = self.dispatcher.pulidb.loadCommands(tasks, tree.renderNodes.values())
+        count = 0
+        for task in tasks:
+            task.commands = commandsByTask.get(task.id, [])
+            count += len(task.commands)
+        node.cold = False
+        self.loadedCommands += count
+        LOGGER.info("loaded %d commands of job %d in %.1f ms" % (count, node.id, (time.time() - start) * 1000))
+        return True
+
+    def thawTask(self, task):
+        '''Loads back the commands of the job of a task (or taskgroup) if it is cold.'''
+        if not self.jobs or not task.nodes:
+            return False
+        return self.thaw(task.nodes.values()[0])
+
+    def thawCommand(self, commandId):
+        '''
+        Loads back the commands of the job of a command released from memory, returns True if the command is in the
+        dispatch tree.
+        '''
+        if commandId in self.dispatcher.dispatchTree.commands:
+            return True
+        if not self.jobs:
+            return False
+        task = self.dispatcher.dispatchTree.tasks.get(self.dispatcher.pulidb.getCommandTaskId(commandId))
+        return task is not None and self.thawTask(task) and commandId in self.dispatcher.dispatchTree.commands
+
+    def getTasks(self, job):
+        '''Returns the tasks of a job, the taskgroups are not returned.'''
+        tasks = []
+        stack = [getattr(job, 'task', None) or getattr(job, 'taskGroup', None)]
+        while stack:
+            task = stack.pop()
+            if task is None:
+                continue
+            if isinstance(task, TaskGroup):
+                stack.extend(task.tasks)
+            else:
+                tasks.append(task)
+        return tasks
@@ -24,11 +24,12 @@ except ImportError:
     import json
 
 from octopus.dispatcher.model.node import FolderNode, TaskNode
-from octopus.dispatcher.model.task import Task, TaskGroup
+from octopus.dispatcher.model.task import Task, TaskGroup, PendingCommands
 from octopus.dispatcher.model.command import Command
 from octopus.dispatcher.model.rendernode import RenderNode
 from octopus.dispatcher.model.pool import Pool, PoolShare
 from octopus.dispatcher.strategies import createStrategyInstance
+from octopus.core import singletonconfig
 
 LOGGER = logging.getLogger('dispatcher')
 
@@ -130,6 +131,9 @@ class Tasks(SQLObject):
     # Adding autoretry capability on task
     maxAttempt = IntCol()
 
+    # Commands of a command range not created yet (see model.task.PendingCommands)
+    pendingCommands = UnicodeCol()
+
 
 class Commands(SQLObject):
     class sqlmeta:
@@ -196,6 +200,18 @@ def createTables():
     RenderNodes.createTable(ifNotExists=True)
 
 
+def migrateTables():
+    '''Adds to the tables of an existing database the columns added since its creation.'''
+    for (table, columnName) in ((Tasks, 'pendingCommands'),):
+        conn = table._connection
+        column = table.sqlmeta.columns[columnName]
+        try:
+            conn.queryAll("SELECT %s FROM %s WHERE 1 = 0" % (column.dbName, table.sqlmeta.table))
+        except Exception:
+            LOGGER.warning("adding column %s to table %s" % (column.dbName, table.sqlmeta.table))
+            conn.addColumn(table.sqlmeta.table, column)
+
+
 def dropTables():
     Dependencies.dropTable(ifExists=True)
     FolderNodes.dropTable(ifExists=True)
@@ -221,6 +237,7 @@ class PuliDB(object):
         # create the tables, if necessary
         LOGGER.info("checking database")
         createTables()
+        migrateTables()
         self.licenseManager = licManager
 
     def dropPoolsAndRnsTables(self):
@@ -352,7 +369,8 @@ class PuliDB(object):
                           Tasks.q.validationExpression.fieldName: element.validationExpression,
                           Tasks.q.archived.fieldName: False,
                           Tasks.q.args.fieldName: str(element.arguments),
-                          Tasks.q.maxAttempt.fieldName: element.maxAttempt
+                          Tasks.q.maxAttempt.fieldName: element.maxAttempt,
+                          Tasks.q.pendingCommands.fieldName: self.getPendingCommandsJSON(element)
                           }
                 conn.query(conn.sqlrepr(Insert(Tasks.q, values=fields)))
                 conn.cache.clear()
@@ -499,7 +517,8 @@ class PuliDB(object):
               if element.id:
                   conn = Tasks._connection
                   fields = { Tasks.q.tags.fieldName: json.dumps(element.tags),
-                            Tasks.q.maxAttempt.fieldName: str(element.maxAttempt) }
+                            Tasks.q.maxAttempt.fieldName: str(element.maxAttempt),
+                            Tasks.q.pendingCommands.fieldName: self.getPendingCommandsJSON(element) }
                   conn.query(conn.sqlrepr(Update(Tasks.q, values=fields, where=(Tasks.q.id == element.id))))
                   conn.cache.clear()
 
@@ -552,64 +571,108 @@ class PuliDB(object):
         # del elements
 
         # /////////////// Handling of the Tasks
-        if len(tasksList):
-            conn = Tasks._connection
-            sqlrepr = conn.sqlrepr(Update(Tasks.q, values={Tasks.q.archived.fieldName: True}, where=IN(Tasks.q.id, tasksList)))
-            conn.query(sqlrepr)
-            conn.cache.clear()
+        self.archiveByIds(Tasks, Tasks.q.id, tasksList)
         # /////////////// Handling of the TaskGroups
-        if len(taskgroupsList):
-            conn = TaskGroups._connection
-            conn.query(conn.sqlrepr(Update(TaskGroups.q, values={TaskGroups.q.archived.fieldName: True}, where=IN(TaskGroups.q.id, taskgroupsList))))
-            conn.cache.clear()
+        self.archiveByIds(TaskGroups, TaskGroups.q.id, taskgroupsList)
         # /////////////// Handling of the Commands
-        if len(commandsList):
-            conn = Commands._connection
-            conn.query(conn.sqlrepr(Update(Commands.q, values={Commands.q.archived.fieldName: True}, where=IN(Commands.q.id, commandsList))))
-            conn.cache.clear()
+        self.archiveByIds(Commands, Commands.q.id, commandsList)
         # /////////////// Handling of the TaskNodes
-        if len(taskNodesList):
-            conn = TaskNodes._connection
-            sqlrepr = conn.sqlrepr(Update(TaskNodes.q, values={TaskNodes.q.archived.fieldName: True}, where=IN(TaskNodes.q.id, taskNodesList)))
-            conn.query(sqlrepr)
-            conn.cache.clear()
-            conn = PoolShares._connection
-            conn.query(conn.sqlrepr(Update(PoolShares.q, values={PoolShares.q.archived.fieldName: True}, where=IN(PoolShares.q.nodeId, taskNodesList))))
-            conn.cache.clear()
+        self.archiveByIds(TaskNodes, TaskNodes.q.id, taskNodesList)
+        self.archiveByIds(PoolShares, PoolShares.q.nodeId, taskNodesList)
         # /////////////// Handling of the FolderNodes
-        if len(folderNodesList):
-            conn = FolderNodes._connection
-            conn.query(conn.sqlrepr(Update(FolderNodes.q, values={FolderNodes.q.archived.fieldName: True}, where=IN(FolderNodes.q.id, folderNodesList))))
-            conn.cache.clear()
-            conn = PoolShares._connection
-            conn.query(conn.sqlrepr(Update(PoolShares.q, values={PoolShares.q.archived.fieldName: True}, where=IN(PoolShares.q.nodeId, folderNodesList))))
-            conn.cache.clear()
+        self.archiveByIds(FolderNodes, FolderNodes.q.id, folderNodesList)
+        self.archiveByIds(PoolShares, PoolShares.q.nodeId, folderNodesList)
         # /////////////// Handling of the Pools
-        if len(poolsList):
-            conn = Pools._connection
-            conn.query(conn.sqlrepr(Update(Pools.q, values={Pools.q.archived.fieldName: True}, where=IN(Pools.q.id, poolsList))))
-            conn.cache.clear()
-            conn = PoolShares._connection
-            conn.query(conn.sqlrepr(Update(PoolShares.q, values={PoolShares.q.archived.fieldName: True}, where=IN(PoolShares.q.poolId, poolsList))))
-            conn.cache.clear()
+        self.archiveByIds(Pools, Pools.q.id, poolsList)
+        self.archiveByIds(PoolShares, PoolShares.q.poolId, poolsList)
         # /////////////// Handling of the PoolShares
-        if len(poolsharesList):
-            conn = PoolShares._connection
-            sqlrepr = conn.sqlrepr(Update(PoolShares.q, values={PoolShares.q.archived.fieldName: True}, where=IN(PoolShares.q.id, poolsharesList)))
-            conn.query(sqlrepr)
-            conn.cache.clear()
+        self.archiveByIds(PoolShares, PoolShares.q.id, poolsharesList)
         # /////////////// Handling of the RenderNodes
         if len(rendernodesList):
             conn = RenderNodes._connection
-            conn.query(conn.sqlrepr(Delete(RenderNodes.q, where=IN(RenderNodes.q.id, rendernodesList))))
+            for ids in self.chunks(rendernodesList):
+                conn.query(conn.sqlrepr(Delete(RenderNodes.q, where=IN(RenderNodes.q.id, ids))))
             conn.cache.clear()
 
+    ## Sets the archived flag of the rows of a table whose column is in the given ids.
+    # The ids are sent by chunks of CORE.DB_CHUNK_SIZE to keep the IN (...) clauses of a reasonable size.
+    #
+    def archiveByIds(self, table, column, ids):
+        if not len(ids):
+            return
+        conn = table._connection
+        for chunk in self.chunks(ids):
+            conn.query(conn.sqlrepr(Update(table.q, values={table.q.archived.fieldName: True}, where=IN(column, chunk))))
+        conn.cache.clear()
+
+    def chunks(self, ids):
+        chunkSize = singletonconfig.get('CORE', 'DB_CHUNK_SIZE', 1000)
+        for first in xrange(0, len(ids), chunkSize):
+            yield ids[first:first + chunkSize]
+
+    def getPendingCommandsJSON(self, task):
+        if task.pendingCommands is None:
+            return None
+        return json.dumps(task.pendingCommands.to_json())
+
     def getDateFromTimeStamp(self, timeStamp):
         return datetime.datetime.fromtimestamp(timeStamp) if timeStamp else None
 
     def getTimeStampFromDate(self, date):
         return time.mktime(date.timetuple()) if date else None
 
+    ## Reloads the commands of tasks whose commands were released from memory (see octopus.dispatcher.coldstorage).
+    # The commands are registered in the dispatch tree by their creation event, like the restored ones.
+    # @return the lists of commands by task id
+    #
+    def loadCommands(self, tasks, renderNodes):
+        tasksById = dict((task.id, task) for task in tasks)
+        rnById = dict((renderNode.id, renderNode) for renderNode in renderNodes)
+        commandsByTask = defaultdict(list)
+        conn = Commands._connection
+        fields = [Commands.q.id,
+                  Commands.q.description,
+                  Commands.q.taskId,
+                  Commands.q.status,
+                  Commands.q.completion,
+                  Commands.q.creationTime,
+                  Commands.q.startTime,
+                  Commands.q.updateTime,
+                  Commands.q.endTime,
+                  Commands.q.assignedRNId,
+                  Commands.q.message,
+                  Commands.q.stats,
+                  Commands.q.args,
+                  Commands.q.attempt
+                  ]
+        for ids in self.chunks(sorted(tasksById)):
+            where = AND(IN(Commands.q.taskId, ids), Commands.q.archived == False)
+            for dbCmd in conn.queryAll(conn.sqlrepr(Select(fields, where=where, orderBy=Commands.q.id))):
+                id, description, taskId, status, completion, creationTime, startTime, updateTime, endTime, assignedRNId, message, stats, args, attempt = dbCmd
+                command = Command(id,
+                                  description,
+                                  tasksById[taskId],
+                                  eval(args or "{}"),
+                                  status,
+                                  completion,
+                                  rnById.get(assignedRNId, None),
+                                  self.getTimeStampFromDate(creationTime),
+                                  self.getTimeStampFromDate(startTime),
+                                  self.getTimeStampFromDate(updateTime),
+                                  self.getTimeStampFromDate(endTime),
+                                  attempt=attempt,
+                                  stats=eval(stats or "{}"),
+                                  message=message)
+                commandsByTask[taskId].append(command)
+        return commandsByTask
+
+    ## @return the id of the task of a command, None if the command does not exist or is archived
+    #
+    def getCommandTaskId(self, commandId):
+        conn = Commands._connection
+        rows = conn.queryAll(conn.sqlrepr(Select([Commands.q.taskId], where=AND(Commands.q.id == int(commandId), Commands.q.archived == False))))
+        return rows[0][0] if rows else None
+
     ## Restores the state of the dispatcher from the database.
     # @var tree the DispatchTree instance.
     #
@@ -888,13 +951,18 @@ class PuliDB(object):
                   Tasks.q.validationExpression,
                   Tasks.q.archived,
                   Tasks.q.args,
-                  Tasks.q.maxAttempt]
+                  Tasks.q.maxAttempt,
+                  Tasks.q.pendingCommands]
         tasks = conn.queryAll(conn.sqlrepr(Select(fields, where=(Tasks.q.archived == False))))
         for num, dbTask in enumerate(tasks):
-            id, name, parentId, user, priority, dispatchKey, maxRN, runner, environment, requirements, minNbCores, maxNbCores, ramUse, licence, tags, validationExpression, archived, args, maxAttempt = dbTask
+            id, name, parentId, user, priority, dispatchKey, maxRN, runner, environment, requirements, minNbCores, maxNbCores, ramUse, licence, tags, validationExpression, archived, args, maxAttempt, pendingCommands = dbTask
             taskCmds = []
             if args is None:
                 args = '{}'
+            if pendingCommands:
+                pendingCommands = PendingCommands.from_json(json.loads(pendingCommands))
+            else:
+                pendingCommands = None
             # get the commands associated to this task
             taskCmds = cmdTaskIdList[id]
             realTask = Task(id,
@@ -916,7 +984,8 @@ class PuliDB(object):
                             {},
                             licence,
                             json.loads(tags), 
-                            maxAttempt=maxAttempt)
+                            maxAttempt=maxAttempt,
+                            pendingCommands=pendingCommands)
             tree.tasks[realTask.id] = realTask
             realTasksList[realTask.id] = realTask
             # set the task on the appropriate commands
@@ -30,9 +30,15 @@ from octopus.dispatcher.strategies import FifoStrategy
 from octopus.dispatcher import settings
 from octopus.dispatcher.db.pulidb import PuliDB
 from octopus.dispatcher.model.enums import *
+from octopus.dispatcher.model.command import COMMAND_TIMERS
+from octopus.dispatcher.model.capacity import AVAILABLE_STATUS, ONLINE_STATUS
+from octopus.dispatcher.graphsubmitter import GraphSubmitter
+from octopus.dispatcher.archiver import Archiver
+from octopus.dispatcher.coldstorage import ColdStorage
 from octopus.dispatcher.poolman.filepoolman import FilePoolManager
 from octopus.dispatcher.poolman.wspoolman import WebServicePoolManager
 from octopus.dispatcher.licenses.licensemanager import LicenseManager
+from octopus.dispatcher.profiler import theProfiler
 
 
 LOGGER = logging.getLogger('dispatcher')
@@ -78,6 +84,8 @@ class Dispatcher(MainLoopApplication):
         self.pulidb = None
         if self.enablePuliDB:
             self.pulidb = PuliDB(self.cleanDB, self.licenseManager)
+        # commands of the finished jobs released from memory, needed by the nodes from the start
+        self.coldStorage = ColdStorage(self)
 
         self.dispatchTree.registerModelListeners()
         rnsAlreadyInitialized = self.initPoolsDataFromBackend()
@@ -89,6 +97,8 @@ class Dispatcher(MainLoopApplication):
             LOGGER.warning("reloading took %.2fs" % (time.time() - beginTime))
             LOGGER.warning("done reloading jobs from database")
             LOGGER.warning("reloaded %d tasks" % len(self.dispatchTree.tasks))
+            # nodes are reparented without change events during the reload
+            self.dispatchTree.jobIndex.rebuild()
         LOGGER.warning("checking dispatcher state")
 
         self.dispatchTree.updateCompletionAndStatus()
@@ -97,6 +107,9 @@ class Dispatcher(MainLoopApplication):
         if self.enablePuliDB and not self.cleanDB:
             self.dispatchTree.toModifyElements = []
 
+        # the reloaded state is the initial snapshot of the clients, only the following changes are recorded
+        self.dispatchTree.changeFeed.registerModelListeners()
+
         # If no 'default' pool exists, create default pool
         if 'default' not in self.dispatchTree.pools:
             newId = len(self.dispatchTree.pools)+1
@@ -106,6 +119,10 @@ class Dispatcher(MainLoopApplication):
 
         LOGGER.warning("loading dispatch rules")
         self.loadRules()
+        # registration of the submitted graphs in the background
+        self.graphSubmitter = GraphSubmitter(self)
+        # archiving of the finished jobs by batches
+        self.archiver = Archiver(self)
         # it should be better to have a maxsize
         self.queue = Queue(maxsize=10000)
 
@@ -190,6 +207,7 @@ class Dispatcher(MainLoopApplication):
                     self.dispatchTree.toCreateElements or
                     self.dispatchTree.toModifyElements)
 
+    @theProfiler.profiled("mainLoop")
     def mainLoop(self):
         '''
         | Dispatcher main loop iteration.
@@ -203,7 +221,12 @@ class Dispatcher(MainLoopApplication):
         |   - release all finished jobs/rns
         '''
         
-        # JSA DEBUG: timer pour profiler les etapes       
+        # The dispatch tree must not be used while a graph is partially registered, the cycle is run again
+        # as soon as the registration is finished
+        if self.graphSubmitter.registering:
+            LOGGER.info("Graph registration in progress, cycle postponed")
+            self.graphSubmitter.cyclePostponed = True
+            return
 
         loopStartTime = time.time()
         prevTimer = loopStartTime
@@ -227,59 +250,55 @@ class Dispatcher(MainLoopApplication):
 
         self.cycle += 1
 
+        # Delayed actions on commands whose deadline is reached (i.e. autoretry)
+        COMMAND_TIMERS.run()
+
         # Update of allocation is done when parsing the tree for completion and status update (done partially for invalidated node only i.e. when needed)
-        self.dispatchTree.updateCompletionAndStatus()
-        if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['update_tree'] = time.time() - prevTimer
-        LOGGER.info("%8.2f ms --> update completion status" % ( (time.time() - prevTimer)*1000 ) )
-        prevTimer = time.time()
+        with theProfiler.span("updateCompletionAndStatus"):
+            self.dispatchTree.updateCompletionAndStatus()
+        prevTimer = self.endStage(prevTimer, 'update_tree', "update completion status")
 
         # Update render nodes
-        self.updateRenderNodes()
-        if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['update_rn'] = time.time() - prevTimer
-        LOGGER.info("%8.2f ms --> update render node" % ( (time.time() - prevTimer)*1000 ) )
-        prevTimer = time.time()
+        with theProfiler.span("updateRenderNodes"):
+            self.updateRenderNodes()
+        prevTimer = self.endStage(prevTimer, 'update_rn', "update render node")
 
         # Validate dependencies
-        self.dispatchTree.validateDependencies()
-        if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['update_dependencies'] = time.time() - prevTimer
-        LOGGER.info("%8.2f ms --> validate dependencies" % ( (time.time() - prevTimer)*1000 ) )
-        prevTimer = time.time()
+        with theProfiler.span("validateDependencies"):
+            self.dispatchTree.validateDependencies()
+        prevTimer = self.endStage(prevTimer, 'update_dependencies', "validate dependencies")
 
+        # remove a batch of finished jobs from the tree, they are archived in the db by updateDB
+        with theProfiler.span("archive"):
+            self.archiver.step()
 
         # update db
-        self.updateDB()
-        if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['update_db'] = time.time() - prevTimer
-        LOGGER.info("%8.2f ms --> update DB" % ( (time.time() - prevTimer)*1000 ) )
-        prevTimer = time.time()
+        with theProfiler.span("updateDB"):
+            self.updateDB()
+        prevTimer = self.endStage(prevTimer, 'update_db', "update DB")
+
+        # release the commands of a batch of old finished jobs, all their changes are in the db now
+        with theProfiler.span("coldStorage"):
+            self.coldStorage.step()
 
         # compute and send command assignments to rendernodes
-        assignments = self.computeAssignments()
-        if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['compute_assignment'] = time.time() - prevTimer
-        LOGGER.info("%8.2f ms --> compute assignments." % ( (time.time() - prevTimer)*1000)  )
-        prevTimer = time.time()
+        with theProfiler.span("computeAssignments"):
+            assignments = self.computeAssignments()
+        prevTimer = self.endStage(prevTimer, 'compute_assignment', "compute assignments.")
 
-        self.sendAssignments(assignments)
+        with theProfiler.span("sendAssignments"):
+            self.sendAssignments(assignments)
         if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['send_assignment'] = time.time() - prevTimer
             singletonstats.theStats.cycleCounts['num_assignments'] = len(assignments)
-        LOGGER.info("%8.2f ms --> send %r assignments." % ( (time.time() - prevTimer)*1000, len(assignments) )  )
-        prevTimer = time.time()
+        prevTimer = self.endStage(prevTimer, 'send_assignment', "send %d assignments.", len(assignments))
 
         # call the release finishing status on all rendernodes
-        for renderNode in self.dispatchTree.renderNodes.values():
-            renderNode.releaseFinishingStatus()
-        if singletonconfig.get('CORE','GET_STATS'):
-            singletonstats.theStats.cycleTimers['release_finishing'] = time.time() - prevTimer
-        LOGGER.info("%8.2f ms --> releaseFinishingStatus" % ( (time.time() - prevTimer)*1000 ) )
-        prevTimer = time.time()
+        with theProfiler.span("releaseFinishingStatus"):
+            for renderNode in self.dispatchTree.renderNodes.values():
+                renderNode.releaseFinishingStatus()
+        prevTimer = self.endStage(prevTimer, 'release_finishing', "releaseFinishingStatus")
 
-        loopDuration = (time.time() - loopStartTime)*1000
-        LOGGER.info( "%8.2f ms --> cycle ended. " % loopDuration )
+        LOGGER.info("%8.2f ms --> cycle ended. ", (time.time() - loopStartTime) * 1000)
         LOGGER.info("-----------------------------------------------------")
 
         # TODO: process average and sums of datas in stats, if flush time, send it to disk
@@ -287,7 +306,19 @@ class Dispatcher(MainLoopApplication):
             singletonstats.theStats.cycleTimers['time_elapsed'] = time.time() - loopStartTime
             singletonstats.theStats.aggregate()
 
+        # a graph submitted during the cycle can now be registered
+        self.graphSubmitter.onCycleEnd()
+
+
 
+    def endStage(self, prevTimer, statsKey, description, *args):
+        '''Records the duration of a stage of the cycle in the stats and the log, returns the start time of the next stage.'''
+        now = time.time()
+        if singletonconfig.get('CORE','GET_STATS'):
+            singletonstats.theStats.cycleTimers[statsKey] = now - prevTimer
+        # the message is only formatted if the INFO level is enabled
+        LOGGER.info("%8.2f ms --> " + description, (now - prevTimer) * 1000, *args)
+        return now
 
     def updateDB(self):
         if settings.DB_ENABLE:
@@ -301,30 +332,28 @@ class Dispatcher(MainLoopApplication):
         '''Computes and returns a list of (rendernode, command) assignments.'''
 
         from .model.node import NoRenderNodeAvailable, NoLicenseAvailableForTask
-        # if no rendernodes available, return
-        if not any(rn.isAvailable() for rn in self.dispatchTree.renderNodes.values()):
+        # if no rendernodes available, return (the idle rendernodes of the pools are counted by the dispatch tree)
+        poolCapacity = self.dispatchTree.poolCapacity
+        if not poolCapacity.hasIdleRenderNodes():
             return []
 
         assignments = []
 
+        span = theProfiler.start("collectEntryPoints")
         # first create a set of entrypoints that are not done nor cancelled nor blocked nor paused and that have at least one command ready
         # FIXME: hack to avoid getting the 'graphs' poolShare node in entryPoints, need to avoid it more nicely...
         entryPoints = set([poolShare.node for poolShare in self.dispatchTree.poolShares.values() if poolShare.node.status not in [NODE_BLOCKED, NODE_DONE, NODE_CANCELED, NODE_PAUSED] and poolShare.node.readyCommandCount > 0 and poolShare.node.name != 'graphs'])
+        span.stop()
 
         # don't proceed to the calculation if no rns availables in the requested pools
-        rnsBool = False
-        for pool, nodesiterator in groupby(entryPoints, lambda x: x.poolShares.values()[0].pool):
-            rnsAvailables = set([rn for rn in pool.renderNodes if rn.status not in [RN_UNKNOWN, RN_PAUSED, RN_WORKING]])
-            if len(rnsAvailables):
-                rnsBool = True
-
-        if not rnsBool:
+        pools = set(node.poolShares.values()[0].pool for node in entryPoints)
+        if not any(poolCapacity.count(pool, AVAILABLE_STATUS) for pool in pools):
             return []
 
-
         # Log time updating max rn
         prevTimer = time.time()
 
+        span = theProfiler.start("updateMaxRN")
         # sort by pool for the groupby
         entryPoints = sorted(entryPoints, key=lambda node: node.poolShares.values()[0].pool)
 
@@ -335,8 +364,7 @@ class Dispatcher(MainLoopApplication):
             nodesList = [node for node in nodesiterator]
 
             # the new maxRN value is calculated based on the number of active jobs of the pool, and the number of online rendernodes of the pool
-            rnsNotOffline = set([rn for rn in pool.renderNodes if rn.status not in [RN_UNKNOWN, RN_PAUSED]])
-            rnsSize = len(rnsNotOffline)
+            rnsSize = poolCapacity.count(pool, ONLINE_STATUS)
             # LOGGER.debug("@   - nb rns awake:%r" % (rnsSize) )
 
             # if we have a userdefined maxRN for some nodes, remove them from the list and substracts their maxRN from the pool's size
@@ -395,6 +423,7 @@ class Dispatcher(MainLoopApplication):
                         unassignedRN -= 1
                     else:
                         break
+        span.stop()
 
         if singletonconfig.get('CORE','GET_STATS'):
             singletonstats.theStats.assignmentTimers['update_max_rn'] = time.time() - prevTimer
@@ -415,6 +444,7 @@ class Dispatcher(MainLoopApplication):
         # Log time dispatching RNs
         prevTimer = time.time()
 
+        span = theProfiler.start("updateLicenses")
         # 
         # HACK update license info for katana with rlmutils
         # This helps having the real number of used licenses before finishing assignment
@@ -436,18 +466,20 @@ class Dispatcher(MainLoopApplication):
             LOGGER.warning("Error getting number of katana license used via rlmutil (e: %r, rlmoutput=%r)" % (e,strRlmKatanaUsed))
         # ENDHACK
         #
+        span.stop()
 
         # Iterate over each entryPoint to get an assignment
         for entryPoint in scoredEntryPoints:
-            if any([poolShare.hasRenderNodesAvailable() for poolShare in entryPoint.poolShares.values()]):
+            if any([poolCapacity.count(poolShare.pool, (RN_IDLE,)) and poolShare.hasRenderNodesAvailable() for poolShare in entryPoint.poolShares.values()]):
                 try:
 
-                    for (rn, com) in entryPoint.dispatchIterator(lambda: self.queue.qsize() > 0):
-                        assignments.append((rn, com))
-                        # increment the allocatedRN for the poolshare
-                        poolShare.allocatedRN += 1
-                        # save the active poolshare of the rendernode
-                        rn.currentpoolshare = poolShare
+                    with theProfiler.span("dispatchIterator:%s", poolShare.pool.name):
+                        for (rn, com) in entryPoint.dispatchIterator(lambda: self.queue.qsize() > 0):
+                            assignments.append((rn, com))
+                            # increment the allocatedRN for the poolshare
+                            poolShare.allocatedRN += 1
+                            # save the active poolshare of the rendernode
+                            rn.currentpoolshare = poolShare
 
                 except NoRenderNodeAvailable:
                     pass
@@ -515,6 +547,7 @@ class Dispatcher(MainLoopApplication):
                     "taskName": command.task.name,
                     "relativePathToLogDir": "%d" % command.task.id,
                     "environment": environment,
+                    "assignment": command.assignment,
                 }
                 body = json.dumps(commandDict)
                 headers["Content-Length"] = len(body)
@@ -554,6 +587,11 @@ class Dispatcher(MainLoopApplication):
         nodes = self.dispatchTree.registerNewGraph(graph)
 
         LOGGER.info("%.2f ms --> graph registered" % ( (time.time() - prevTimer)*1000 ) )
+        self.onGraphRegistered(graph, nodes)
+        return nodes
+
+    def onGraphRegistered(self, graph, nodes):
+        '''Last step of a graph submission, once the graph is registered in the dispatch tree.'''
         prevTimer = time.time()
 
         # handles the case of post job with paused status
@@ -568,7 +606,6 @@ class Dispatcher(MainLoopApplication):
         prevTimer = time.time()
 
         LOGGER.info('Added graph "%s" to the model.' % graph['name'])
-        return nodes
 
     def updateCommandApply(self, dct):
         '''
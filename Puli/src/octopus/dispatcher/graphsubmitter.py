@@ -0,0 +1,248 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Asynchronous registration of the graphs submitted to the dispatcher.
+
+A submission is answered immediately with a ticket, then:
+  1. the json body is decompressed (gzip), parsed and validated in a background thread
+  2. the graph is registered in the dispatch tree by chunks (see DispatchTree.iterRegisterNewGraph), each chunk
+     runs in the IOLoop for at most CORE.GRAPH_REGISTRATION_CHUNK_TIME seconds so that the webservices keep
+     answering during the registration of a large graph
+  3. the ticket is closed with the url of the created job, or set in error
+
+The dispatch tree must never be seen partially registered by the dispatcher cycle (tasks would be written in
+the database without their hierarchy, commands assigned before their dependencies are set): the cycles are
+postponed while a graph is being registered, and a pending graph is only started once the postponed cycle has
+been run.
+'''
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import logging
+import time
+import zlib
+from collections import deque
+from threading import Thread
+from Queue import Queue
+
+from tornado.ioloop import IOLoop
+
+from octopus.core import singletonconfig
+from octopus.core import commandrange
+from octopus.core.framework.ticket import Ticket
+
+LOGGER = logging.getLogger("dispatcher.graphsubmitter")
+
+TASK_KEYS = ('name', 'runner', 'arguments', 'environment', 'requirements', 'maxRN', 'priority', 'dispatchKey',
+             'validationExpression', 'minNbCores', 'maxNbCores', 'ramUse', 'lic', 'tags', 'commands', 'dependencies')
+TASKGROUP_KEYS = ('name', 'arguments', 'environment', 'requirements', 'maxRN', 'priority', 'dispatchKey', 'strategy',
+                  'tags', 'tasks', 'dependencies')
+
+
+class GraphValidationError(Exception):
+    pass
+
+
+def validateGraph(graph):
+    '''
+    Checks the structure of a graph representation before it is registered, so that most invalid submissions
+    are refused before any object is created in the dispatch tree.
+
+    :return: the number of commands of the graph
+    :raise GraphValidationError: if the graph is invalid
+    '''
+    if not isinstance(graph, dict):
+        raise GraphValidationError("The graph must be a json object.")
+    for key in ('name', 'user', 'tasks', 'root', 'poolName'):
+        if key not in graph:
+            raise GraphValidationError("Missing entry in graph: %r." % key)
+    taskDefs = graph['tasks']
+    if not isinstance(taskDefs, list) or not taskDefs:
+        raise GraphValidationError("The graph must have a non empty list of tasks.")
+    if not isinstance(graph['root'], int) or not 0 <= graph['root'] < len(taskDefs):
+        raise GraphValidationError("Invalid root task index: %r." % graph['root'])
+
+    commandCount = 0
+    for (index, taskDef) in enumerate(taskDefs):
+        taskType = taskDef.get('type')
+        if taskType == 'Task':
+            requiredKeys = TASK_KEYS
+        elif taskType == 'TaskGroup':
+            requiredKeys = TASKGROUP_KEYS
+        else:
+            raise GraphValidationError("Invalid type for task %d: %r." % (index, taskType))
+        for key in requiredKeys:
+            if key not in taskDef:
+                raise GraphValidationError("Missing entry in task %d: %r." % (index, key))
+        if taskType == 'Task':
+            for commandDef in taskDef['commands']:
+                if 'description' not in commandDef or 'arguments' not in commandDef:
+                    raise GraphValidationError("Invalid command in task %d: %r." % (index, commandDef))
+            commandCount += len(taskDef['commands'])
+            if 'commandRange' in taskDef:
+                # compact form, the commands are expanded when the task is registered
+                if not isinstance(taskDef['arguments'], dict):
+                    raise GraphValidationError("Arguments of task %d must be a json object." % index)
+                try:
+                    commandCount += commandrange.countCommands(taskDef['commandRange'])
+                except ValueError, e:
+                    raise GraphValidationError("Invalid command range in task %d: %s." % (index, e))
+        else:
+            for taskIndex in taskDef['tasks']:
+                if not isinstance(taskIndex, int) or not 0 <= taskIndex < len(taskDefs):
+                    raise GraphValidationError("Invalid subtask index in task %d: %r." % (index, taskIndex))
+        dependencies = taskDef['dependencies']
+        if not isinstance(dependencies, list) or not all(
+                isinstance(dependency, list) and len(dependency) == 2 and
+                isinstance(dependency[0], int) and 0 <= dependency[0] < len(taskDefs) and
+                isinstance(dependency[1], list) and all(isinstance(status, int) for status in dependency[1])
+                for dependency in dependencies):
+            raise GraphValidationError("Dependencies of task %d must be a list of (taskId, [status-list]), got %r." % (index, dependencies))
+    return commandCount
+
+
+class GraphSubmission(object):
+    '''A graph waiting to be registered, and the ticket given to the client.'''
+
+    def __init__(self, ticket, body, nodeURL, encoding=None):
+        self.ticket = ticket
+        self.body = body
+        self.encoding = encoding
+        self.nodeURL = nodeURL
+        self.graph = None
+        self.commandCount = 0
+        self.submitTime = time.time()
+
+
+class GraphSubmitter(object):
+    '''
+    | Registers the submitted graphs in the background, the progress of each submission is given by its ticket.
+    | Tickets are kept CORE.GRAPH_TICKET_TTL seconds after the end of the registration.
+    '''
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.tickets = {}
+        self.parseQueue = Queue()
+        self.parser = None
+        # submissions parsed and waiting to be registered, and the one being registered
+        self.pending = deque()
+        self.current = None
+        self.steps = None
+        self.nodes = None
+        self.cyclePostponed = False
+
+    @property
+    def registering(self):
+        '''True while a graph is partially registered in the dispatch tree.'''
+        return self.current is not None
+
+    def submit(self, body, nodeURL, encoding=None):
+        '''
+        Queues a graph submission and returns its ticket.
+
+        :param body: the json representation of the graph, as sent by the client
+        :param nodeURL: url of the nodes, the id of the created job is appended to get the result url of the ticket
+        :param encoding: content encoding of the body, "gzip" or None/"identity"
+        '''
+        self.purgeTickets()
+        ticket = Ticket(message="Graph submission queued")
+        self.tickets[ticket.id] = ticket
+        if self.parser is None:
+            self.parser = Thread(target=self._parse, name="graphParser")
+            self.parser.setDaemon(True)
+            self.parser.start()
+        self.parseQueue.put(GraphSubmission(ticket, body, nodeURL, encoding))
+        return ticket
+
+    def getTicket(self, ticketId):
+        return self.tickets.get(ticketId)
+
+    def purgeTickets(self):
+        ttl = singletonconfig.get('CORE', 'GRAPH_TICKET_TTL', 3600)
+        limit = time.time() - ttl
+        for ticket in self.tickets.values():
+            if ticket.status != Ticket.OPENED and ticket.updateTimestamp < limit:
+                del self.tickets[ticket.id]
+
+    def _parse(self):
+        '''Parser thread: parses and validates the submissions, valid ones are given to the IOLoop.'''
+        while True:
+            submission = self.parseQueue.get()
+            try:
+                submission.ticket.message = "Parsing graph"
+                body = submission.body
+                if submission.encoding == 'gzip':
+                    body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                graph = json.loads(body)
+                submission.commandCount = validateGraph(graph)
+                submission.graph = graph
+                submission.body = None
+            except (ValueError, zlib.error, GraphValidationError), e:
+                LOGGER.warning("Invalid graph submission: %s" % e)
+                self._fail(submission, "Invalid graph: %s" % e)
+                continue
+            except Exception, e:
+                LOGGER.exception("Error while parsing graph submission")
+                self._fail(submission, "Failed. %s" % e)
+                continue
+            IOLoop.instance().add_callback(lambda submission=submission: self._enqueue(submission))
+
+    def _fail(self, submission, message):
+        submission.ticket.message = message
+        submission.ticket.status = Ticket.ERROR
+
+    def _enqueue(self, submission):
+        submission.ticket.message = "Waiting for registration"
+        self.pending.append(submission)
+        if self.current is None and not self.cyclePostponed:
+            self._startNext()
+
+    def _startNext(self):
+        if not self.pending:
+            return
+        self.current = self.pending.popleft()
+        self.nodes = []
+        self.steps = self.dispatcher.dispatchTree.iterRegisterNewGraph(self.current.graph, self.nodes)
+        self.current.ticket.message = "Registering graph: 0/%d commands" % self.current.commandCount
+        self._registerChunk()
+
+    def _registerChunk(self):
+        '''Runs the registration of the current graph for a limited time, then lets the IOLoop handle other events.'''
+        submission = self.current
+        chunkTime = singletonconfig.get('CORE', 'GRAPH_REGISTRATION_CHUNK_TIME', 0.05)
+        deadline = time.time() + chunkTime
+        try:
+            for commandCount in self.steps:
+                if time.time() >= deadline:
+                    submission.ticket.message = "Registering graph: %d/%d commands" % (commandCount, submission.commandCount)
+                    IOLoop.instance().add_callback(self._registerChunk)
+                    return
+            self.dispatcher.onGraphRegistered(submission.graph, self.nodes)
+        except Exception, e:
+            LOGGER.exception("Graph submission failed")
+            self._fail(submission, "Failed. %s" % e)
+        else:
+            submission.ticket.resultURL = "%s/%d" % (submission.nodeURL, self.nodes[0].id)
+            submission.ticket.message = "Graph created.\nCreated nodes: %s" % (",".join([str(node.id) for node in self.nodes]))
+            submission.ticket.status = Ticket.CLOSED
+            LOGGER.info("Graph \"%s\" registered in %.2fs after submission" % (submission.graph['name'], time.time() - submission.submitTime))
+
+        self.current = None
+        self.steps = None
+        self.nodes = None
+        if self.cyclePostponed:
+            # run the postponed cycle now, the next graph will be started at its end
+            IOLoop.instance().add_callback(self.dispatcher.mainLoop)
+        else:
+            self._startNext()
+
+    def onCycleEnd(self):
+        '''Called by the dispatcher after each cycle, a graph waiting for the postponed cycle can be registered.'''
+        if self.cyclePostponed:
+            self.cyclePostponed = False
+            if self.current is None:
+                self._startNext()
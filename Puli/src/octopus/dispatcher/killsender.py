@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Sends the kill requests (DELETE /commands/<id>/?assignment=<id>) of the cancelled commands to the render nodes in the
+background. The request holds the assignment of the killed command, the worker ignores it if the command has been
+assigned again to the render node before the request is sent.
+
+The commands are cancelled in the dispatch tree immediately, only the requests to the workers are deferred: they
+are grouped by render node and sent by a few threads (CORE.KILL_SENDER_THREADS), the requests of a render node are
+sent in sequence by one thread at a time. Cancelling thousands of jobs neither blocks the IOLoop nor sends the
+requests one after the other, and an unreachable render node only delays its own requests.
+'''
+
+import logging
+from collections import OrderedDict
+from threading import Thread, Lock, Condition
+
+from octopus.core import singletonconfig
+
+LOGGER = logging.getLogger("dispatcher.killsender")
+
+
+class KillSender(object):
+    '''
+    | Queue of the commands to kill, by render node.
+    | The threads are started with the first request.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.available = Condition(self.lock)
+        # render node name -> (render node, [(command id, assignment)]), the render nodes waiting for a thread
+        self.pending = OrderedDict()
+        # names of the render nodes whose requests are being sent by a thread
+        self.busy = set()
+        self.threads = []
+        self.sentCount = 0
+        self.failedCount = 0
+
+    def __len__(self):
+        '''Number of kill requests not sent yet.'''
+        with self.lock:
+            return sum(len(commandIds) for (renderNode, commandIds) in self.pending.itervalues())
+
+    def kill(self, renderNode, commandId, assignment=None):
+        '''Queues the kill request of a command running on the given render node for the given assignment.'''
+        with self.lock:
+            if renderNode.name in self.pending:
+                self.pending[renderNode.name][1].append((commandId, assignment))
+            else:
+                self.pending[renderNode.name] = (renderNode, [(commandId, assignment)])
+            self.available.notify()
+        if not self.threads:
+            self._startThreads()
+
+    def _startThreads(self):
+        for i in xrange(singletonconfig.get('CORE', 'KILL_SENDER_THREADS', 16)):
+            thread = Thread(target=self._run, name="killSender%d" % i)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next(self):
+        '''Returns the name of the first render node waiting for a thread and not served by another one.'''
+        for renderNodeName in self.pending:
+            if renderNodeName not in self.busy:
+                return renderNodeName
+        return None
+
+    def _run(self):
+        while True:
+            with self.lock:
+                renderNodeName = self._next()
+                while renderNodeName is None:
+                    self.available.wait()
+                    renderNodeName = self._next()
+                renderNode, requests = self.pending.pop(renderNodeName)
+                self.busy.add(renderNodeName)
+            try:
+                for (commandId, assignment) in requests:
+                    self._send(renderNode, commandId, assignment)
+            finally:
+                # the requests queued for this render node in the meantime are sent by the next thread
+                with self.lock:
+                    self.busy.discard(renderNodeName)
+                    if renderNodeName in self.pending:
+                        self.available.notify()
+
+    def _send(self, renderNode, commandId, assignment):
+        url = "/commands/%d/" % commandId
+        if assignment is not None:
+            url += "?assignment=%d" % assignment
+        try:
+            renderNode.request("DELETE", url)
+        except Exception:
+            # the command is already cancelled on the server
+            LOGGER.warning("Impossible to reach RN %s to kill command %d." % (renderNode.name, commandId))
+            self.failedCount += 1
+        else:
+            self.sentCount += 1
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Counters of the render nodes and cores of each pool by status, so that the dispatcher knows whether a pool has idle
+render nodes without scanning them at each cycle (see Dispatcher.computeAssignments).
+
+The counters are updated by the dispatch tree listeners: a status change of a render node moves it between the
+counters of its pools. When the pools of the render nodes change (creation or removal of a render node or a pool,
+render nodes added to or removed from a pool), the counters are counted again at the next read.
+
+With the ready commands of the active jobs of each pool (see nodeindex.JobStats), the counters give the queue
+pressure of the pools, the number of ready commands per idle core, published by /stats (so recorded by
+grab_usage_stats) and /metrics.
+'''
+
+import logging
+
+from octopus.core.enums.rendernode import (RN_STATUS, RN_UNKNOWN, RN_BOOTING, RN_PAUSED, RN_IDLE, RN_ASSIGNED,
+                                           RN_WORKING, RN_FINISHING)
+
+LOGGER = logging.getLogger("dispatcher.capacity")
+
+# status of the render nodes counted in each state of the stats
+STATES = (
+    ('idle', (RN_IDLE,)),
+    ('working', (RN_ASSIGNED, RN_WORKING, RN_FINISHING)),
+    ('paused', (RN_PAUSED,)),
+    ('unknown', (RN_UNKNOWN, RN_BOOTING)),
+)
+
+# status of the render nodes neither offline nor working (they may take a command soon), and of the online ones
+AVAILABLE_STATUS = (RN_BOOTING, RN_IDLE, RN_ASSIGNED, RN_FINISHING)
+ONLINE_STATUS = (RN_BOOTING, RN_IDLE, RN_ASSIGNED, RN_WORKING, RN_FINISHING)
+
+
+class PoolCapacity(object):
+    '''
+    | Counters by pool name, the pools are the ones of the dispatch tree (pools by name).
+    '''
+
+    def __init__(self, pools):
+        self.pools = pools
+        # pool name -> number of render nodes by status, number of cores by status
+        self.renderNodes = {}
+        self.cores = {}
+        self.dirty = True
+
+    def invalidate(self):
+        self.dirty = True
+
+    def onStatusChange(self, renderNode, oldStatus, newStatus):
+        if self.dirty or oldStatus is None:
+            return
+        for pool in renderNode.pools:
+            renderNodes = self.renderNodes.get(pool.name)
+            if renderNodes is None:
+                self.dirty = True
+                return
+            renderNodes[oldStatus] -= 1
+            renderNodes[newStatus] += 1
+            self.cores[pool.name][oldStatus] -= renderNode.coresNumber
+            self.cores[pool.name][newStatus] += renderNode.coresNumber
+
+    def sync(self):
+        '''Counts the render nodes of every pool again if the pools have changed.'''
+        if not self.dirty:
+            return
+        self.renderNodes.clear()
+        self.cores.clear()
+        for (name, pool) in self.pools.iteritems():
+            renderNodes = [0] * len(RN_STATUS)
+            cores = [0] * len(RN_STATUS)
+            for renderNode in pool.renderNodes:
+                renderNodes[renderNode.status] += 1
+                cores[renderNode.status] += renderNode.coresNumber
+            self.renderNodes[name] = renderNodes
+            self.cores[name] = cores
+        self.dirty = False
+
+    def count(self, pool, statuses):
+        '''Returns the number of render nodes of a pool in the given statuses.'''
+        self.sync()
+        renderNodes = self.renderNodes.get(pool.name)
+        if renderNodes is None:
+            return 0
+        return sum(renderNodes[status] for status in statuses)
+
+    def hasIdleRenderNodes(self):
+        '''Returns True if a pool has an idle render node.'''
+        self.sync()
+        return any(renderNodes[RN_IDLE] for renderNodes in self.renderNodes.itervalues())
+
+    def getStats(self, readyCommands):
+        '''
+        Returns the counters of each pool by pool name, with the given ready commands by pool name:
+        { "default": {"idle": 12, "working": 140, "paused": 2, "unknown": 3, "idleCores": 96, "totalCores": 1256,
+          "readyCommands": 1500, "pressure": 15.6}, ... }
+        The pressure is the number of ready commands per idle core, None if commands are ready without idle cores.
+        '''
+        self.sync()
+        stats = {}
+        for (name, renderNodes) in self.renderNodes.iteritems():
+            cores = self.cores[name]
+            poolStats = dict((state, sum(renderNodes[status] for status in statuses)) for (state, statuses) in STATES)
+            poolStats['idleCores'] = cores[RN_IDLE]
+            poolStats['totalCores'] = sum(cores)
+            poolStats['readyCommands'] = readyCommands.get(name, 0)
+            if cores[RN_IDLE]:
+                poolStats['pressure'] = poolStats['readyCommands'] / float(cores[RN_IDLE])
+            else:
+                poolStats['pressure'] = None if poolStats['readyCommands'] else 0.0
+            stats[name] = poolStats
+        return stats
+
+    def toPrometheus(self, stats):
+        '''Returns the lines of the given stats (see getStats) in the Prometheus text format.'''
+        lines = []
+        lines.append("# HELP puli_pool_rendernodes Number of render nodes of the pools, by state.")
+        lines.append("# TYPE puli_pool_rendernodes gauge")
+        for (name, poolStats) in sorted(stats.iteritems()):
+            for (state, statuses) in STATES:
+                lines.append('puli_pool_rendernodes{pool="%s",state="%s"} %d' % (name, state, poolStats[state]))
+        for (key, metric, description) in (("idleCores", "puli_pool_idle_cores", "Number of cores of the idle render nodes"),
+                                           ("totalCores", "puli_pool_cores", "Number of cores of the render nodes"),
+                                           ("readyCommands", "puli_pool_ready_commands", "Number of ready commands of the active jobs")):
+            lines.append("# HELP %s %s, by pool." % (metric, description))
+            lines.append("# TYPE %s gauge" % metric)
+            for (name, poolStats) in sorted(stats.iteritems()):
+                lines.append('%s{pool="%s"} %d' % (metric, name, poolStats[key]))
+        lines.append("# HELP puli_pool_queue_pressure Ready commands per idle core, by pool (+Inf if commands are ready without idle cores).")
+        lines.append("# TYPE puli_pool_queue_pressure gauge")
+        for (name, poolStats) in sorted(stats.iteritems()):
+            pressure = poolStats['pressure']
+            lines.append('puli_pool_queue_pressure{pool="%s"} %s' % (name, "+Inf" if pressure is None else repr(pressure)))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Change feed of the dispatch tree: the changes on nodes, commands and render nodes are recorded with a
+monotonically increasing revision number, so that a client (UI, monitoring tool) only has to retrieve a
+snapshot once and then ask for the changes since the last revision it received.
+
+Only the latest revision of each object is kept: when an object changes several times, it is moved to the end
+of the feed with the list of all its changed fields. The values are serialized when the changes are read, so a
+client always gets the current value of a field. The feed holds at most "maxSize" objects, a client asking for a
+revision older than the oldest one still in the feed has to resync from a new snapshot.
+
+Protocol for a client:
+  1. GET /changes to retrieve the current revision
+  2. GET /query (or any other resource) to get a snapshot
+  3. GET /changes?since=<revision> (long-poll) or /changes/stream?since=<revision> (server-sent events)
+'''
+
+import logging
+import weakref
+from collections import OrderedDict
+
+from tornado.ioloop import IOLoop
+
+from octopus.dispatcher.model import Command, RenderNode
+from octopus.dispatcher.model.node import BaseNode
+
+LOGGER = logging.getLogger("dispatcher.changefeed")
+
+NODE = "node"
+COMMAND = "command"
+RENDERNODE = "rendernode"
+
+
+class ResyncRequired(Exception):
+    '''Raised when the changes asked have been dropped from the feed.'''
+    pass
+
+
+class ChangeListener(object):
+    '''Records the events of a model class in the feed with the given kind.'''
+
+    def __init__(self, feed, kind):
+        self.feed = feed
+        self.kind = kind
+
+    def onCreationEvent(self, obj):
+        self.feed.record(self.kind, obj, created=True)
+
+    def onDestructionEvent(self, obj):
+        self.feed.record(self.kind, obj, removed=True)
+
+    def onChangeEvent(self, obj, field, oldvalue, newvalue):
+        self.feed.record(self.kind, obj, field)
+
+
+class ChangeEntry(object):
+    '''The last change of an object in the feed.'''
+
+    __slots__ = ('revision', 'kind', 'id', 'ref', 'fields', 'creationRevision', 'removed')
+
+    def __init__(self, kind, obj):
+        self.revision = 0
+        self.kind = kind
+        self.id = obj.id
+        self.ref = weakref.ref(obj)
+        self.fields = set()
+        self.creationRevision = None
+        self.removed = False
+
+    def to_json(self, since):
+        '''All the fields are given for an object created after "since", only the changed ones otherwise.'''
+        result = {'revision': self.revision, 'kind': self.kind, 'id': self.id}
+        obj = self.ref()
+        if self.removed or obj is None:
+            result['removed'] = True
+            return result
+        if self.creationRevision is not None and self.creationRevision > since:
+            result['created'] = True
+            fields = obj.FIELDS.keys()
+        else:
+            fields = self.fields
+        values = {}
+        for name in fields:
+            field = obj.FIELDS.get(name)
+            if field is None:
+                continue
+            try:
+                values[name] = field.to_json(obj)
+            except Exception:
+                # e.g. a model field referencing an object without id yet
+                pass
+        result['fields'] = values
+        return result
+
+
+class ChangeFeed(object):
+    '''
+    | Ordered record of the latest change of each node, command and render node.
+    | The model listeners are registered with registerModelListeners(), usually once the dispatcher state has been
+    | reloaded, the objects restored from the database are part of the initial snapshot.
+    '''
+
+    def __init__(self, maxSize=100000):
+        self.maxSize = maxSize
+        self.revision = 0
+        # revision of the most recent change dropped from the feed, clients must have seen it
+        self.droppedRevision = 0
+        self.entries = OrderedDict()
+        self.waiters = set()
+        self.wakeScheduled = False
+        self.listeners = [
+            (BaseNode, ChangeListener(self, NODE)),
+            (Command, ChangeListener(self, COMMAND)),
+            (RenderNode, ChangeListener(self, RENDERNODE)),
+        ]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def registerModelListeners(self):
+        for (modelClass, listener) in self.listeners:
+            if listener not in modelClass.changeListeners:
+                modelClass.changeListeners.append(listener)
+
+    def unregisterModelListeners(self):
+        for (modelClass, listener) in self.listeners:
+            if listener in modelClass.changeListeners:
+                modelClass.changeListeners.remove(listener)
+
+    def record(self, kind, obj, field=None, created=False, removed=False):
+        if obj.id is None:
+            # the id is given by the dispatch tree creation listener, the creation will be recorded then
+            return
+        key = (kind, obj.id)
+        entry = self.entries.pop(key, None)
+        if entry is None or entry.ref() is not obj:
+            entry = ChangeEntry(kind, obj)
+        self.revision += 1
+        entry.revision = self.revision
+        if field is not None:
+            entry.fields.add(field)
+        if created:
+            entry.creationRevision = self.revision
+        entry.removed = removed
+        self.entries[key] = entry
+
+        while len(self.entries) > self.maxSize:
+            droppedKey, dropped = self.entries.popitem(last=False)
+            self.droppedRevision = dropped.revision
+
+        self._scheduleWake()
+
+    def recordRemoval(self, obj):
+        '''Records the removal of an object from the dispatch tree (e.g. archived nodes and commands).'''
+        if isinstance(obj, BaseNode):
+            self.record(NODE, obj, removed=True)
+        elif isinstance(obj, Command):
+            self.record(COMMAND, obj, removed=True)
+        elif isinstance(obj, RenderNode):
+            self.record(RENDERNODE, obj, removed=True)
+
+    def getChanges(self, since, kinds=None, limit=None):
+        '''
+        Returns the changes recorded after the given revision, oldest first.
+
+        :param kinds: if given, only the changes of these kinds of objects are returned
+        :param limit: maximum number of changes to return, the oldest are returned first
+        :return: a tuple (revision, changes), "revision" is the revision to ask next time
+        :raise ResyncRequired: if some changes after "since" have been dropped
+        '''
+        if since < self.droppedRevision:
+            raise ResyncRequired("revision %d is too old, oldest available is %d" % (since, self.droppedRevision))
+        entries = []
+        for key in reversed(self.entries):
+            entry = self.entries[key]
+            if entry.revision <= since:
+                break
+            if kinds is None or entry.kind in kinds:
+                entries.append(entry)
+        entries.reverse()
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            return entries[-1].revision, [entry.to_json(since) for entry in entries]
+        return self.revision, [entry.to_json(since) for entry in entries]
+
+    def hasChanges(self, since):
+        return self.revision > since
+
+    ## Waiters are called (in the IOLoop thread) when new changes have been recorded
+    #
+    def addWaiter(self, callback):
+        self.waiters.add(callback)
+
+    def removeWaiter(self, callback):
+        self.waiters.discard(callback)
+
+    def _scheduleWake(self):
+        # several changes are usually recorded in a row (e.g. a dispatcher cycle), waiters are only woken once
+        if self.waiters and not self.wakeScheduled:
+            self.wakeScheduled = True
+            IOLoop.instance().add_callback(self._wakeWaiters)
+
+    def _wakeWaiters(self):
+        self.wakeScheduled = False
+        for callback in list(self.waiters):
+            try:
+                callback()
+            except Exception:
+                LOGGER.exception("Error while notifying a change feed waiter")
@@ -11,9 +11,11 @@
 
 import time
 import logging
-from threading import Timer
+import itertools
 
 from octopus.core.enums.command import *
+from octopus.core.timers import TimerQueue
+from octopus.dispatcher.killsender import KillSender
 from octopus.core.enums.rendernode import RN_FINISHING
 from . import models
 from octopus.dispatcher import settings
@@ -21,9 +23,24 @@ from octopus.core import singletonconfig
 
 LOGGER = logging.getLogger('command')
 
+# Delayed actions on commands (i.e. autoretry). They are executed by the dispatcher main loop, like every other
+# modification of the model.
+COMMAND_TIMERS = TimerQueue()
+
+# Kill requests of the cancelled commands, sent to the workers in the background
+KILL_SENDER = KillSender()
+
+# Ids of the assignments of the commands, sent to the worker with the command and with its kill request so that the
+# worker ignores the kill of a previous assignment (unique across the restarts of the dispatcher)
+ASSIGNMENT_IDS = itertools.count(int(time.time() * 1000))
+
 
 class Command(models.Model):
 
+    # validatorMessage and errorInfos are sent by the workers with the completion of a command (see
+    # Dispatcher.updateCommandApply), assignment is the id of the current assignment (not saved in db)
+    __slots__ = ('validatorMessage', 'errorInfos', 'assignment')
+
     description = models.StringField()
     task = models.ModelField()
     arguments = models.DictField()
@@ -87,10 +104,12 @@ class Command(models.Model):
 
         self.message = str(message)
 
+        self.assignment = None
+
         # compute the average time by frame
         self.computeAvgTimeByFrame()
         self.retryCount = 0
-        self.retryRnList = []
+        self.retryRnList = ()
 
     def __repr__(self):
         return "Command(id=%r, status=%s)" % (self.id, CMD_STATUS_NAME[self.status])
@@ -107,6 +126,7 @@ class Command(models.Model):
         self.status = CMD_READY
 
     def assign(self, renderNode):
+        self.assignment = next(ASSIGNMENT_IDS)
         self.renderNode = renderNode
         self.startTime = time.time()
         self.status = CMD_ASSIGNED
@@ -114,20 +134,14 @@ class Command(models.Model):
     def cancel(self):
         """
         | Method called when changing node status via "nodes/id/status" webservice.
-        | The calling webservice is made asynchronous to avoid blocking when RN node request encounter a timeout error
+        | The command is cancelled immediately, the kill request is sent to the RN in the background (see KILL_SENDER).
         | If a RN can not be reached, its command assignement is reseted and RN is marked as "quarantine"
         """
         if self.status in (CMD_FINISHING, CMD_DONE, CMD_CANCELED):
             return
         elif self.status == CMD_RUNNING:
-            try:
-                self.renderNode.clearAssignment(self)
-                (response, data) = self.renderNode.request("DELETE", "/commands/" + str(self.id) + "/")
-
-            except Exception:
-                # if request has failed, it means the rendernode is unreachable
-                LOGGER.error( "Impossible to reach RN %s to cancel command %d." % (self.renderNode, self.id) )
-                self.status = CMD_CANCELED
+            self.renderNode.clearAssignment(self)
+            KILL_SENDER.kill(self.renderNode, self.id, self.assignment)
 
         elif self.renderNode is not None:
             self.renderNode.clearAssignment(self)
@@ -161,8 +175,7 @@ class Command(models.Model):
 
     def setReadyAndKill(self):
         if self.renderNode is not None:
-            self.renderNode.request("DELETE", "/commands/" + str(self.id) + "/")
-            # FIXME test the return value of this request ?
+            KILL_SENDER.kill(self.renderNode, self.id, self.assignment)
             self.renderNode.reset()
         self.setReadyStatusAndClear()
 
@@ -263,8 +276,7 @@ class CommandDatesUpdater(object):
 
             LOGGER.debug("Mark command %d for auto retry in %ds  (%d/%d)" % (cmd.id, singletonconfig.get('CORE','DELAY_BEFORE_AUTORETRY'), cmd.attempt, cmd.task.maxAttempt))
             if cmd.attempt < cmd.task.maxAttempt:
-                t = Timer(singletonconfig.get('CORE','DELAY_BEFORE_AUTORETRY'), self.autoretry, [cmd])
-                t.start()
+                COMMAND_TIMERS.schedule(singletonconfig.get('CORE','DELAY_BEFORE_AUTORETRY'), self.autoretry, cmd)
 
         elif cmd.status is CMD_ASSIGNED:
             cmd.startTime = cmd.updateTime
@@ -273,7 +285,7 @@ class CommandDatesUpdater(object):
 
     def autoretry(self, cmd):
         rn = cmd.renderNode
-        cmd.retryRnList.append(rn.name)
+        cmd.retryRnList += (rn.name,)
 
         # cmd.setReadyStatusAndClear()
         cmd.status = CMD_READY
@@ -287,3 +299,44 @@ class CommandDatesUpdater(object):
 
 
 Command.changeListeners.append(CommandDatesUpdater())
+
+
+def _benchmark(nbCommands=200000):
+    '''
+    Measures the memory used by the commands and the cost of setting their attributes.
+    Usage: python -m octopus.dispatcher.model.command [nbCommands]
+    '''
+    import gc
+    import resource
+    from octopus.dispatcher.model import Task
+
+    singletonconfig.conf = {'CORE': {}}
+    task = Task(None, "task", None, "user", 1, 1, 1, "runner", {}, "", [])
+    arguments = {'start': 1, 'end': 1}
+    gc.collect()
+    startRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    startTime = time.time()
+    commands = [Command(i + 1, "task_%d_%d" % (i, i), task, arguments, CMD_READY, 0.0, None, startTime) for i in xrange(nbCommands)]
+    creationTime = time.time() - startTime
+    usedMemory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - startRss) * 1024.0
+    print "%d commands created in %.2fs, %.0f bytes/command" % (nbCommands, creationTime, usedMemory / nbCommands)
+
+    command = commands[0]
+    nbLoops = 1000000
+    startTime = time.time()
+    for i in xrange(nbLoops):
+        command.completion = i
+    print "field set (change event):   %.2f M/s" % (nbLoops / (time.time() - startTime) / 1e6)
+    startTime = time.time()
+    for i in xrange(nbLoops):
+        command.status = CMD_READY
+    print "field set (same value):     %.2f M/s" % (nbLoops / (time.time() - startTime) / 1e6)
+    startTime = time.time()
+    for i in xrange(nbLoops):
+        command.status
+    print "field get:                  %.2f M/s" % (nbLoops / (time.time() - startTime) / 1e6)
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Columnar copy of the fields of the commands used by the statistics of the dispatcher.
+
+The webservices giving farm-wide statistics (/stats, /mobile) used to iterate over every Command object. The
+store keeps the status, task id, completion and dates of each command in numpy arrays, one row per command,
+so that the aggregates are computed with vectorized reductions:
+  - countByStatus(): number of commands of each status
+  - aggregate(tasks, key): counts by status and completion sum of the commands, grouped by a key of their task
+    (e.g. its user or prod)
+
+The store is updated by the dispatch tree command listener: a row is allocated when a command is registered,
+updated when one of the stored fields changes and freed when the command is removed from the tree. The rows of
+the removed commands are reused.
+
+A benchmark comparing the loop on the commands and the store is available with:
+    python -m octopus.dispatcher.model.commandstore [nbCommands]
+'''
+
+import logging
+
+import numpy as np
+
+from octopus.core.enums.command import CMD_STATUS, CMD_STATUS_NAME
+
+LOGGER = logging.getLogger("dispatcher.commandstore")
+
+# status of a free row: counted in an extra bin of the histograms, which is dropped
+FREE = len(CMD_STATUS)
+NO_TASK = -1
+
+TIME_FIELDS = ('creationTime', 'startTime', 'updateTime', 'endTime')
+
+
+class CommandStore(object):
+    '''
+    | One row per command registered in the dispatch tree, the rows are found by command id.
+    | A date that is not set (None) is stored as NaN.
+    '''
+
+    def __init__(self, capacity=1024):
+        self.rows = {}
+        self.freeRows = []
+        # rows [0, size) have been used at least once, the others are not initialized
+        self.size = 0
+        self.capacity = 0
+        self.status = np.empty(0, dtype=np.int8)
+        self.taskId = np.empty(0, dtype=np.int32)
+        self.completion = np.empty(0, dtype=np.float32)
+        self.times = dict((field, np.empty(0, dtype=np.float64)) for field in TIME_FIELDS)
+        self.columns = {}
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, command):
+        return command.id in self.rows
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        self.status = np.concatenate((self.status, np.empty(extra, dtype=np.int8)))
+        self.taskId = np.concatenate((self.taskId, np.empty(extra, dtype=np.int32)))
+        self.completion = np.concatenate((self.completion, np.empty(extra, dtype=np.float32)))
+        for field in TIME_FIELDS:
+            self.times[field] = np.concatenate((self.times[field], np.empty(extra, dtype=np.float64)))
+        self.capacity = capacity
+        # column holding each stored field of the commands
+        self.columns = dict(self.times)
+        self.columns['status'] = self.status
+        self.columns['task'] = self.taskId
+        self.columns['completion'] = self.completion
+
+    def clear(self):
+        self.rows.clear()
+        del self.freeRows[:]
+        self.size = 0
+
+    def add(self, command):
+        if command.id is None or command.id in self.rows:
+            return
+        if self.freeRows:
+            row = self.freeRows.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.size
+            self.size += 1
+        self.rows[command.id] = row
+        self.status[row] = command.status
+        self.taskId[row] = NO_TASK if command.task is None else command.task.id
+        self.completion[row] = command.completion
+        for (field, column) in self.times.iteritems():
+            value = getattr(command, field)
+            column[row] = np.nan if value is None else value
+
+    def remove(self, command):
+        row = self.rows.pop(command.id, None)
+        if row is None:
+            return
+        self.status[row] = FREE
+        self.taskId[row] = NO_TASK
+        self.freeRows.append(row)
+
+    def update(self, command, field):
+        '''Copies the new value of a field of a command, the fields that are not stored are ignored.'''
+        column = self.columns.get(field)
+        if column is None:
+            return
+        row = self.rows.get(command.id)
+        if row is not None:
+            column[row] = self._value(command, field)
+
+    def _value(self, command, field):
+        value = getattr(command, field)
+        if field == 'task':
+            return NO_TASK if value is None else value.id
+        if value is None:
+            return np.nan
+        return value
+
+    ## Aggregates
+    #
+    def countByStatus(self):
+        '''Returns an array holding the number of commands of each status, indexed by status.'''
+        return np.bincount(self.status[:self.size], minlength=FREE + 1)[:FREE]
+
+    def getStatusCounts(self):
+        '''Returns a dict giving the number of commands for each status name.'''
+        return dict(zip(CMD_STATUS_NAME, self.countByStatus().tolist()))
+
+    def aggregate(self, tasks, key):
+        '''
+        Counts the commands of each status and sums their completion, for each group of tasks.
+
+        :param tasks: dict of the tasks by id, the commands of a task not in this dict are ignored
+        :param key: function returning the group of a task (e.g. lambda task: task.user)
+        :return: a dict { group: {'commands': {statusName: count}, 'total': count, 'completion': sum} }, the groups
+                 without commands are not given
+        '''
+        status = self.status[:self.size]
+        taskId = self.taskId[:self.size]
+        # group index of each task, found at index "task id + 1": the free rows (NO_TASK) and the tasks that are
+        # not in "tasks" are put in an extra group
+        groups = {}
+        lookup = np.empty(int(taskId.max()) + 2 if self.size else 1, dtype=np.int32)
+        lookup.fill(-1)
+        for (taskIndex, task) in tasks.iteritems():
+            if taskIndex + 1 < len(lookup):
+                lookup[taskIndex + 1] = groups.setdefault(key(task), len(groups))
+        groupCount = len(groups)
+        lookup[lookup == -1] = groupCount
+
+        rowGroups = lookup[taskId + 1]
+        counts = np.bincount(rowGroups * (FREE + 1) + status, minlength=(groupCount + 1) * (FREE + 1))
+        counts = counts.reshape(groupCount + 1, FREE + 1)
+        completion = np.bincount(rowGroups, weights=self.completion[:self.size], minlength=groupCount + 1)
+
+        result = {}
+        for (group, index) in groups.iteritems():
+            groupCounts = counts[index, :FREE].tolist()
+            if not any(groupCounts):
+                continue
+            result[group] = {
+                'commands': dict(zip(CMD_STATUS_NAME, groupCounts)),
+                'total': sum(groupCounts),
+                'completion': float(completion[index]),
+            }
+        return result
+
+
+def _benchmark(nbCommands=1000000):
+    '''Compares the status histogram computed with a loop on the commands and with the store.'''
+    import random
+    import time
+
+    class FakeTask(object):
+        def __init__(self, id, user):
+            self.id = id
+            self.user = user
+
+    class FakeCommand(object):
+        def __init__(self, id, task):
+            self.id = id
+            self.task = task
+            self.status = random.choice(CMD_STATUS)
+            self.completion = random.random()
+            self.creationTime = time.time()
+            self.startTime = None
+            self.updateTime = None
+            self.endTime = None
+
+    tasks = dict((i, FakeTask(i, "user%d" % (i % 50))) for i in xrange(1, nbCommands / 100 + 1))
+    commands = dict((i, FakeCommand(i, tasks[(i % len(tasks)) + 1])) for i in xrange(1, nbCommands + 1))
+    store = CommandStore()
+    startTime = time.time()
+    for command in commands.itervalues():
+        store.add(command)
+    print "store filled with %d commands in %.2fs" % (len(store), time.time() - startTime)
+
+    startTime = time.time()
+    commandsByStatus = dict((name, 0) for name in CMD_STATUS_NAME)
+    for command in commands.itervalues():
+        commandsByStatus[CMD_STATUS_NAME[command.status]] += 1
+    print "loop on the commands:   %8.2f ms" % ((time.time() - startTime) * 1000)
+    startTime = time.time()
+    assert store.getStatusCounts() == commandsByStatus
+    print "store status counts:    %8.2f ms" % ((time.time() - startTime) * 1000)
+    startTime = time.time()
+    byUser = store.aggregate(tasks, lambda task: task.user)
+    print "store counts by user:   %8.2f ms (%d groups)" % ((time.time() - startTime) * 1000, len(byUser))
+    assert sum(group['total'] for group in byUser.values()) == nbCommands
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(*[int(arg) for arg in sys.argv[1:]])
@@ -6,10 +6,18 @@ from weakref import WeakValueDictionary
 
 
 from octopus.dispatcher.model import FolderNode, TaskNode, Pool, RenderNode, Task, TaskGroup, Command, PoolShare
+from octopus.dispatcher.model.task import PendingCommands
 from octopus.dispatcher.model.node import BaseNode
+from octopus.dispatcher.model.nodeindex import JobIndex
+from octopus.dispatcher.model.changefeed import ChangeFeed
+from octopus.dispatcher.model.commandstore import CommandStore
+from octopus.dispatcher.model.telemetry import RenderNodeTelemetry
+from octopus.dispatcher.model.capacity import PoolCapacity
 from octopus.dispatcher.strategies import FifoStrategy, loadStrategyClass
 from octopus.core.enums.command import *
 from octopus.dispatcher.rules import RuleError
+from octopus.core import singletonconfig
+from octopus.core import commandrange
 
 
 
@@ -148,6 +156,16 @@ class DispatchTree(object):
         self.toCreateElements = []
         self.toModifyElements = []
         self.toArchiveElements = []
+        # secondary indexes on the jobs (children of the "graphs" folder node) used by the queries
+        self.jobIndex = JobIndex()
+        # revisions of the changes on nodes, commands and rendernodes, for the clients following the changes
+        self.changeFeed = ChangeFeed(singletonconfig.get('CORE', 'CHANGE_FEED_SIZE', 100000))
+        # columnar copy of the status, completion and dates of the commands, for the statistics
+        self.commandStore = CommandStore()
+        # recent history of the system infos and status of the render nodes
+        self.renderNodeTelemetry = RenderNodeTelemetry()
+        # render nodes and cores of the pools by status
+        self.poolCapacity = PoolCapacity(self.pools)
         # listeners
         self.nodeListener = ObjectListener(self.onNodeCreation, self.onNodeDestruction, self.onNodeChange)
         self.taskListener = ObjectListener(self.onTaskCreation, self.onTaskDestruction, self.onTaskChange)
@@ -175,6 +193,7 @@ class DispatchTree(object):
         Pool.changeListeners.remove(self.poolListener)
         Command.changeListeners.remove(self.commandListener)
         PoolShare.changeListeners.remove(self.poolShareListener)
+        self.changeFeed.unregisterModelListeners()
         self.root = None
         self.nodes.clear()
         self.pools.clear()
@@ -182,6 +201,8 @@ class DispatchTree(object):
         self.tasks.clear()
         self.rules = None
         self.commands.clear()
+        self.commandStore.clear()
+        self.renderNodeTelemetry.clear()
         self.poolShares = None
         self.modifiedNodes = None
         self.toCreateElements = None
@@ -203,6 +224,11 @@ class DispatchTree(object):
     def updateCompletionAndStatus(self):
         self.root.updateCompletionAndStatus()
 
+    def getPoolStats(self):
+        '''Render nodes of each pool by state and queue pressure, see PoolCapacity.getStats.'''
+        jobStats = self.jobIndex.stats.getStats(['pool'])['pool']
+        return self.poolCapacity.getStats(dict((pool, counters['readyCommandCount']) for (pool, counters) in jobStats.iteritems()))
+
 
 
     def validateDependencies(self):
@@ -220,10 +246,14 @@ class DispatchTree(object):
                     for cmd in node.task.commands:
                         if cmd.status == CMD_BLOCKED:
                             cmd.status = CMD_READY
+                    if node.task.hasPendingCommands(CMD_BLOCKED):
+                        node.task.setPendingCommandsStatus(CMD_READY)
                 else:
                     for cmd in node.task.commands:
                         if cmd.status == CMD_READY:
                             cmd.status = CMD_BLOCKED
+                    if node.task.hasPendingCommands(CMD_READY):
+                        node.task.setPendingCommandsStatus(CMD_BLOCKED)
 
             # TODO: may be needed to check dependencies on task groups
             #       so far, a hack is done on the client side when submitting:
@@ -242,6 +272,17 @@ class DispatchTree(object):
 
 
     def registerNewGraph(self, graph):
+        nodes = []
+        for step in self.iterRegisterNewGraph(graph, nodes):
+            pass
+        return nodes
+
+    def iterRegisterNewGraph(self, graph, nodes):
+        """
+        Generator registering a new graph step by step, so that the registration of a large graph can be done in
+        several chunks. It yields the number of commands created so far, the created nodes are appended to the
+        given (empty) "nodes" list.
+        """
         user = graph['user']
         taskDefs = graph['tasks']
         poolName = graph['poolName']
@@ -254,12 +295,19 @@ class DispatchTree(object):
         # Create objects.
         #
         tasks = [None for i in xrange(len(taskDefs))]
+        commandCount = 0
         for (index, taskDef) in enumerate(taskDefs):
             if taskDef['type'] == 'Task':
-                task = self._createTaskFromJSON(taskDef, user)
+                task = self._createTaskFromJSON(taskDef, user, createCommands=False)
+                for (description, arguments) in self._iterCommandDefinitions(taskDef, task):
+                    self._createCommand(description, arguments, task)
+                    commandCount += 1
+                    if commandCount % 100 == 0:
+                        yield commandCount
             elif taskDef['type'] == 'TaskGroup':
                 task = self._createTaskGroupFromJSON(taskDef, user)
             tasks[index] = task
+            yield commandCount
         root = tasks[graph['root']]
 
         # get the pool
@@ -298,18 +346,18 @@ class DispatchTree(object):
             logger.warning("graph submitted but no rule has been defined")
 
         unprocessedTasks = [root]
-        nodes = []
         while unprocessedTasks:
             unprocessedTask = unprocessedTasks.pop(0)
             for rule in self.rules:
                 try:
                     nodes += rule.apply(unprocessedTask)
                 except RuleError:
-                    logger.warning("rule %s failed for graph %s" % (rule, graph))
+                    logger.warning("rule %s failed for graph %s" % (rule, graph['name']))
                     raise
             if isinstance(unprocessedTask, TaskGroup):
                 for task in unprocessedTask:
                     unprocessedTasks.append(task)
+            yield commandCount
 
         # create the poolshare, if any, and affect it to the node
         if pool:
@@ -331,7 +379,7 @@ class DispatchTree(object):
 
         # Init number of command in hierarchy
         self.populateCommandCounts(nodes[0])
-        return nodes
+        yield commandCount
 
     def populateCommandCounts(self, node):
         """
@@ -342,7 +390,7 @@ class DispatchTree(object):
             for child in node.children:
                 res += self.populateCommandCounts( child )
         elif isinstance(node, TaskNode):
-            res = len(node.task.commands)
+            res = node.task.getCommandCount()
 
         node.commandCount = res
         return res
@@ -369,7 +417,7 @@ class DispatchTree(object):
         return TaskGroup(id, name, parent, user, arguments, environment, requirements,
                          maxRN, priority, dispatchKey, strategy, tags=tags, timer=timer)
 
-    def _createTaskFromJSON(self, taskDefinition, user):
+    def _createTaskFromJSON(self, taskDefinition, user, createCommands=True):
         # id, name, parent, user, priority, dispatchKey, runner, arguments,
         # validationExpression, commands, requirements=[], minNbCores=1,
         # maxNbCores=0, ramUse=0, environment={}
@@ -393,20 +441,43 @@ class DispatchTree(object):
 
         maxAttempt = taskDefinition.get('maxAttempt', 1)
 
+        # the commands of a large command range are only created when they are about to be dispatched
+        pendingCommands = None
+        if 'commandRange' in taskDefinition:
+            pendingCommands = PendingCommands(taskDefinition['commandRange'])
+            if pendingCommands.count <= singletonconfig.get('CORE', 'COMMAND_WINDOW_SIZE', 100):
+                pendingCommands = None
+
         task = Task(None, name, None, user, maxRN, priority, dispatchKey, runner,
                     arguments, validationExpression, [], requirements, minNbCores,
-                    maxNbCores, ramUse, environment, lic=lic, tags=tags, timer=timer, maxAttempt=maxAttempt)
+                    maxNbCores, ramUse, environment, lic=lic, tags=tags, timer=timer, maxAttempt=maxAttempt,
+                    pendingCommands=pendingCommands)
 
-        for commandDef in taskDefinition['commands']:
-            description = commandDef['description']
-            arguments = commandDef['arguments']
-            cmd = Command(None, description, task, arguments)
-            task.commands.append(cmd)
-            # import sys
-            # logger.warning("cmd creation : %s" % str(sys.getrefcount(cmd)))
+        if createCommands:
+            for (description, arguments) in self._iterCommandDefinitions(taskDefinition, task):
+                self._createCommand(description, arguments, task)
 
         return task
 
+    def _iterCommandDefinitions(self, taskDefinition, task):
+        '''
+        Yields the (description, arguments) of the commands to create for a task definition: the explicit commands,
+        then the ones expanded from the "commandRange" of a task sent in the compact form (see
+        octopus.core.commandrange), unless they are kept as pending commands of the task.
+        '''
+        for commandDef in taskDefinition['commands']:
+            yield commandDef['description'], commandDef['arguments']
+        if 'commandRange' in taskDefinition and task.pendingCommands is None:
+            for command in commandrange.iterCommands(taskDefinition['name'], taskDefinition['arguments'], taskDefinition['commandRange']):
+                yield command
+
+    def _createCommand(self, description, arguments, task):
+        cmd = Command(None, description, task, arguments)
+        task.commands.append(cmd)
+        # import sys
+        # logger.warning("cmd creation : %s" % str(sys.getrefcount(cmd)))
+        return cmd
+
     ## Resets the lists of elements to create or update in the database.
     #
     def resetDbElements(self):
@@ -427,6 +498,7 @@ class DispatchTree(object):
     ## Removes from the dispatchtree the provided element and all its parents and children.
     #
     def unregisterElementsFromTree(self, element):
+        self.changeFeed.recordRemoval(element)
         # /////////////// Handling of the Task
         if isinstance(element, Task):
             del self.tasks[element.id]
@@ -487,6 +559,7 @@ class DispatchTree(object):
         # /////////////// Handling of the Command
         elif isinstance(element, Command):
             del self.commands[element.id]
+            self.commandStore.remove(element)
             self.toArchiveElements.append(element)
 
     ### methods called after interaction with a Task
@@ -512,10 +585,17 @@ class DispatchTree(object):
         However in order to keep track of comments (stored in task's tags[comment] field), we make the following change:
         - enable task/taskgroups update in DB (cf pulidb.py)
         - disable changeEvent (append an event in dispatchTree.toModifyElements array) for all fields of tasks and TGs
-          BUT the only field we want to update: "tags"
+          BUT the fields we want to update: "tags" and "pendingCommands" (commands not created yet)
         """
         if field == "tags":
             self.toModifyElements.append(task)
+            for node in task.nodes.values():
+                self.jobIndex.update(node, "tags")
+        elif field == "pendingCommands":
+            # pending commands created or their status changed
+            self.toModifyElements.append(task)
+            for node in task.nodes.values():
+                node.invalidate()
 
     ### methods called after interaction with a BaseNode
 
@@ -529,6 +609,11 @@ class DispatchTree(object):
             self.nodeMaxId = max(self.nodeMaxId, node.id)
         if node.parent == None:
             node.parent = self.root
+        if node.id == 1 and isinstance(node, FolderNode):
+            # the "graphs" folder node holding the jobs
+            self.jobIndex.attach(node)
+        elif node.parent is self.jobIndex.folder:
+            self.jobIndex.add(node)
 
     def onNodeDestruction(self, node):
         # logger.info("  -- on node destruction: %s" % node)
@@ -541,6 +626,7 @@ class DispatchTree(object):
             self.toModifyElements.append(node)
             if field == "status" and node.reverseDependencies:
                 self.modifiedNodes.append(node)
+            self.jobIndex.update(node, field)
 
     ### methods called after interaction with a RenderNode
 
@@ -552,10 +638,14 @@ class DispatchTree(object):
         else:
             self.renderNodeMaxId = max(self.renderNodeMaxId, renderNode.id)
         self.renderNodes[renderNode.name] = renderNode
+        self.renderNodeTelemetry.add(renderNode)
+        self.poolCapacity.invalidate()
 
     def onRenderNodeDestruction(self, rendernode):
         try:
             del self.renderNodes[rendernode.name]
+            self.renderNodeTelemetry.remove(rendernode)
+            self.poolCapacity.invalidate()
             self.toArchiveElements.append(rendernode)
         except KeyError, e:
             # TOFIX: use of class method vs obj method in changeListener might generate a duplicate call
@@ -564,6 +654,11 @@ class DispatchTree(object):
     def onRenderNodeChange(self, rendernode, field, oldvalue, newvalue):
         if field == "performance":
             self.toModifyElements.append(rendernode)
+        elif field == "status":
+            self.renderNodeTelemetry.recordStatus(rendernode, newvalue)
+            self.poolCapacity.onStatusChange(rendernode, oldvalue, newvalue)
+        elif field in ("pools", "coresNumber"):
+            self.poolCapacity.invalidate()
 
     ### methods called after interaction with a Pool
 
@@ -575,14 +670,18 @@ class DispatchTree(object):
         else:
             self.poolMaxId = max(self.poolMaxId, pool.id)
         self.pools[pool.name] = pool
+        self.poolCapacity.invalidate()
 
     def onPoolDestruction(self, pool):
         del self.pools[pool.name]
         self.toArchiveElements.append(pool)
+        self.poolCapacity.invalidate()
 
     def onPoolChange(self, pool, field, oldvalue, newvalue):
         if pool not in self.toModifyElements:
             self.toModifyElements.append(pool)
+        # the render nodes of the pool have changed
+        self.poolCapacity.invalidate()
 
     ### methods called after interaction with a Command
 
@@ -594,9 +693,11 @@ class DispatchTree(object):
         else:
             self.commandMaxId = max(self.commandMaxId, command.id)
         self.commands[command.id] = command
+        self.commandStore.add(command)
 
     def onCommandChange(self, command, field, oldvalue, newvalue):
         self.toModifyElements.append(command)
+        self.commandStore.update(command, field)
         if command.task is not None:
             for node in command.task.nodes.values():
                 node.invalidate()
@@ -4,12 +4,24 @@ Created on Nov 2, 2009
 @author: Olivier Derpierre
 '''
 
+import logging
+
+
+# default value of getattr for a field which has never been set
+_UNSET = object()
+
 
 class Field(object):
+    '''
+    | A field of a model, the values are stored in a slot of the instances created by the ModelType metaclass.
+    | Reading a field is a plain slot access, setting it fires the change event of the model if the value changes.
+    '''
 
     def __init__(self, allow_null=False):
         self.name = None
         self.allow_null = allow_null
+        # member descriptor of the slot storing the value
+        self.slot = None
 
     def contribute_to_instance(self, instance):
         pass
@@ -23,11 +35,34 @@ class Field(object):
         if getattr(instance, self.name) is None and not self.allow_null:
             raise ValueError("None is not a valid %s value" % self.name)
 
+    # True if the subclass overrides setValue, Model.__setattr__ inlines the default implementation
+    customSetter = False
+
+    def setValue(self, instance, value):
+        '''Sets the value of the field and fires the change event if the value is different from the current one.'''
+        oldvalue = getattr(instance, self.name, _UNSET)
+        if oldvalue is _UNSET:
+            oldvalue = None
+        elif oldvalue == value:
+            return
+        object.__setattr__(instance, self.name, value)
+        # instances are not ready for change events until they have been created (see ModelType.__call__)
+        if getattr(instance, '_changeReady', False):
+            try:
+                instance.fireChangeEvent(instance, self.name, oldvalue, value)
+            except Exception:
+                logging.getLogger("model").exception("error while running event listener")
+
     def __repr__(self):
         return "%s(%r)" % (self.__class__.__name__, self.name)
 
 
 class ModelType(type):
+    '''
+    | Creates a slot for each field declared in a model class.
+    | A model class defining "__slots__" is compact: its instances have no __dict__, all the attributes which are
+    | not fields must be listed in "__slots__". The other model classes keep a __dict__ for their attributes.
+    '''
 
     def __new__(cls, clsname, bases, attributes):
         fields = {}
@@ -35,13 +70,25 @@ class ModelType(type):
             if isinstance(base, ModelType):
                 fields.update(base.FIELDS)
         newfields = dict([(name, value) for (name, value) in attributes.items() if isinstance(value, Field)])
-        fields.update(newfields)
+        if '__slots__' in attributes:
+            slots = list(attributes['__slots__'])
+        elif any(getattr(base, '__dictoffset__', 0) for base in bases):
+            slots = []
+        else:
+            slots = ['__dict__']
         for (name, field) in newfields.items():
             field.name = name
             del attributes[name]
+            if name not in fields:
+                slots.append(name)
+        fields.update(newfields)
+        attributes['__slots__'] = tuple(slots)
         attributes['FIELDS'] = fields
         attributes['changeListeners'] = []
-        return super(ModelType, cls).__new__(cls, clsname, bases, attributes)
+        newcls = super(ModelType, cls).__new__(cls, clsname, bases, attributes)
+        for field in newfields.values():
+            field.slot = getattr(newcls, field.name)
+        return newcls
 
     def __call__(self, *args, **kwargs):
         instance = super(ModelType, self).__call__(*args, **kwargs)
@@ -51,8 +98,14 @@ class ModelType(type):
 
 
 class Model(object):
+    '''
+    | Base class of the objects of the dispatcher model.
+    | The change listeners are registered on the classes (e.g. Command.changeListeners), the listeners of a class
+    | and of its base classes are called for the events of every instance.
+    '''
 
     __metaclass__ = ModelType
+    __slots__ = ('_changeReady', '__weakref__')
 
     id = Field()
 
@@ -63,19 +116,26 @@ class Model(object):
                 setattr(self, key, value)
         for value in self.FIELDS.values():
             value.contribute_to_instance(self)
-        self.changeListeners = []
 
     def __setattr__(self, name, value):
-        if hasattr(self, name) and getattr(self, name) == value:
-            return
-        oldvalue = getattr(self, name, None)
-        super(Model, self).__setattr__(name, value)
-        if name in self.FIELDS:
-            try:
-                self.fireChangeEvent(self, name, oldvalue, value)
-            except Exception:
-                import logging
-                logging.getLogger("model").exception("error while running event listener")
+        field = self.FIELDS.get(name)
+        if field is None:
+            object.__setattr__(self, name, value)
+        elif field.customSetter:
+            field.setValue(self, value)
+        else:
+            # inlined Field.setValue, the most frequent case
+            oldvalue = getattr(self, name, _UNSET)
+            if oldvalue is _UNSET:
+                oldvalue = None
+            elif oldvalue == value:
+                return
+            object.__setattr__(self, name, value)
+            if getattr(self, '_changeReady', False):
+                try:
+                    self.fireChangeEvent(self, name, oldvalue, value)
+                except Exception:
+                    logging.getLogger("model").exception("error while running event listener")
 
     def to_json(self):
         self.validate()
@@ -94,24 +154,17 @@ class Model(object):
 
     @classmethod
     def fireDestructionEvent(cls, obj):
-        if hasattr(cls, 'changeListeners'):
-            # parcourt les changeListeners de classe
-            for changeListener in cls.changeListeners:
-                changeListener.onDestructionEvent(obj)
-        # parcourt les changeListeners d'instance
-        for changeListener in obj.changeListeners:
+        for changeListener in cls.changeListeners:
             changeListener.onDestructionEvent(obj)
 
     @classmethod
     def fireChangeEvent(cls, obj, field, oldvalue, newvalue):
-        if not hasattr(obj, "_changeReady") or not obj._changeReady:
+        if not getattr(obj, "_changeReady", False):
             return
         for base in obj.__class__.__mro__:
             if hasattr(base, 'changeListeners'):
                 for changeListener in base.changeListeners:
                     changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
-        for changeListener in obj.changeListeners:
-            changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
 
 
 class ModelField(Field):
@@ -218,6 +271,16 @@ class DictField(Field):
             return dict(value_dict.items())
 
 
+class ObjectField(Field):
+    '''A field holding an object serialized by its own to_json() method.'''
+
+    def to_json(self, instance):
+        value = Field.to_json(self, instance)
+        if value is None:
+            return None
+        return value.to_json()
+
+
 class StrategyField(Field):
 
     def to_json(self, instance):
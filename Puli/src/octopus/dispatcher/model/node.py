@@ -4,6 +4,8 @@ from weakref import WeakKeyDictionary
 
 from octopus.dispatcher.model.enums import *
 from octopus.dispatcher.model import Task, TaskGroup
+from octopus.core import singletonconfig
+from octopus.dispatcher.profiler import theProfiler
 
 from . import models
 
@@ -36,12 +38,24 @@ class FolderNodeChildrenField(models.Field):
         return [child.id for child in instance.children]
 
 
+class ParentField(models.ModelField):
+    '''Setting the parent of a node moves it in the children of its new parent, no change event is fired.'''
+    customSetter = True
+
+    def setValue(self, instance, value):
+        instance.setParentValue(value)
+
+
 class BaseNode(models.Model):
 
+    __slots__ = ('_parent_value', 'invalidated', 'allocatedRN', 'reverseDependencies', 'lastDependenciesSatisfaction',
+                 'lastDependenciesSatisfactionDispatchCycle', 'readyCommandCount', 'doneCommandCount', 'commandCount',
+                 'averageTimeByFrameList', 'cold')
+
     dispatcher = None
 
     name = models.StringField()
-    parent = models.ModelField(allow_null=True)
+    parent = ParentField(allow_null=True)
     user = models.StringField()
     priority = models.IntegerField()
     dispatchKey = models.FloatField()
@@ -78,8 +92,9 @@ class BaseNode(models.Model):
     def __init__(self, id, name, parent, user, priority, dispatchKey, maxRN, creationTime=None, startTime=None, updateTime=None, endTime=None, status=NODE_READY):
         if not self.dispatcher:
             from octopus.dispatcher.dispatcher import Dispatcher
-            self.dispatcher = Dispatcher(None)
-        self.__dict__['parent'] = None
+            BaseNode.dispatcher = Dispatcher(None)
+        # the parent is set without ParentField.setValue, which needs the current parent
+        object.__setattr__(self, 'parent', None)
         models.Model.__init__(self)
         self.id = int(id) if id is not None else None
         self.name = str(name)
@@ -105,6 +120,8 @@ class BaseNode(models.Model):
         self.readyCommandCount = 0
         self.doneCommandCount = 0
         self.commandCount = 0
+        # the commands of a cold job are released from memory (see octopus.dispatcher.coldstorage)
+        self.cold = False
         self.averageTimeByFrameList = []
         self.averageTimeByFrame = 0.0
         self.minTimeByFrame = 0.0
@@ -163,11 +180,6 @@ class BaseNode(models.Model):
         obj.invalidated = True
         return obj
 
-    def __setattr__(self, name, value):
-        if name == 'parent':
-            self.setParentValue(value)
-        super(BaseNode, self).__setattr__(name, value)
-
     def setParentValue(self, parent):
         if self.parent is parent:
                 return
@@ -175,7 +187,7 @@ class BaseNode(models.Model):
                 self.parent.removeChild(self, False)
         if parent:
                 parent.addChild(self, False)
-        self.__dict__['parent'] = parent
+        object.__setattr__(self, 'parent', parent)
 
     def dispatchIterator(self):
         raise NotImplementedError
@@ -293,6 +305,10 @@ class FolderNode(BaseNode):
             for command in child.cmdIterator():
                 yield command
 
+    def cancelPendingCommands(self):
+        for child in self.children:
+            child.cancelPendingCommands()
+
 
         # if pCascadeUpdate:
         #     for dependingNode in self.reverseDependencies:
@@ -370,7 +386,9 @@ class FolderNode(BaseNode):
             completion = 0.0
             status = defaultdict(int)
             for child in self.children:
-                child.updateCompletionAndStatus()
+                # the values of a cold job are kept from its last update
+                if not child.cold:
+                    child.updateCompletionAndStatus()
                 completion += child.completion
                 status[child.status] += 1
                 self.readyCommandCount += child.readyCommandCount
@@ -491,6 +509,8 @@ class FolderNode(BaseNode):
 
 class TaskNode(BaseNode):
 
+    __slots__ = ()
+
     task = models.ModelField()
     paused = models.BooleanField()
     maxAttempt = models.IntegerField()
@@ -524,9 +544,17 @@ class TaskNode(BaseNode):
 
     def cmdIterator(self):
         # LOGGER.debug("Iterator on TaskNode %s" % (self.name))
+        self.dispatcher.coldStorage.thaw(self)
         for command in self.task.commands:
             yield command
 
+    def cancelPendingCommands(self):
+        """
+        The commands not created yet are not given by cmdIterator, they are canceled without being created.
+        """
+        if self.status != NODE_DONE:
+            self.task.setPendingCommandsStatus(CMD_CANCELED)
+
 
     def dispatchIterator(self, stopFunc, ep=None):
 
@@ -539,9 +567,7 @@ class TaskNode(BaseNode):
             return
         # ensure we are treating the commands in the order they arrived
         sorted(self.task.commands, key=lambda x: x.id)
-        for command in self.task.commands:
-            if command.status != CMD_READY:
-                continue
+        for command in self.iterReadyCommands():
             renderNode = self.reserve_rendernode(command, ep)
             if renderNode:
                 # command.assignment_date = time()
@@ -558,6 +584,19 @@ class TaskNode(BaseNode):
                 # LOGGER.debug("Reservation failed in task %s for command %d" % self.name, command.id)
                 return
 
+    def iterReadyCommands(self):
+        """
+        Yields the ready commands of the task. Once the created ones are exhausted, the pending commands of the
+        task are created by windows of CORE.COMMAND_WINDOW_SIZE commands.
+        """
+        for command in self.task.commands:
+            if command.status == CMD_READY:
+                yield command
+        windowSize = singletonconfig.get('CORE', 'COMMAND_WINDOW_SIZE', 100)
+        while self.task.hasPendingCommands(CMD_READY):
+            for command in self.task.materializeCommands(windowSize):
+                yield command
+
     def reserve_rendernode(self, command, ep):
         if ep is None:
             ep = self
@@ -566,7 +605,9 @@ class TaskNode(BaseNode):
             rnList = sorted(poolshare.pool.renderNodes, key=lambda rn: rn.performance, reverse=True)
             for rendernode in rnList:
                 if rendernode.isAvailable() and rendernode.canRun(command):
-                    if rendernode.reserveLicense(command, self.dispatcher.licenseManager):
+                    with theProfiler.span("reserveLicense"):
+                        reserved = rendernode.reserveLicense(command, self.dispatcher.licenseManager)
+                    if reserved:
                         rendernode.addAssignment(command)
                         return rendernode
                     else:
@@ -601,8 +642,16 @@ class TaskNode(BaseNode):
             if command.status == CMD_DONE:
                 self.doneCommandCount += 1
 
-        if self.task.commands:
-            self.completion = completion / len(self.task.commands)
+        # the pending commands are not created yet, they all have the same status and no completion
+        pending = self.task.pendingCommands
+        if pending is not None:
+            status[pending.status] += pending.count
+            if pending.status == CMD_READY:
+                self.readyCommandCount += pending.count
+
+        commandCount = self.task.getCommandCount()
+        if commandCount:
+            self.completion = completion / commandCount
         else:
             self.completion = 1.0
 
@@ -670,6 +719,7 @@ class TaskNode(BaseNode):
     def setPaused(self, paused):
         # pause every job not done
         if self.status != NODE_DONE:
+            self.dispatcher.coldStorage.thaw(self)
             self.paused = paused
         if self.status == NODE_PAUSED and not paused:
             self.status = NODE_READY
@@ -698,6 +748,7 @@ class TaskNode(BaseNode):
 
 
         self.completion = 0
+        # the commands of a cold job are not loaded back, the restart (setStatus) resets the loaded commands
         for command in self.task.commands:
             command.completion = 0
 
@@ -715,13 +766,17 @@ class TaskNode(BaseNode):
                 dependingNode.setStatus( pStatus )
 
         if pStatus == NODE_CANCELED and self.status != NODE_DONE:
+            self.dispatcher.coldStorage.thaw(self)
             for command in self.task.commands:
                 command.cancel()
+            self.task.setPendingCommandsStatus(CMD_CANCELED)
         elif pStatus == NODE_READY and self.status != NODE_RUNNING:
+            self.dispatcher.coldStorage.thaw(self)
             if any(isRunningStatus(command.status) for command in self.task.commands):
                 return False
             for command in self.task.commands:
                 command.setReadyStatus()
+            self.task.setPendingCommandsStatus(CMD_READY)
         elif pStatus in (NODE_DONE, NODE_ERROR, NODE_BLOCKED, NODE_RUNNING):
             return False
         return True
@@ -0,0 +1,433 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Secondary indexes on the jobs of the dispatch tree (i.e. the children of the "graphs" folder node).
+
+The queries of the webservice (/query, /edit/*) filter the jobs on a few attributes. Instead of scanning every
+job for each constraint, the index keeps:
+  - a hash index (value -> set of job ids) for the user, the prod tag and the status
+  - a sorted list of (timestamp, id) for the creation, start and end times, queried with bisect
+  - a sorted list of (timestamp, id) for the finish time of the done and canceled jobs (see finishTime)
+  - the counters of the jobs grouped by user, pool and tags, used by /stats/aggregate (see JobStats)
+
+The index is updated by the dispatch tree listeners: jobs are added/removed when they are attached to or
+detached from the graphs folder, and moved between buckets when one of the indexed fields changes.
+
+A benchmark comparing the scan and the indexed query is available with:
+    python -m octopus.dispatcher.model.nodeindex [nbJobs]
+'''
+
+import logging
+from bisect import bisect_left, insort
+
+from octopus.core.enums.node import NODE_BLOCKED, NODE_READY, NODE_RUNNING, NODE_DONE, NODE_ERROR, NODE_CANCELED, NODE_PAUSED
+
+LOGGER = logging.getLogger("dispatcher.nodeindex")
+
+HASH_FIELDS = ('user', 'status')
+TIME_FIELDS = ('creationTime', 'startTime', 'endTime')
+FINISHED_STATUS = (NODE_DONE, NODE_CANCELED)
+# fields the finish time of a job is computed from
+FINISH_FIELDS = ('status', 'endTime', 'updateTime')
+# fields holding the task or taskgroup a node gets its tags from
+TAGS_FIELDS = ('task', 'taskGroup', 'tags')
+
+
+class JobIndex(object):
+    '''
+    | Indexes the direct children of a folder node, the folder is given by attach().
+    | Only ids are stored in the buckets, nodes are retrieved with getNodes().
+    '''
+
+    def __init__(self):
+        self.folder = None
+        self.byId = {}
+        self.byField = dict((field, {}) for field in HASH_FIELDS + ('prod',))
+        self.byTime = dict((field, []) for field in TIME_FIELDS + ('finishTime',))
+        # values currently indexed for each job, needed to remove a job from its buckets
+        self.indexedValues = {}
+        # counters of the jobs by group, for the statistics
+        self.stats = JobStats()
+
+    def __len__(self):
+        return len(self.byId)
+
+    def __contains__(self, node):
+        return self.byId.get(node.id) is node
+
+    def attach(self, folder):
+        '''Indexes the children of the given folder and follows its child added/removed events.'''
+        if self.folder is not None and self in self.folder.changeListeners:
+            self.folder.changeListeners.remove(self)
+        self.folder = folder
+        folder.changeListeners.append(self)
+        self.rebuild()
+
+    def rebuild(self):
+        '''Recomputes the whole index from the children of the folder (e.g. after a reload from the database).'''
+        self.byId.clear()
+        self.indexedValues.clear()
+        self.stats.clear()
+        for buckets in self.byField.values():
+            buckets.clear()
+        for sortedList in self.byTime.values():
+            del sortedList[:]
+        if self.folder is None:
+            return
+        for child in self.folder.children:
+            self.add(child, sort=False)
+        for sortedList in self.byTime.values():
+            sortedList.sort()
+
+    def add(self, node, sort=True):
+        if node.id is None or node.id in self.byId:
+            return
+        self.byId[node.id] = node
+        values = {}
+        for field in HASH_FIELDS:
+            values[field] = getattr(node, field, None)
+        values['prod'] = self._prod(node)
+        for field in TIME_FIELDS:
+            values[field] = getattr(node, field, None)
+        values['finishTime'] = self.finishTime(node)
+        self.indexedValues[node.id] = values
+
+        for field in HASH_FIELDS + ('prod',):
+            self.byField[field].setdefault(values[field], set()).add(node.id)
+        for field in TIME_FIELDS + ('finishTime',):
+            if values[field] is None:
+                continue
+            if sort:
+                insort(self.byTime[field], (values[field], node.id))
+            else:
+                self.byTime[field].append((values[field], node.id))
+        self.stats.add(node)
+
+    def remove(self, node):
+        if self.byId.get(node.id) is not node:
+            return
+        del self.byId[node.id]
+        values = self.indexedValues.pop(node.id)
+        for field in HASH_FIELDS + ('prod',):
+            self._removeFromBucket(field, values[field], node.id)
+        for field in TIME_FIELDS + ('finishTime',):
+            self._removeFromSortedList(field, values[field], node.id)
+        self.stats.remove(node)
+
+    def update(self, node, field):
+        '''Moves a job to the buckets matching the current value of the given field, if it is indexed.'''
+        if self.byId.get(node.id) is not node:
+            return
+        self.stats.update(node, field)
+        values = self.indexedValues[node.id]
+        if field in HASH_FIELDS:
+            self._move(node.id, values, field, getattr(node, field, None))
+        elif field in TIME_FIELDS:
+            self._moveTime(node.id, values, field, getattr(node, field, None))
+        elif field in TAGS_FIELDS:
+            self._move(node.id, values, 'prod', self._prod(node))
+        if field in FINISH_FIELDS:
+            self._moveTime(node.id, values, 'finishTime', self.finishTime(node))
+
+    ## Listener of the indexed folder node
+    # The instance listeners of a node may be shared with its class (see Model.__init__), the events of the
+    # other folders are ignored.
+    #
+    def onChildAddedEvent(self, folder, child):
+        # a node being created is not ready yet, it is added by the dispatch tree creation listener once its id is set
+        if folder is self.folder and getattr(child, '_changeReady', False):
+            self.add(child)
+
+    def onChildRemovedEvent(self, folder, child):
+        if folder is self.folder:
+            self.remove(child)
+
+    def onCreationEvent(self, obj):
+        pass
+
+    def onChangeEvent(self, obj, field, oldvalue, newvalue):
+        pass
+
+    def onDestructionEvent(self, obj):
+        pass
+
+    ## Queries
+    #
+    def idsWithValues(self, field, values):
+        '''Returns the ids of the jobs whose field (user, status or prod) is one of the given values.'''
+        buckets = self.byField[field]
+        result = set()
+        for value in values:
+            bucket = buckets.get(value)
+            if bucket:
+                result.update(bucket)
+        return result
+
+    def countWithValues(self, field, values):
+        buckets = self.byField[field]
+        return sum(len(buckets.get(value, ())) for value in values)
+
+    def idsAfter(self, field, timestamp):
+        '''Returns the ids of the jobs whose time field is greater or equal to the timestamp.'''
+        sortedList = self.byTime[field]
+        return set(jobId for (value, jobId) in sortedList[bisect_left(sortedList, (timestamp,)):])
+
+    def countAfter(self, field, timestamp):
+        sortedList = self.byTime[field]
+        return len(sortedList) - bisect_left(sortedList, (timestamp,))
+
+    def idsBefore(self, field, timestamp):
+        '''Returns the ids of the jobs whose time field is lower than the timestamp, in increasing time order.'''
+        sortedList = self.byTime[field]
+        return [jobId for (value, jobId) in sortedList[:bisect_left(sortedList, (timestamp,))]]
+
+    def finishTime(self, node):
+        '''
+        Returns the time a job was finished, None if it is not done nor canceled. The end time is only set on the
+        done nodes, the last update time is used for the canceled ones.
+        '''
+        if getattr(node, 'status', None) not in FINISHED_STATUS:
+            return None
+        endTime = getattr(node, 'endTime', None)
+        if endTime is not None:
+            return endTime
+        return getattr(node, 'updateTime', None)
+
+    def getNodes(self, ids):
+        '''Returns the jobs with the given ids, sorted by id (i.e. by submission order).'''
+        return [self.byId[jobId] for jobId in sorted(ids) if jobId in self.byId]
+
+    ## Internals
+    #
+    def _prod(self, node):
+        try:
+            return node.tags.get('prod')
+        except AttributeError:
+            return None
+
+    def _move(self, jobId, values, field, newValue):
+        oldValue = values[field]
+        if newValue == oldValue:
+            return
+        self._removeFromBucket(field, oldValue, jobId)
+        self.byField[field].setdefault(newValue, set()).add(jobId)
+        values[field] = newValue
+
+    def _moveTime(self, jobId, values, field, newValue):
+        if newValue == values[field]:
+            return
+        self._removeFromSortedList(field, values[field], jobId)
+        values[field] = newValue
+        if newValue is not None:
+            insort(self.byTime[field], (newValue, jobId))
+
+    def _removeFromBucket(self, field, value, jobId):
+        buckets = self.byField[field]
+        bucket = buckets.get(value)
+        if bucket is not None:
+            bucket.discard(jobId)
+            if not bucket:
+                del buckets[value]
+
+    def _removeFromSortedList(self, field, value, jobId):
+        if value is None:
+            return
+        sortedList = self.byTime[field]
+        position = bisect_left(sortedList, (value, jobId))
+        if position < len(sortedList) and sortedList[position] == (value, jobId):
+            del sortedList[position]
+        else:
+            LOGGER.warning("Job %d not found in the %s index" % (jobId, field))
+
+
+class JobStats(object):
+    '''
+    | Counters of the jobs grouped by user, pool and tags (prod, step, type, shot), kept up to date by the job index.
+    | Only the jobs that are not done nor canceled are counted (as the queue statistics of grab_queue_stats).
+    |
+    | The groups and the status of a job are updated when the job changes. The allocatedRN and readyCommandCount of
+    | the nodes are not model fields (they are computed by the dispatcher cycle without change events), they are
+    | synchronized when the counters are read, as the pool of a job whose poolshares have been replaced.
+    '''
+
+    DIMENSIONS = ('user', 'pool', 'prod', 'step', 'type', 'shot')
+    COUNTERS = ('jobs', 'ready', 'running', 'err', 'paused', 'allocatedRN', 'readyCommandCount')
+    # counter incremented for each job status
+    STATUS_COUNTERS = {NODE_BLOCKED: 'ready', NODE_READY: 'ready', NODE_RUNNING: 'running', NODE_ERROR: 'err',
+                       NODE_PAUSED: 'paused'}
+    # fields changing the groups or the status of a job
+    FIELDS = ('user', 'status', 'poolShares') + TAGS_FIELDS
+
+    def __init__(self):
+        # dimension -> group -> counter -> value
+        self.groups = dict((dimension, {}) for dimension in self.DIMENSIONS)
+        self.total = dict((counter, 0) for counter in self.COUNTERS)
+        # job id -> (job, groups, statusCounter, allocatedRN, readyCommandCount) of the counted jobs
+        self.counted = {}
+        # jobs to count again at the next synchronization
+        self.dirty = {}
+
+    def clear(self):
+        for groups in self.groups.values():
+            groups.clear()
+        for counter in self.COUNTERS:
+            self.total[counter] = 0
+        self.counted.clear()
+        self.dirty.clear()
+
+    def add(self, job):
+        self._count(job)
+
+    def remove(self, job):
+        self.dirty.pop(job.id, None)
+        self._uncount(job.id)
+
+    def update(self, job, field):
+        if field not in self.FIELDS:
+            return
+        if field == 'poolShares':
+            # the new poolshare is put in the dict after the event, the pool is read at the next synchronization
+            self.dirty[job.id] = job
+        else:
+            self._uncount(job.id)
+            self._count(job)
+
+    def sync(self):
+        '''Counts the dirty jobs again and updates the allocatedRN and readyCommandCount counters.'''
+        for job in self.dirty.values():
+            self._uncount(job.id)
+            self._count(job)
+        self.dirty.clear()
+        for (jobId, (job, groups, statusCounter, allocatedRN, readyCommandCount)) in self.counted.items():
+            if job.allocatedRN != allocatedRN or job.readyCommandCount != readyCommandCount:
+                self._add(groups, 'allocatedRN', job.allocatedRN - allocatedRN)
+                self._add(groups, 'readyCommandCount', job.readyCommandCount - readyCommandCount)
+                self.counted[jobId] = (job, groups, statusCounter, job.allocatedRN, job.readyCommandCount)
+
+    def getStats(self, dimensions):
+        '''Returns the counters of each group of the given dimensions and the total.'''
+        self.sync()
+        result = {'total': dict(self.total)}
+        for dimension in dimensions:
+            result[dimension] = dict((group, dict(counters)) for (group, counters) in self.groups[dimension].iteritems())
+        return result
+
+    def _groups(self, job):
+        tags = getattr(job, 'tags', None) or {}
+        try:
+            pool = job.poolShares.keys()[0].name
+        except (AttributeError, IndexError):
+            pool = ''
+        return {'user': job.user, 'pool': pool, 'prod': tags.get('prod', ''), 'step': tags.get('step', ''),
+                'type': tags.get('type', ''), 'shot': tags.get('shot', '')}
+
+    def _count(self, job):
+        if job.status in (NODE_DONE, NODE_CANCELED):
+            return
+        groups = self._groups(job)
+        statusCounter = self.STATUS_COUNTERS.get(job.status)
+        self.counted[job.id] = (job, groups, statusCounter, job.allocatedRN, job.readyCommandCount)
+        self._add(groups, 'jobs', 1)
+        if statusCounter is not None:
+            self._add(groups, statusCounter, 1)
+        self._add(groups, 'allocatedRN', job.allocatedRN)
+        self._add(groups, 'readyCommandCount', job.readyCommandCount)
+
+    def _uncount(self, jobId):
+        entry = self.counted.pop(jobId, None)
+        if entry is None:
+            return
+        job, groups, statusCounter, allocatedRN, readyCommandCount = entry
+        self._add(groups, 'jobs', -1)
+        if statusCounter is not None:
+            self._add(groups, statusCounter, -1)
+        self._add(groups, 'allocatedRN', -allocatedRN)
+        self._add(groups, 'readyCommandCount', -readyCommandCount)
+        for (dimension, group) in groups.iteritems():
+            counters = self.groups[dimension].get(group)
+            if counters is not None and counters['jobs'] == 0:
+                del self.groups[dimension][group]
+
+    def _add(self, groups, counter, value):
+        if not value:
+            return
+        self.total[counter] += value
+        for (dimension, group) in groups.iteritems():
+            counters = self.groups[dimension].get(group)
+            if counters is None:
+                counters = self.groups[dimension][group] = dict((name, 0) for name in self.COUNTERS)
+            counters[counter] += value
+
+
+def _benchmark(nbJobs=100000, nbQueries=20):
+    '''
+    Compares the time of typical queries on a fake dispatch tree with and without the index.
+    Usage: python -m octopus.dispatcher.model.nodeindex [nbJobs]
+    '''
+    import time
+    import random
+    from octopus.dispatcher.model.nodequery import IQueryNode
+
+    class FakePool(object):
+        def __init__(self, name):
+            self.name = name
+
+    class FakeJob(object):
+        def __init__(self, id, user, prod, status, creationTime, pool):
+            self.id = id
+            self.name = "job_%d" % id
+            self.user = user
+            self.status = status
+            self.tags = {'prod': prod}
+            self.poolShares = {pool: None}
+            self.creationTime = creationTime
+            self.startTime = creationTime + 60 if status != 1 else None
+            self.endTime = creationTime + 3600 if status == 5 else None
+            self.allocatedRN = random.randint(1, 10) if status == 2 else 0
+            self.readyCommandCount = random.randint(0, 100) if status in (1, 2) else 0
+
+    class FakeFolder(object):
+        def __init__(self, children):
+            self.children = children
+            self.changeListeners = []
+
+    users = ["user%d" % i for i in xrange(50)]
+    prods = ["prod%d" % i for i in xrange(10)]
+    pools = [FakePool("pool%d" % i) for i in xrange(5)]
+    now = int(time.time())
+    jobs = [FakeJob(id, random.choice(users), random.choice(prods), random.choice(range(7)), now - random.randint(0, 30 * 86400),
+                    random.choice(pools))
+            for id in xrange(2, nbJobs + 2)]
+
+    startTime = time.time()
+    index = JobIndex()
+    index.attach(FakeFolder(jobs))
+    print "index of %d jobs built in %.3fs" % (nbJobs, time.time() - startTime)
+
+    day = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - 86400))
+    queries = [
+        {'constraint_user': ['user1']},
+        {'constraint_user': ['user1', 'user2'], 'constraint_status': ['2']},
+        {'constraint_prod': ['prod3'], 'constraint_status': ['1', '2']},
+        {'constraint_creationtime': [day]},
+        {'constraint_user': ['user4'], 'constraint_creationtime': [day], 'constraint_name': ['job_1']},
+        {'constraint_id': [str(random.randint(2, nbJobs)) for i in xrange(100)]},
+    ]
+    query = IQueryNode()
+    for args in queries:
+        startTime = time.time()
+        for i in xrange(nbQueries):
+            scanned = query.filterNodes(args, jobs)
+        scanTime = (time.time() - startTime) / nbQueries
+        startTime = time.time()
+        for i in xrange(nbQueries):
+            indexed = query.filterNodes(args, jobs, index)
+        indexTime = (time.time() - startTime) / nbQueries
+        assert [job.id for job in scanned] == [job.id for job in indexed]
+        print "%-70s scan: %7.2fms  index: %7.2fms  (%d jobs)" % (", ".join(sorted(args)), scanTime * 1000, indexTime * 1000, len(indexed))
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(*[int(arg) for arg in sys.argv[1:2]])
@@ -21,13 +21,37 @@ __all__ = []
 logger = logging.getLogger('dispatcher.webservice')
 
 
+# compiled name constraints, a client polling with the same filter does not recompile the regex
+NAME_REGEX_CACHE = {}
+NAME_REGEX_CACHE_SIZE = 100
+
+
+def getNameRegex( names ):
+    """
+    Returns the compiled alternation of the given name patterns (matched at the beginning of the name)
+    :raise HTTPError: 400 if a pattern is invalid
+    """
+    key = tuple(names)
+    regex = NAME_REGEX_CACHE.get(key)
+    if regex is None:
+        try:
+            regex = re.compile( '|'.join(names) )
+        except re.error, e:
+            logger.warning('Error: invalid name constraint %s (%s)' % (names, e) )
+            raise HTTPError(400, 'Invalid name constraint')
+        if len(NAME_REGEX_CACHE) >= NAME_REGEX_CACHE_SIZE:
+            NAME_REGEX_CACHE.clear()
+        NAME_REGEX_CACHE[key] = regex
+    return regex
+
+
 class QueryError(Exception):
     pass
 
 class IQueryNode:
 
 
-    def filterNodes( self, pFilterArgs, pNodes ):
+    def filterNodes( self, pFilterArgs, pNodes, pIndex=None ):
         """
         Returns a reduced list of nodes according to the given filter arguments (pFilterArgs)
         Filtering works on direct attributes of every nodes: status, user, name, creationtime
@@ -42,97 +66,93 @@ class IQueryNode:
 
           The resulting list will contain all jobs from user 'jsa' or 'render', having the status '1' or '2'
           i.e.: (user == jsa OR user == render) AND (status == 1 OR status == 2)
+
+        If a JobIndex of pNodes is given (pIndex), the candidates are taken from the most selective indexed constraint
+        and only them are checked against the other constraints. The resulting nodes are then sorted by id.
         """
+        constraints = []
 
         if 'constraint_id' in pFilterArgs:
-            filteredIds = [int(id) for id in pFilterArgs['constraint_id']]
-            pNodes = [child for child in pNodes if child.id in filteredIds]
-            logger.info( "-- Filtering on id list %s, nb remaining nodes: %d", pFilterArgs['constraint_id'], len(pNodes) )
+            filteredIds = set(int(id) for id in pFilterArgs['constraint_id'])
+            constraints.append( ('id', filteredIds, lambda child: child.id in filteredIds) )
 
         if 'constraint_status' in pFilterArgs:
-            statusList = [int(status) for status in pFilterArgs['constraint_status']]
-            pNodes = [child for child in pNodes if child.status in statusList]
-            logger.info( "-- Filtering on status %s, nb remaining nodes: %d", pFilterArgs['constraint_status'], len(pNodes) )
+            statusList = set(int(status) for status in pFilterArgs['constraint_status'])
+            constraints.append( ('status', statusList, lambda child: child.status in statusList) )
 
         if 'constraint_user' in pFilterArgs:
-            pNodes = [child for child in pNodes if child.user in pFilterArgs['constraint_user']]
-            logger.info( "-- Filtering on user %s, nb remaining nodes: %d", pFilterArgs['constraint_user'], len(pNodes) )
+            userList = set(pFilterArgs['constraint_user'])
+            constraints.append( ('user', userList, lambda child: child.user in userList) )
 
         if 'constraint_prod' in pFilterArgs:
-            filteredNodes = []
-            for child in pNodes:
-             	if child.tags.get('prod') in pFilterArgs['constraint_prod']:
-             		filteredNodes += [child]
-            pNodes = filteredNodes
-            logger.info( "-- Filtering on prod %s, nb remaining nodes: %d", pFilterArgs['constraint_prod'], len(pNodes) )
-
-        # WARNING: regexp matching constraint can take some time
-        # TO IMPROVE
-        if 'constraint_name' in pFilterArgs:
-            nameRegex = '|'.join( pFilterArgs['constraint_name'] )
-            pNodes = [child for child in pNodes if re.match( nameRegex, child.name ) ]
-            logger.info( "-- Filtering on name %s, nb remaining nodes: %d", pFilterArgs['constraint_name'], len(pNodes) )
-
-        if 'constraint_creationtime' in pFilterArgs:
-            if len(pFilterArgs['constraint_creationtime']) > 1:
-                logger.info( "More than one date specified, first occurence is used: %s" % str(pFilterArgs['constraint_creationtime'][0]) )
-            try:
-                filterTimestamp = datetime.strptime( pFilterArgs['constraint_creationtime'][0], "%Y-%m-%d %H:%M:%S" ).strftime('%s')
-                pNodes = [child for child in pNodes if child.creationTime >= int(filterTimestamp)]
-
-                logger.info( "-- Filtering on date %s (e.g. timestamp=%d), nb remaining nodes: %d", pFilterArgs['constraint_creationtime'][0], 
-                    int(filterTimestamp), len(pNodes) )
-
-            except ValueError:
-                logger.warning('Error: invalid date format, the format definition is "YYYY-mm-dd HH:MM:SS"' )
-                raise HTTPError(400, 'Invalid date format')
-            except Exception:
-                logger.warning('Error parsing date constraint')
-                raise HTTPError(400, 'Error when parsing date constraint')
-
-
-        if 'constraint_starttime' in pFilterArgs:
-            if len(pFilterArgs['constraint_starttime']) > 1:
-                logger.info( "More than one date specified, first occurence is used: %s" % str(pFilterArgs['constraint_starttime'][0]) )
-            try:
-                filterTimestamp = datetime.strptime( pFilterArgs['constraint_starttime'][0], "%Y-%m-%d %H:%M:%S" ).strftime('%s')
-                pNodes = [child for child in pNodes if child.startTime >= int(filterTimestamp)]
-
-                logger.info( "-- Filtering on date %s (e.g. timestamp=%d), nb remaining nodes: %d", pFilterArgs['constraint_starttime'][0], 
-                    int(filterTimestamp), len(pNodes) )
+            prodList = set(pFilterArgs['constraint_prod'])
+            constraints.append( ('prod', prodList, lambda child: child.tags.get('prod') in prodList) )
 
-            except ValueError:
-                logger.warning('Error: invalid date format, the format definition is "YYYY-mm-dd HH:MM:SS"' )
-                raise HTTPError(400, 'Invalid date format')
-            except Exception:
-                logger.warning('Error parsing date constraint')
-                raise HTTPError(400, 'Error when parsing date constraint')
+        for (arg, field) in (('constraint_creationtime', 'creationTime'), ('constraint_starttime', 'startTime'), ('constraint_endtime', 'endTime')):
+            if arg in pFilterArgs:
+                filterTimestamp = self._parseDateConstraint( pFilterArgs, arg )
+                constraints.append( (field, filterTimestamp, lambda child, field=field, ts=filterTimestamp: getattr(child, field) >= ts) )
 
+        if pIndex is not None and constraints:
+            pNodes = self._filterWithIndex( constraints, pIndex )
+        else:
+            for (field, value, predicate) in constraints:
+                pNodes = [child for child in pNodes if predicate(child)]
+                logger.info( "-- Filtering on %s %s, nb remaining nodes: %d", field, value, len(pNodes) )
 
-        if 'constraint_endtime' in pFilterArgs:
-            if len(pFilterArgs['constraint_endtime']) > 1:
-                logger.info( "More than one date specified, first occurence is used: %s" % str(pFilterArgs['constraint_endtime'][0]) )
-            try:
-                filterTimestamp = datetime.strptime( pFilterArgs['constraint_endtime'][0], "%Y-%m-%d %H:%M:%S" ).strftime('%s')
-                pNodes = [child for child in pNodes if child.endTime >= int(filterTimestamp)]
-
-                logger.info( "-- Filtering on date %s (e.g. timestamp=%d), nb remaining nodes: %d", pFilterArgs['constraint_endtime'][0], 
-                    int(filterTimestamp), len(pNodes) )
-
-            except ValueError:
-                logger.warning('Error: invalid date format, the format definition is "YYYY-mm-dd HH:MM:SS"' )
-                raise HTTPError(400, 'Invalid date format')
-            except Exception:
-                logger.warning('Error parsing date constraint')
-                raise HTTPError(400, 'Error when parsing date constraint')
-
+        if 'constraint_name' in pFilterArgs:
+            nameRegex = getNameRegex( pFilterArgs['constraint_name'] )
+            pNodes = [child for child in pNodes if nameRegex.match( child.name ) ]
+            logger.info( "-- Filtering on name %s, nb remaining nodes: %d", pFilterArgs['constraint_name'], len(pNodes) )
 
         return pNodes
-        pass
 
 
+    def _filterWithIndex( self, constraints, pIndex ):
+        """
+        Intersects the constraints using the index: the ids matching the most selective constraint are retrieved
+        from the index, the other constraints are checked on these candidates only.
+        """
+        def estimate( constraint ):
+            field, value, predicate = constraint
+            if field == 'id':
+                return len(value)
+            if field in ('status', 'user', 'prod'):
+                return pIndex.countWithValues( field, value )
+            return pIndex.countAfter( field, value )
+
+        constraints = sorted( constraints, key=estimate )
+        field, value, predicate = constraints[0]
+        if field == 'id':
+            candidates = set(value)
+        elif field in ('status', 'user', 'prod'):
+            candidates = pIndex.idsWithValues( field, value )
+        else:
+            candidates = pIndex.idsAfter( field, value )
+
+        nodes = pIndex.getNodes( candidates )
+        logger.info( "-- Filtering on %s %s with index, nb remaining nodes: %d", field, value, len(nodes) )
+        for field, value, predicate in constraints[1:]:
+            nodes = [child for child in nodes if predicate(child)]
+            logger.info( "-- Filtering on %s %s, nb remaining nodes: %d", field, value, len(nodes) )
+        return nodes
 
 
+    def _parseDateConstraint( self, pFilterArgs, arg ):
+        """
+        Returns the timestamp of a date constraint given as "YYYY-mm-dd HH:MM:SS"
+        :raise HTTPError: 400 if the date is invalid
+        """
+        if len(pFilterArgs[arg]) > 1:
+            logger.info( "More than one date specified, first occurence is used: %s" % str(pFilterArgs[arg][0]) )
+        try:
+            return int(datetime.strptime( pFilterArgs[arg][0], "%Y-%m-%d %H:%M:%S" ).strftime('%s'))
+        except ValueError:
+            logger.warning('Error: invalid date format, the format definition is "YYYY-mm-dd HH:MM:SS"' )
+            raise HTTPError(400, 'Invalid date format')
+        except Exception:
+            logger.warning('Error parsing date constraint')
+            raise HTTPError(400, 'Error when parsing date constraint')
 
 
     def filterRenderNodes( self, pFilterArgs, pNodes ):
@@ -168,8 +188,8 @@ class IQueryNode:
         # WARNING: regexp matching constraint can take some time
         # TO IMPROVE
         if 'constraint_name' in pFilterArgs:
-            nameRegex = '|'.join( pFilterArgs['constraint_name'] )
-            pNodes = [child for child in pNodes if re.match( nameRegex, child.name ) ]
+            nameRegex = getNameRegex( pFilterArgs['constraint_name'] )
+            pNodes = [child for child in pNodes if nameRegex.match( child.name ) ]
             logger.info( "-- Filtering on name %s, nb remaining render nodes: %d", pFilterArgs['constraint_name'], len(pNodes) )
 
 
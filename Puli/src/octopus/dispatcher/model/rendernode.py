@@ -31,6 +31,9 @@ logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(logging.W
 #
 class RenderNode(models.Model):
 
+    __slots__ = ('licenseManager', 'responseId', 'idInformed', 'httpConnection', 'currentpoolshare', 'history',
+                 'tasksHistory', 'cores', 'ram')
+
     # Sys infos
     name = models.StringField()
     speed = models.FloatField()
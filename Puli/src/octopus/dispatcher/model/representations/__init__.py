@@ -39,6 +39,7 @@ TASK_JOBTYPE = "runner"
 TASK_ARGUMENTS = "arguments"
 TASK_REQUIREMENTS = "requirements"
 TASK_ENVIRONMENT = "environment"
+TASK_PENDING_COMMANDS = "pendingCommands"
 
 
 def TaskRepresentation(task):
@@ -53,4 +54,5 @@ def TaskRepresentation(task):
         TASK_ARGUMENTS: task.arguments.copy(),
         TASK_REQUIREMENTS: task.requirements.copy(),
         TASK_ENVIRONMENT: task.environment.copy(),
+        TASK_PENDING_COMMANDS: task.pendingCommands.to_json() if task.pendingCommands is not None else None,
     }
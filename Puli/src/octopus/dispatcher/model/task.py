@@ -1,7 +1,10 @@
 from .models import (Model, StringField, ModelField, DictField, IntegerField, FloatField,
-                     ModelListField, ModelDictField)
+                     ModelListField, ModelDictField, ObjectField)
 from .enums import NODE_BLOCKED, NODE_CANCELED, NODE_DONE, NODE_ERROR, NODE_PAUSED, NODE_READY, NODE_RUNNING
+from octopus.core.enums.command import CMD_READY
+from octopus.core import commandrange
 from collections import defaultdict
+from itertools import islice
 import logging
 import datetime
 
@@ -156,8 +159,9 @@ class Task(Model):
     lic = StringField()
     timer = FloatField(allow_null=True)
     maxAttempt = IntegerField()
+    pendingCommands = ObjectField(allow_null=True)
 
-    def __init__(self, id, name, parent, user, maxRN, priority, dispatchKey, runner, arguments, validationExpression, commands, requirements=[], minNbCores=1, maxNbCores=0, ramUse=0, environment={}, nodes={}, lic="", tags={}, maxAttempt=1, timer=None):
+    def __init__(self, id, name, parent, user, maxRN, priority, dispatchKey, runner, arguments, validationExpression, commands, requirements=[], minNbCores=1, maxNbCores=0, ramUse=0, environment={}, nodes={}, lic="", tags={}, maxAttempt=1, timer=None, pendingCommands=None):
         assert parent is None or isinstance(parent, TaskGroup)
         Model.__init__(self)
         self.id = int(id) if id else None
@@ -187,6 +191,46 @@ class Task(Model):
         self.updateTime = None
         self.endTime = None
         self.timer = timer
+        self.pendingCommands = pendingCommands
+
+    def getCommandCount(self):
+        count = len(self.commands)
+        if self.pendingCommands is not None:
+            count += self.pendingCommands.count
+        return count
+
+    def hasPendingCommands(self, status=None):
+        if self.pendingCommands is None:
+            return False
+        return status is None or self.pendingCommands.status == status
+
+    def setPendingCommandsStatus(self, status):
+        '''Sets the status the pending commands will have once created.'''
+        if self.pendingCommands is None or self.pendingCommands.status == status:
+            return
+        self.pendingCommands.status = status
+        self.fireChangeEvent(self, 'pendingCommands', self.pendingCommands, self.pendingCommands)
+
+    def materializeCommands(self, maxCount):
+        '''
+        Creates the next pending commands of the task, at most maxCount.
+
+        :return: the list of the created commands
+        '''
+        from octopus.dispatcher.model import Command
+        if self.pendingCommands is None:
+            return []
+        created = []
+        status = self.pendingCommands.status
+        for (description, arguments) in self.pendingCommands.take(self.name, self.arguments, maxCount):
+            command = Command(None, description, self, arguments, status=status)
+            self.commands.append(command)
+            created.append(command)
+        if self.pendingCommands.count == 0:
+            self.pendingCommands = None
+        else:
+            self.fireChangeEvent(self, 'pendingCommands', self.pendingCommands, self.pendingCommands)
+        return created
 
     def addValidationExpression(self, validationExpression):
         self.validationExpression = "&".join(self.validationExpression,
@@ -222,6 +266,42 @@ class Task(Model):
         return "Task(%r, %r)" % (self.id, self.name)
 
 
+class PendingCommands(object):
+    '''
+    | The commands of a task which have not been created yet: the end of a command range (see
+    | octopus.core.commandrange), starting after the "offset" commands already created.
+    | All the pending commands share the same status, they are created by the dispatcher when they are about to be
+    | assigned (see TaskNode.iterReadyCommands), so that a task of thousands of frames does not keep (and write
+    | in the database) thousands of waiting commands.
+    '''
+
+    def __init__(self, commandRange, offset=0, status=CMD_READY):
+        self.commandRange = commandRange
+        self.offset = offset
+        self.count = commandrange.countCommands(commandRange) - offset
+        self.status = status
+        self._iterator = None
+
+    def take(self, taskName, taskArguments, maxCount):
+        '''Returns the (description, arguments) of the next pending commands, at most maxCount.'''
+        if self._iterator is None:
+            self._iterator = islice(commandrange.iterCommands(taskName, taskArguments, self.commandRange), self.offset, None)
+        commands = list(islice(self._iterator, min(maxCount, self.count)))
+        self.offset += len(commands)
+        self.count -= len(commands)
+        return commands
+
+    def to_json(self):
+        return {'commandRange': self.commandRange, 'offset': self.offset, 'count': self.count, 'status': self.status}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['commandRange'], data['offset'], data['status'])
+
+    def __repr__(self):
+        return "PendingCommands(%r, offset=%r, count=%r, status=%r)" % (self.commandRange, self.offset, self.count, self.status)
+
+
 class TaskListener(object):
 # """
 # NEVER USER ???
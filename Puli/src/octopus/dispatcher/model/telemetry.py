@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Recent history of the system infos of the render nodes, to spot the swapping or flapping nodes without an external
+monitoring.
+
+The store keeps one row per render node in numpy arrays, each row is a ring buffer of fixed size:
+  - samples of the free RAM, swap percentage, load and status, taken from the sysinfos heartbeats of the workers at
+    most every CORE.RN_TELEMETRY_INTERVAL seconds, CORE.RN_TELEMETRY_SIZE samples per render node
+  - status transitions (date and new status), CORE.RN_TELEMETRY_TRANSITIONS per render node, and the total number of
+    transitions since the render node was registered
+
+With the default sizes, a render node takes about 3 KB. The farm-wide summary (summary()) is computed on the whole
+arrays at once.
+
+The store is updated by the dispatch tree render node listener (rows and status transitions) and by the sysinfos
+webservice (samples). The rows of the removed render nodes are reused.
+'''
+
+import time
+import logging
+import warnings
+
+import numpy as np
+
+from octopus.core import singletonconfig
+
+LOGGER = logging.getLogger("dispatcher.telemetry")
+
+SAMPLE_FIELDS = (
+    ('freeRam', np.float32),    # systemFreeRam, in MB
+    ('swap', np.float32),       # systemSwapPercentage
+    ('load', np.float32),       # load average of the last minute
+)
+
+
+class RenderNodeTelemetry(object):
+    '''
+    | One row per render node registered in the dispatch tree, the rows are found by render node name.
+    | The slots of a ring not written yet have a NaN date.
+    '''
+
+    def __init__(self, capacity=64):
+        self.size = singletonconfig.get('CORE', 'RN_TELEMETRY_SIZE', 120)
+        self.transitionsSize = singletonconfig.get('CORE', 'RN_TELEMETRY_TRANSITIONS', 32)
+        self.interval = singletonconfig.get('CORE', 'RN_TELEMETRY_INTERVAL', 30)
+        self.rows = {}
+        self.freeRows = []
+        self.capacity = 0
+        # samples
+        self.dates = np.empty((0, self.size), dtype=np.float64)
+        self.samples = dict((name, np.empty((0, self.size), dtype=dtype)) for (name, dtype) in SAMPLE_FIELDS)
+        self.status = np.empty((0, self.size), dtype=np.int8)
+        self.nextSample = np.empty(0, dtype=np.int32)
+        # status transitions
+        self.transitionDates = np.empty((0, self.transitionsSize), dtype=np.float64)
+        self.transitionStatus = np.empty((0, self.transitionsSize), dtype=np.int8)
+        self.nextTransition = np.empty(0, dtype=np.int32)
+        self.transitionCount = np.empty(0, dtype=np.int64)
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        added = capacity - self.capacity
+
+        def extend(array, fill):
+            extra = np.empty((added,) + array.shape[1:], dtype=array.dtype)
+            extra.fill(fill)
+            return np.concatenate((array, extra))
+
+        self.dates = extend(self.dates, np.nan)
+        for name in self.samples:
+            self.samples[name] = extend(self.samples[name], np.nan)
+        self.status = extend(self.status, -1)
+        self.nextSample = extend(self.nextSample, 0)
+        self.transitionDates = extend(self.transitionDates, np.nan)
+        self.transitionStatus = extend(self.transitionStatus, -1)
+        self.nextTransition = extend(self.nextTransition, 0)
+        self.transitionCount = extend(self.transitionCount, 0)
+        self.freeRows.extend(reversed(range(self.capacity, capacity)))
+        self.capacity = capacity
+
+    ## Rows
+    #
+    def add(self, renderNode):
+        if renderNode.name in self.rows:
+            return
+        if not self.freeRows:
+            self._grow(self.capacity * 2)
+        row = self.freeRows.pop()
+        self.rows[renderNode.name] = row
+        self.dates[row] = np.nan
+        self.nextSample[row] = 0
+        self.transitionDates[row] = np.nan
+        self.nextTransition[row] = 0
+        self.transitionCount[row] = 0
+
+    def remove(self, renderNode):
+        row = self.rows.pop(renderNode.name, None)
+        if row is not None:
+            self.freeRows.append(row)
+
+    def clear(self):
+        self.freeRows.extend(self.rows.values())
+        self.rows.clear()
+
+    ## Updates
+    #
+    def sample(self, renderNode, date=None, load=None):
+        '''
+        Records the system infos of a render node, returns False if the last sample is more recent than the sampling
+        interval.
+        '''
+        row = self.rows.get(renderNode.name)
+        if row is None:
+            return False
+        date = time.time() if date is None else date
+        last = self.dates[row, (self.nextSample[row] - 1) % self.size]
+        if date - last < self.interval:
+            return False
+        index = self.nextSample[row]
+        self.dates[row, index] = date
+        self.samples['freeRam'][row, index] = renderNode.systemFreeRam
+        self.samples['swap'][row, index] = renderNode.systemSwapPercentage
+        self.samples['load'][row, index] = np.nan if load is None else load
+        self.status[row, index] = renderNode.status
+        self.nextSample[row] = (index + 1) % self.size
+        return True
+
+    def recordStatus(self, renderNode, status, date=None):
+        row = self.rows.get(renderNode.name)
+        if row is None:
+            return
+        index = self.nextTransition[row]
+        self.transitionDates[row, index] = time.time() if date is None else date
+        self.transitionStatus[row, index] = status
+        self.nextTransition[row] = (index + 1) % self.transitionsSize
+        self.transitionCount[row] += 1
+
+    ## Queries
+    #
+    def history(self, renderNode):
+        '''Returns the samples and the status transitions of a render node in chronological order, None if unknown.'''
+        row = self.rows.get(renderNode.name)
+        if row is None:
+            return None
+        order = np.roll(np.arange(self.size), -self.nextSample[row])
+        order = order[~np.isnan(self.dates[row, order])]
+        samples = {
+            'date': self.dates[row, order].tolist(),
+            'status': self.status[row, order].tolist(),
+        }
+        for name in self.samples:
+            samples[name] = [None if value != value else value for value in self.samples[name][row, order].tolist()]
+        order = np.roll(np.arange(self.transitionsSize), -self.nextTransition[row])
+        order = order[~np.isnan(self.transitionDates[row, order])]
+        return {
+            'samples': samples,
+            'transitions': {
+                'date': self.transitionDates[row, order].tolist(),
+                'status': self.transitionStatus[row, order].tolist(),
+            },
+            'transitionCount': int(self.transitionCount[row]),
+        }
+
+    def summary(self, window, date=None):
+        '''
+        Returns the statistics of the samples and transitions of the last window seconds of every render node, as a
+        dict of lists in the order of the names:
+          - name
+          - samples: number of samples in the window
+          - minFreeRam, meanSwap, maxSwap, meanLoad, maxLoad: None without samples
+          - transitions: number of status transitions in the window (only the last ones are kept, see the
+            transitionCount of the history for the total)
+        '''
+        date = time.time() if date is None else date
+        names = sorted(self.rows)
+        rows = np.array([self.rows[name] for name in names], dtype=np.int64)
+        start = date - window
+
+        dates = self.dates[rows]
+        with np.errstate(invalid='ignore'):
+            inWindow = dates >= start
+        counts = inWindow.sum(axis=1)
+
+        def reduce(name, function):
+            values = np.where(inWindow, self.samples[name][rows], np.nan)
+            with np.errstate(invalid='ignore'):
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    result = function(values, axis=1)
+            return [None if value != value else value for value in result.tolist()]
+
+        with np.errstate(invalid='ignore'):
+            transitions = (self.transitionDates[rows] >= start).sum(axis=1)
+        return {
+            'name': names,
+            'samples': counts.tolist(),
+            'minFreeRam': reduce('freeRam', np.nanmin),
+            'meanSwap': reduce('swap', np.nanmean),
+            'maxSwap': reduce('swap', np.nanmax),
+            'meanLoad': reduce('load', np.nanmean),
+            'maxLoad': reduce('load', np.nanmax),
+            'transitions': transitions.tolist(),
+        }
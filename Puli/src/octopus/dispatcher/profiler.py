@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Opt-in profiler of the dispatch cycle, enabled with CORE.PROFILE_ENABLED (reloaded by /reconfig, or toggled with
+/reconfig?profile=on|off).
+
+Two kinds of data are collected while it is enabled:
+  - spans: nested timers opened around the stages of the cycle (e.g. mainLoop > computeAssignments >
+    dispatchIterator:<pool> > reserveLicense). The self time of each span (its duration minus the duration of
+    its children) is kept in a buffer of CORE.PROFILE_BUFFER_SIZE spans.
+  - samples: every CORE.PROFILE_SAMPLE_INTERVAL seconds during a cycle, a thread records the python stack of the
+    thread running the cycle, the last CORE.PROFILE_BUFFER_SIZE stacks are kept. 0 disables the sampling.
+
+A span is opened with a with block (span()), around a whole function (profiled() decorator) or with explicit calls
+(start() and stop()) for the long stages. When the profiler is disabled, span() and start() return a shared no-op
+span and the sampling thread sleeps.
+
+Both are exposed as folded stacks (one "frame;frame;frame value" line per stack), the input of flamegraph.pl:
+    curl http://localhost:8004/profile?mode=spans | flamegraph.pl > cycle.svg
+'''
+
+import sys
+import time
+import thread
+import logging
+import functools
+import threading
+from collections import deque
+
+from octopus.core import singletonconfig
+
+LOGGER = logging.getLogger('dispatcher.profiler')
+
+
+class NoSpan(object):
+    '''Context manager doing nothing, returned when the profiler is disabled.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+    def stop(self):
+        pass
+
+NO_SPAN = NoSpan()
+
+
+class Span(object):
+
+    __slots__ = ('profiler', 'path', 'startTime', 'childTime')
+
+    def __init__(self, profiler, path):
+        self.profiler = profiler
+        self.path = path
+        self.childTime = 0.0
+
+    def __enter__(self):
+        self.profiler.stack.append(self)
+        self.startTime = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        duration = time.time() - self.startTime
+        stack = self.profiler.stack
+        if self not in stack:
+            return False
+        # the spans started inside this one and not stopped (an exception was raised) are dropped
+        while stack.pop() is not self:
+            pass
+        if stack:
+            stack[-1].childTime += duration
+        self.profiler.spans.append((self.path, duration - self.childTime))
+        return False
+
+    def stop(self):
+        self.__exit__(None, None, None)
+
+
+class Profiler(object):
+    '''
+    | Spans are opened and closed by a single thread (the IOLoop thread running the dispatch cycle), the
+    | samples are taken by a daemon thread started when the profiler is enabled.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = deque(maxlen=100000)
+        self.samples = deque(maxlen=100000)
+        # spans currently opened
+        self.stack = []
+        self.targetThread = None
+        self.sampler = None
+
+    def configure(self, enabled=None):
+        '''Reads the profiler settings, "enabled" overrides CORE.PROFILE_ENABLED.'''
+        if enabled is None:
+            enabled = singletonconfig.get('CORE', 'PROFILE_ENABLED', False)
+        bufferSize = singletonconfig.get('CORE', 'PROFILE_BUFFER_SIZE', 100000)
+        if bufferSize != self.spans.maxlen:
+            self.spans = deque(self.spans, maxlen=bufferSize)
+            self.samples = deque(self.samples, maxlen=bufferSize)
+        if enabled != self.enabled:
+            LOGGER.warning("Profiler %s" % ("enabled" if enabled else "disabled"))
+        self.enabled = enabled
+        if enabled and self.sampler is None:
+            self.sampler = threading.Thread(target=self._sample, name="profileSampler")
+            self.sampler.setDaemon(True)
+            self.sampler.start()
+
+    def clear(self):
+        self.spans.clear()
+        self.samples.clear()
+
+    def span(self, name, *args):
+        '''
+        Returns a context manager timing a span, nested in the span currently opened.
+        The name is formatted with args only if the profiler is enabled, e.g. span("dispatchIterator:%s", pool.name)
+        '''
+        if not self.enabled:
+            return NO_SPAN
+        if args:
+            name = name % args
+        if self.stack:
+            path = self.stack[-1].path + (name,)
+        else:
+            path = (name,)
+            self.targetThread = thread.get_ident()
+        return Span(self, path)
+
+    def start(self, name, *args):
+        '''Opens a span closed by its stop() method, like span() without indenting the timed code in a with block.'''
+        return self.span(name, *args).__enter__()
+
+    def profiled(self, name):
+        '''Decorator timing each call of a function in a span.'''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    ## Sampling of the python stack of the dispatch thread
+    #
+    def _sample(self):
+        while True:
+            interval = singletonconfig.get('CORE', 'PROFILE_SAMPLE_INTERVAL', 0.01)
+            if not self.enabled or not interval:
+                time.sleep(1.0)
+                continue
+            time.sleep(interval)
+            # only the stacks of the cycle are sampled, not the IOLoop waiting for events
+            if not self.stack:
+                continue
+            frame = sys._current_frames().get(self.targetThread)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append("%s:%s" % (frame.f_globals.get('__name__', '?'), code.co_name))
+                frame = frame.f_back
+            names.reverse()
+            self.samples.append(tuple(names))
+
+    ## Folded stacks
+    #
+    def foldedSpans(self):
+        '''Returns the self time of each stack of spans, in microseconds.'''
+        totals = {}
+        for (path, selfTime) in list(self.spans):
+            totals[path] = totals.get(path, 0.0) + selfTime
+        return "".join("%s %d\n" % (";".join(path), int(total * 1e6)) for (path, total) in sorted(totals.iteritems()))
+
+    def foldedSamples(self):
+        '''Returns the number of samples of each python stack.'''
+        counts = {}
+        for stack in list(self.samples):
+            counts[stack] = counts.get(stack, 0) + 1
+        return "".join("%s %d\n" % (";".join(stack), count) for (stack, count) in sorted(counts.iteritems()))
+
+
+theProfiler = Profiler()
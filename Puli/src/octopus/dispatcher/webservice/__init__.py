@@ -20,18 +20,27 @@ class Controller(framework.Controller):
         return self.framework.application
 
 
+import time
+
+from tornado.escape import json_encode
+
 from octopus.core import singletonconfig, singletonstats
 from octopus.core.framework import BaseResource
+from octopus.dispatcher.webservice.metrics import theMetrics
 
 class DispatcherBaseResource(BaseResource):
     """
     Simply override prepare to have a specific handler for the dispatcher (stats are not allowed for the worker)
+    The duration and size of each request are recorded in the webservice metrics (see metrics.py)
     """
     
     def prepare( self ):
         """
         For each request, update stats if needed
         """
+        self.startTime = time.time()
+        self.responseBytes = 0
+
         if singletonconfig.get('CORE','GET_STATS'):
             singletonstats.theStats.cycleCounts['incoming_requests'] += 1
 
@@ -44,4 +53,17 @@ class DispatcherBaseResource(BaseResource):
             elif self.request.method == 'DELETE':
                     singletonstats.theStats.cycleCounts['incoming_delete'] += 1
 
+    def write( self, chunk ):
+        # dicts are encoded here (as tornado does) to know the size of the response
+        if isinstance(chunk, dict):
+            chunk = json_encode(chunk)
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.responseBytes = getattr(self, 'responseBytes', 0) + len(chunk)
+        super(DispatcherBaseResource, self).write(chunk)
+
+    def on_finish( self ):
+        # prepare() is not called if the request fails before (e.g. unsupported method)
+        if hasattr(self, 'startTime'):
+            theMetrics.recordRequest(self, time.time() - self.startTime, len(self.request.body or ""), self.responseBytes)
+
 from .webservicedispatcher import WebServiceDispatcher as WebService
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Webservices giving the changes of the dispatch tree since a revision (see octopus.dispatcher.model.changefeed).
+
+Long-poll:
+    http://localhost:8004/changes
+        returns the current revision, without any change
+    http://localhost:8004/changes?since=1234&timeout=30&kind=node&kind=command&limit=1000
+        returns the changes after the revision 1234, or waits at most "timeout" seconds for new changes
+
+    { "revision": 1250, "changes": [ {"revision": 1236, "kind": "node", "id": 12, "fields": {"status": 2}}, ...] }
+
+Server-sent events:
+    http://localhost:8004/changes/stream?since=1234&kind=rendernode
+        sends an event (with id = revision) each time changes are available, the "Last-Event-ID" header sent by
+        a reconnecting EventSource is used if "since" is not given
+
+If the revision asked is too old, the long-poll returns a 410 error and the stream sends a "resync" event: the
+client has to reload a full snapshot before following the changes again.
+'''
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+import logging
+import time
+
+import tornado
+from tornado.ioloop import IOLoop
+
+from octopus.core import singletonconfig
+from octopus.core.communication.http import Http400
+from octopus.dispatcher.model.changefeed import ResyncRequired, NODE, COMMAND, RENDERNODE
+from octopus.dispatcher.webservice import DispatcherBaseResource
+
+__all__ = []
+
+logger = logging.getLogger('dispatcher.webservice.changes')
+
+
+class BaseChangesResource(DispatcherBaseResource):
+
+    def getChangeFeed(self):
+        return self.getDispatchTree().changeFeed
+
+    def getNumberArgument(self, pName, pType=int):
+        if pName not in self.request.arguments:
+            return None
+        try:
+            return pType(self.request.arguments[pName][0])
+        except ValueError:
+            raise Http400("Invalid value for argument %s: %s" % (pName, self.request.arguments[pName][0]))
+
+    def getKinds(self):
+        kinds = self.request.arguments.get('kind')
+        if not kinds:
+            return None
+        for kind in kinds:
+            if kind not in (NODE, COMMAND, RENDERNODE):
+                raise Http400("Invalid kind: %s" % kind)
+        return set(kinds)
+
+    def sendResync(self, pError):
+        self.set_status(410)
+        self.set_header('Content-Type', 'application/json')
+        self.writeCallback(json.dumps({'resync': True, 'revision': self.getChangeFeed().revision, 'message': str(pError)}))
+        self.finish()
+
+
+class ChangesResource(BaseChangesResource):
+    '''
+    Long-poll on the change feed: answers as soon as there are changes after the given revision.
+    '''
+
+    @tornado.web.asynchronous
+    def get(self):
+        feed = self.getChangeFeed()
+        self.since = self.getNumberArgument('since')
+        self.kinds = self.getKinds()
+        self.limit = self.getNumberArgument('limit')
+        timeout = self.getNumberArgument('timeout', float)
+        if timeout is None:
+            timeout = singletonconfig.get('CORE', 'CHANGE_FEED_TIMEOUT', 30)
+        self.timeoutHandle = None
+
+        if self.since is None:
+            self.sendChanges(feed.revision, [])
+            return
+
+        if feed.hasChanges(self.since) and self.trySend():
+            return
+
+        # wait for new changes or timeout
+        feed.addWaiter(self.onChanges)
+        self.timeoutHandle = IOLoop.instance().add_timeout(time.time() + timeout, self.onTimeout)
+
+    def trySend(self):
+        '''Sends the changes if any (that match the requested kinds) and returns True if the request is finished.'''
+        try:
+            revision, changes = self.getChangeFeed().getChanges(self.since, self.kinds, self.limit)
+        except ResyncRequired, e:
+            self.sendResync(e)
+            return True
+        if not changes:
+            # only changes of other kinds, wait for the next ones
+            self.since = revision
+            return False
+        self.sendChanges(revision, changes)
+        return True
+
+    def sendChanges(self, pRevision, pChanges):
+        self.set_header('Content-Type', 'application/json')
+        self.writeCallback(json.dumps({'revision': pRevision, 'changes': pChanges}))
+        self.finish()
+
+    def onChanges(self):
+        if self.trySend():
+            self.stopWaiting()
+
+    def onTimeout(self):
+        self.timeoutHandle = None
+        self.stopWaiting()
+        self.sendChanges(self.since, [])
+
+    def stopWaiting(self):
+        self.getChangeFeed().removeWaiter(self.onChanges)
+        if self.timeoutHandle is not None:
+            IOLoop.instance().remove_timeout(self.timeoutHandle)
+            self.timeoutHandle = None
+
+    def on_connection_close(self):
+        self.stopWaiting()
+
+
+class ChangesStreamResource(BaseChangesResource):
+    '''
+    Server-sent events stream of the change feed. The connection stays open, each event holds the changes
+    recorded since the previous one.
+    '''
+    HEARTBEAT_INTERVAL = 15.0
+
+    @tornado.web.asynchronous
+    def get(self):
+        feed = self.getChangeFeed()
+        self.since = self.getNumberArgument('since')
+        if self.since is None and self.request.headers.get('Last-Event-ID'):
+            try:
+                self.since = int(self.request.headers['Last-Event-ID'])
+            except ValueError:
+                raise Http400("Invalid Last-Event-ID header")
+        if self.since is None:
+            self.since = feed.revision
+        self.kinds = self.getKinds()
+        self.closed = False
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(": revision %d\n\n" % feed.revision)
+        self.flush()
+
+        feed.addWaiter(self.onChanges)
+        self.heartbeat = tornado.ioloop.PeriodicCallback(self.sendHeartbeat, self.HEARTBEAT_INTERVAL * 1000)
+        self.heartbeat.start()
+        if feed.hasChanges(self.since):
+            self.onChanges()
+
+    def onChanges(self):
+        if self.closed:
+            return
+        try:
+            revision, changes = self.getChangeFeed().getChanges(self.since, self.kinds)
+        except ResyncRequired, e:
+            self.write("event: resync\ndata: %s\n\n" % json.dumps({'revision': self.getChangeFeed().revision, 'message': str(e)}))
+            self.close()
+            return
+        self.since = revision
+        if changes:
+            self.write("id: %d\ndata: %s\n\n" % (revision, json.dumps(changes)))
+            self.flush()
+
+    def sendHeartbeat(self):
+        # a comment line, keeps the connection alive through proxies
+        if not self.closed:
+            self.write(": heartbeat\n\n")
+            self.flush()
+
+    def close(self):
+        self.stopStreaming()
+        self.finish()
+
+    def stopStreaming(self):
+        self.closed = True
+        self.getChangeFeed().removeWaiter(self.onChanges)
+        self.heartbeat.stop()
+
+    def on_connection_close(self):
+        self.stopStreaming()
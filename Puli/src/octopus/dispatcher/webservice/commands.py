@@ -49,8 +49,7 @@ class CommandResource(DispatcherBaseResource):
     #@queue
     def put(self, commandId):
         def work(self, commandId, toUpdate):
-            commands = self.getDispatchTree().commands
-            if commandId not in commands:
+            if not self.dispatcher.coldStorage.thawCommand(commandId):
                 return None
             command = self.getDispatchTree().commands[commandId]
             # TODO should run the following piece of code at boot...
@@ -96,6 +95,8 @@ class CommandResource(DispatcherBaseResource):
         self.writeCallback(result)
 
     def _findCommand(self, id):
+        # the command of a cold job is loaded back with the commands of its job
+        self.dispatcher.coldStorage.thawCommand(id)
         return self.getDispatchTree().commands[id]
 
 
@@ -10,6 +10,8 @@ edit?update_status=0&constraint_user=jsa
 edit?update_status=1&constraint_user=jsa&constraint_user=render
 edit?update_status=0&constraint_id=1&constraint_id=2&constraint_id=3
 
+Plusieurs modifications peuvent etre appliquees en une seule requete avec /edit/bulk (voir BulkEditResource).
+
 On retourne un objet json au format:
 { 
     'summary':
@@ -33,6 +35,10 @@ import logging
 import time
 from datetime import datetime
 
+import tornado
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError
+
 from octopus.dispatcher.model import FolderNode
 from octopus.dispatcher.model.enums import NODE_STATUS
 from octopus.dispatcher.model.nodequery import IQueryNode
@@ -47,130 +53,135 @@ __all__ = []
 
 logger = logging.getLogger('dispatcher.webservice.editController')
 
-class EditStatusResource(DispatcherBaseResource, IQueryNode):
+class Mutation(object):
     """
-    Handle user request to change the status on a set of nodes. Status value will be change according to transition constraints 
-    in setStatusForNode() class member.
+    A change applied to each selected job. The value is checked when the mutation is created, so that all the
+    mutations of a request are validated before any job is modified.
     """
+    field = None
 
-    def getNode(self, nodeId):
-        try:
-            return self.getDispatchTree().nodes[int(nodeId)]
-        except KeyError:
-            raise KeyError
+    def __init__(self, value):
+        self.value = self.parse(value)
 
+    def parse(self, value):
+        return value
 
-    def setStatusForNode( self, pStatus, pNode ):
-        """
-        Changes the status for a particular node. Properly reset completion when restarting a node.
-        Returns the node id IF the node was actually edited, None otherwise
-        """
+    def apply(self, node):
+        """Applies the change to a job, returns True if the job has been modified."""
+        raise NotImplementedError
 
-        if pNode.status == pStatus:
-            logger.info("Status is already %d for node %d" % (pStatus, pNode.id))
-            return None
 
-        if pStatus in [NODE_ERROR, NODE_CANCELED, NODE_DONE] and pStatus == NODE_READY:
-            logger.info("Reset completion for node %d" % pNode.id )
-            pNode.resetCompletion()
-        else:
-            logger.info("Set new status %d" % pStatus )
-            pNode.setStatus(pStatus)
+class StatusMutation(Mutation):
+    """
+    Changes the status of a job, the completion is reset when restarting a finished job.
+    The kill requests of the cancelled commands are sent to the render nodes in the background.
+    """
+    field = 'status'
 
-        return pNode.id
+    def parse(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise Http400("Invalid status given: %r" % value)
+        if value not in NODE_STATUS:
+            raise Http400("Invalid status given: %d" % value)
+        return value
+
+    def apply(self, node):
+        if node.status == self.value:
+            return False
+        if node.status in [NODE_ERROR, NODE_CANCELED, NODE_DONE] and self.value == NODE_READY:
+            node.resetCompletion()
+        return node.setStatus(self.value)
+
+
+class MaxRnMutation(Mutation):
+    """maxRN is an integer > -1"""
+    field = 'maxRN'
+
+    def parse(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise Http400('Bad request:  invalid value, maxRN must be an integer')
+        if value < -1:
+            raise Http400('Bad request: invalid value, maxRN cannot be lower than -1')
+        return value
 
+    def apply(self, node):
+        node.maxRN = self.value
+        return True
 
 
-    def put(self):
-        """
+class PrioMutation(Mutation):
+    """The priority given is stored as the dispatchKey which the true field used for job assignation"""
+    field = 'prio'
 
-        """
-        start_time = time.time()
-        prevTimer = time.time()
-        editedJobs = []
+    def parse(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise Http400('Bad request:  invalid value, prio must be an integer')
 
-        nodes = self.getDispatchTree().nodes[1].children
-        totalNodes = len(nodes)
+    def apply(self, node):
+        node.dispatchKey = self.value
+        return True
 
-        args = self.request.arguments
 
-        if 'update_status' in args:
-            newStatus = int(args['update_status'][0])
-        else:
-            raise Http400('New status could not be found.')
+class PausedMutation(Mutation):
+    """A job is modified if one of its tasks not done is paused or resumed."""
+    field = 'paused'
 
-        if newStatus not in NODE_STATUS:
-            raise Http400("Invalid status given: %d" % newStatus)
+    def parse(self, value):
+        if not isinstance(value, bool):
+            raise Http400('Bad request:  invalid value, paused must be a boolean')
+        return value
 
-        # # Optional argument to allow job to be restarted (if defined) or only resumed (if nothing defined)
-        # if 'update_option' in args:
-        #     if args['update_option'][0] == "restart" :
-        #         restartNode = True
+    def apply(self, node):
+        changed = self.isChanged(node)
+        node.setPaused(self.value)
+        return changed
 
-        nodes = self.filterNodes( args, nodes )
-
-        for currNode in nodes:
-            # logger.info("Changing status for job : %d -- %s" % ( currNode.id, currNode.name ) )
-            try:
-                if self.setStatusForNode( newStatus, currNode ) is not None:
-                    editedJobs.append( currNode.id )
-            except:
-                raise Http500('Error changing status.')
-
-
-        content = { 
-                    'summary': 
-                        { 
-                        'editedCount':len(editedJobs),
-                        'filteredCount':len(nodes),
-                        'totalInDispatcher':totalNodes, 
-                        'requestTime':time.time() - start_time,
-                        'requestDate':time.ctime()
-                        }, 
-                    'editedJobs':editedJobs 
-                    }
-
-        # Create response and callback
-        self.writeCallback( json.dumps(content) )
+    def isChanged(self, node):
+        if hasattr(node, 'paused'):
+            return node.paused != self.value and node.status != NODE_DONE
+        return any(self.isChanged(child) for child in node.children)
 
 
+MUTATIONS = dict((mutationClass.field, mutationClass) for mutationClass in (StatusMutation, MaxRnMutation, PrioMutation, PausedMutation))
 
 
-class PauseResource(DispatcherBaseResource, IQueryNode):
+class BaseEditResource(DispatcherBaseResource, IQueryNode):
     """
-    Hanlde user requests to pause a specific set of jobs
+    Applies a list of mutations to the jobs matching a query (see IQueryNode.filterNodes), in a single pass on the
+    selected jobs.
     """
-    def getNode(self, nodeId):
-        try:
-            return self.getDispatchTree().nodes[int(nodeId)]
-        except KeyError:
-            raise KeyError
 
-    def put(self):
+    def editJobs( self, pFilterArgs, pMutations ):
         """
-
+        Returns the response content: the summary and the ids of the edited jobs
         """
         start_time = time.time()
-        prevTimer = time.time()
         editedJobs = []
 
         nodes = self.getDispatchTree().nodes[1].children
         totalNodes = len(nodes)
 
-        args = self.request.arguments
-
+        nodes = self.filterNodes( pFilterArgs, nodes, self.getDispatchTree().jobIndex )
 
-        nodes = self.filterNodes( args, nodes )
         for currNode in nodes:
-            try:
-                if hasattr(currNode, 'paused') and currNode.paused == False:
-                    currNode.setPaused( True)
-                    editedJobs.append( currNode.id )
-            except:
-                raise Http400('Error when pausing job.')
-
+            edited = False
+            for mutation in pMutations:
+                try:
+                    if mutation.apply( currNode ):
+                        edited = True
+                except Exception:
+                    logger.exception("Error when editing %s of job %d" % (mutation.field, currNode.id))
+                    raise Http500('Error changing %s of job: %d.' % (mutation.field, currNode.id))
+            if edited:
+                editedJobs.append( currNode.id )
 
-        content = { 
+        return { 
                     'summary': 
                         { 
                         'editedCount':len(editedJobs),
@@ -182,62 +193,41 @@ class PauseResource(DispatcherBaseResource, IQueryNode):
                     'editedJobs':editedJobs 
                     }
 
-        # Create response and callback
-        self.writeCallback( json.dumps(content) )
-
 
-
-
-class ResumeResource(DispatcherBaseResource, IQueryNode):
+class EditStatusResource(BaseEditResource):
     """
-    Hanlde user requests to resume a specific set of jobs
+    Handle user request to change the status on a set of nodes. Status value will be change according to transition constraints 
+    in StatusMutation.
     """
-    def getNode(self, nodeId):
-        try:
-            return self.getDispatchTree().nodes[int(nodeId)]
-        except KeyError:
-            raise KeyError
 
     def put(self):
-        """
-
-        """
-        start_time = time.time()
-        prevTimer = time.time()
-        editedJobs = []
+        args = self.request.arguments
 
-        nodes = self.getDispatchTree().nodes[1].children
-        totalNodes = len(nodes)
+        if 'update_status' in args:
+            mutation = StatusMutation( args['update_status'][0] )
+        else:
+            raise Http400('New status could not be found.')
 
-        args = self.request.arguments
+        self.writeCallback( json.dumps( self.editJobs( args, [mutation] ) ) )
 
-        nodes = self.filterNodes( args, nodes )
-        for currNode in nodes:
-            try:
-                # if hasattr(currNode, 'resume') and currNode.paused == True:
-                currNode.setPaused( False )
-                editedJobs.append( currNode.id )
-            except:
-                raise Http400('Error when resuming job.')
 
+class PauseResource(BaseEditResource):
+    """
+    Hanlde user requests to pause a specific set of jobs
+    """
+    def put(self):
+        self.writeCallback( json.dumps( self.editJobs( self.request.arguments, [PausedMutation(True)] ) ) )
 
-        content = { 
-                    'summary': 
-                        { 
-                        'editedCount':len(editedJobs),
-                        'filteredCount':len(nodes),
-                        'totalInDispatcher':totalNodes, 
-                        'requestTime':time.time() - start_time,
-                        'requestDate':time.ctime()
-                        }, 
-                    'editedJobs':editedJobs 
-                    }
 
-        # Create response and callback
-        self.writeCallback( json.dumps(content) )
+class ResumeResource(BaseEditResource):
+    """
+    Hanlde user requests to resume a specific set of jobs
+    """
+    def put(self):
+        self.writeCallback( json.dumps( self.editJobs( self.request.arguments, [PausedMutation(False)] ) ) )
 
 
-class EditMaxRnResource(DispatcherBaseResource, IQueryNode):
+class EditMaxRnResource(BaseEditResource):
     """
     Edit multiple jobs with a query for filtering. 
     Value edited is maxRN field which indicates a max number of rendernodes to assign to a specific job.
@@ -247,60 +237,11 @@ class EditMaxRnResource(DispatcherBaseResource, IQueryNode):
     """
 
     def put(self):
-        """
-        """
-        start_time = time.time()
-        prevTimer = time.time()
-        editedJobs = []
-
-        nodes = self.getDispatchTree().nodes[1].children
-        totalNodes = len(nodes)
-
-        #
-        # Getting new value, we check its presence in args, type (int) and range (>-1)
-        #
-        try:
-            newMaxRn = int(self.get_argument('value'))  # Tornado raises a MissingArgumentError if not present
-        except ValueError:
-            raise Http400('Bad request:  invalid value, maxRN must be an integer')
-
-        if newMaxRn < -1:
-            raise Http400('Bad request: invalid value, maxRN cannot be lower than -1')
-
-        #
-        # Filtering nodes
-        #
-        nodes = self.filterNodes( self.request.arguments, nodes )
-
-        #
-        # Perform action
-        #
-        for currNode in nodes:
-            try:
-                currNode.maxRN = newMaxRn
-                editedJobs.append( currNode.id )
-            except:
-                raise Http500('Error changing status of job: %d.', currNode.id)
-
-        #
-        # Prepare response and return
-        #
-        content = { 
-                    'summary': 
-                        { 
-                        'editedCount':len(editedJobs),
-                        'filteredCount':len(nodes),
-                        'totalInDispatcher':totalNodes, 
-                        'requestTime':time.time() - start_time,
-                        'requestDate':time.ctime()
-                        }, 
-                    'editedJobs':editedJobs 
-                    }
-        self.writeCallback( json.dumps(content) )
-
+        mutation = MaxRnMutation( self.get_argument('value') )  # Tornado raises a MissingArgumentError if not present
+        self.writeCallback( json.dumps( self.editJobs( self.request.arguments, [mutation] ) ) )
 
 
-class EditPrioResource(DispatcherBaseResource, IQueryNode):
+class EditPrioResource(BaseEditResource):
     """
     Edit multiple jobs with a query for filtering.
     Value given is a new priority, it is stored as the dispatchKey which the true field used for job assignation
@@ -309,53 +250,60 @@ class EditPrioResource(DispatcherBaseResource, IQueryNode):
     """
 
     def put(self):
-        """
-        """
-        start_time = time.time()
-        prevTimer = time.time()
-        editedJobs = []
+        mutation = PrioMutation( self.get_argument('value') )  # Tornado raises a MissingArgumentError if not present
+        self.writeCallback( json.dumps( self.editJobs( self.request.arguments, [mutation] ) ) )
 
-        nodes = self.getDispatchTree().nodes[1].children
-        totalNodes = len(nodes)
 
-        #
-        # Getting new value, we check its presence in args and type (int)
-        #
+class BulkEditResource(BaseEditResource):
+    """
+    Applies several mutations to the jobs matching a selector, e.g.:
+        curl -X POST http://pulitest:8004/edit/bulk -d '{"selector": {"user": ["jsa"], "status": [1, 2]},
+                                                         "mutations": [{"field": "status", "value": 5}]}'
+
+    The selector gives the constraints of /query without the "constraint_" prefix (id, status, user, prod, name,
+    creationtime, starttime, endtime), the mutations change the "status", "maxRN", "prio" or "paused" of the jobs.
+    All the mutations are checked before any job is modified, they are then applied in one pass between two
+    dispatcher cycles. The response is the one of the other /edit webservices.
+    """
+    # delay before retrying a request received while a graph is being registered
+    RETRY_DELAY = 0.05
+
+    @tornado.web.asynchronous
+    def post(self):
+        data = self.getBodyAsJSON()
+        if not isinstance(data, dict) or not isinstance(data.get('mutations'), list) or not data['mutations']:
+            raise Http400('Missing entry: "mutations".')
+        selector = data.get('selector', {})
+        if not isinstance(selector, dict):
+            raise Http400('The selector must be a json object.')
+
+        filterArgs = {}
+        for (key, values) in selector.iteritems():
+            if not isinstance(values, list):
+                values = [values]
+            filterArgs['constraint_%s' % key] = [unicode(value) for value in values]
+
+        mutations = []
+        for mutationDef in data['mutations']:
+            if not isinstance(mutationDef, dict) or mutationDef.get('field') not in MUTATIONS or 'value' not in mutationDef:
+                raise Http400('Invalid mutation %r, valid fields are: %s' % (mutationDef, ", ".join(sorted(MUTATIONS))))
+            mutations.append( MUTATIONS[mutationDef['field']]( mutationDef['value'] ) )
+
+        self.apply( filterArgs, mutations )
+
+    def apply( self, pFilterArgs, pMutations ):
+        # the jobs of a partially registered graph must not be edited
+        if self.dispatcher.graphSubmitter.registering:
+            IOLoop.instance().add_timeout( time.time() + self.RETRY_DELAY, lambda: self.apply( pFilterArgs, pMutations ) )
+            return
         try:
-            newPrio = int(self.get_argument('value'))  # Tornado raises a MissingArgumentError if not present
-        except ValueError:
-            raise Http400('Bad request:  invalid value, prio must be an integer')
-
-        #
-        # Filtering nodes
-        #
-        nodes = self.filterNodes( self.request.arguments, nodes )
-
-        for currNode in nodes:
-            try:
-                currNode.dispatchKey = newPrio
-                editedJobs.append( currNode.id )
-            except:
-                raise Http500('Error changing status of job: %d.', currNode.id)
-
-        #
-        # Prepare response and return
-        #
-        content = { 
-                    'summary': 
-                        { 
-                        'editedCount':len(editedJobs),
-                        'filteredCount':len(nodes),
-                        'totalInDispatcher':totalNodes, 
-                        'requestTime':time.time() - start_time,
-                        'requestDate':time.ctime()
-                        }, 
-                    'editedJobs':editedJobs 
-                    }
-
-        self.writeCallback( json.dumps(content) )
-        
-
+            content = self.editJobs( pFilterArgs, pMutations )
+        except HTTPError, e:
+            self.send_error( e.status_code, exception=e )
+            return
+        self.set_header( 'Content-Type', 'application/json' )
+        self.writeCallback( json.dumps( content ) )
+        self.finish()
 
 
 class RenderNodeEditResource(DispatcherBaseResource, IQueryNode):
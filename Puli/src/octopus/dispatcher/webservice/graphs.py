@@ -1,9 +1,13 @@
-
+try:
+    import simplejson as json
+except ImportError:
+    import json
 import logging
 
 from octopus.core.communication import *
 from octopus.core import singletonconfig, singletonstats
 from octopus.core.framework import queue
+from octopus.dispatcher.model.representations import TicketRepresentation
 from octopus.dispatcher.webservice import DispatcherBaseResource
 
 logger = logging.getLogger("dispatcher.webservice")
@@ -12,15 +16,21 @@ logger = logging.getLogger("dispatcher.webservice")
 class GraphesResource(DispatcherBaseResource):
     # @queue
     def post(self):
-
+        '''
+        Queues the submitted graph, it is registered in the background (see octopus.dispatcher.graphsubmitter).
+        The response is a 202 with the ticket of the submission, the "Location" header gives the url of the ticket.
+        Once the ticket is closed, its "resultURL" is the url of the created job.
+        The body may be compressed with gzip ("Content-Encoding: gzip" header), see Graph.submit(compact=True).
+        '''
         if singletonconfig.get('CORE','GET_STATS'):
             singletonstats.theStats.cycleCounts['add_graphs'] += 1
 
-        try:
-            nodes = self.dispatcher.handleNewGraphRequestApply(self.getBodyAsJSON())
-        except Exception, e:
-            logger.exception("Graph submission failed")
-            raise Http500("Failed. %s" % str(e))
+        if not self.request.body:
+            raise Http400("The HTTP body is not a valid JSON object")
+
+        encoding = self.request.headers.get('Content-Encoding', 'identity').lower()
+        if encoding not in ('identity', 'gzip'):
+            raise Http400("Unsupported content encoding: %s" % encoding)
 
         host, port = self.getServerAddress()
         # import socket
@@ -29,7 +39,27 @@ class GraphesResource(DispatcherBaseResource):
         # except socket.herror:
         #     host = socket.gethostname()
 
-        self.set_header('Location', 'http://%s:%s/nodes/%d' % (host, port, nodes[0].id))
-        self.set_status(201)
-        self.writeCallback("Graph created.\nCreated nodes: %s" % (",".join([str(node.id) for node in nodes])))
+        try:
+            ticket = self.dispatcher.graphSubmitter.submit(self.request.body, 'http://%s:%s/nodes' % (host, port), encoding)
+        except Exception, e:
+            logger.exception("Graph submission failed")
+            raise Http500("Failed. %s" % str(e))
+
+        self.set_header('Location', 'http://%s:%s/graphs/tickets/%s' % (host, port, ticket.id))
+        self.set_header('Content-Type', 'application/json')
+        self.set_status(202)
+        self.writeCallback(json.dumps({'ticket': TicketRepresentation(ticket)}))
         self.finish()
+
+
+class GraphTicketResource(DispatcherBaseResource):
+    def get(self, ticketId):
+        '''
+        Returns the ticket of a graph submission: its status is OPENED during the registration (the message gives
+        the progress), CLOSED when the graph is registered and ERROR if the submission failed.
+        '''
+        ticket = self.dispatcher.graphSubmitter.getTicket(ticketId)
+        if ticket is None:
+            raise Http404("Ticket not found: %s" % ticketId)
+        self.set_header('Content-Type', 'application/json')
+        self.writeCallback(json.dumps({'ticket': TicketRepresentation(ticket)}))
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+'''
+Latency and size of the requests handled by the dispatcher webservice, and lag of the IOLoop.
+
+Every request is measured by DispatcherBaseResource (from prepare() to on_finish()) and recorded in a histogram
+of its route, i.e. the name of the handler class and the http method. A request longer than
+CORE.SLOW_REQUEST_THRESHOLD seconds is logged with its query.
+
+The lag of the IOLoop is the delay of a timeout scheduled every CORE.IOLOOP_LAG_INTERVAL seconds: it is the
+time the IOLoop was blocked (dispatcher cycle, long handler...) when the timeout should have been run.
+
+Everything is exposed in the Prometheus text format on /metrics:
+    http://localhost:8004/metrics
+'''
+
+import logging
+import time
+from bisect import bisect_left
+
+from tornado.ioloop import IOLoop
+
+from octopus.core import singletonconfig
+
+LOGGER = logging.getLogger('dispatcher.webservice.metrics')
+
+# upper bounds of the buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+    '''
+    | Count of the observed values by bucket, the quantiles are estimated from the buckets.
+    | The last bucket holds the values greater than the last bound.
+    '''
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        '''Estimates a quantile with a linear interpolation in its bucket, as Prometheus histogram_quantile().'''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulated = 0
+        for (index, count) in enumerate(self.counts):
+            if cumulated + count >= rank and count:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - cumulated) / count
+            cumulated += count
+        return self.bounds[-1]
+
+
+class RouteMetrics(object):
+    '''Metrics of the requests of a route (handler class and http method).'''
+
+    __slots__ = ('latency', 'requestBytes', 'responseBytes', 'codes')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.requestBytes = 0
+        self.responseBytes = 0
+        self.codes = {}
+
+
+class WebServiceMetrics(object):
+
+    def __init__(self):
+        self.routes = {}
+        self.slowRequests = 0
+        self.ioLoopLag = Histogram()
+        self.maxIOLoopLag = 0.0
+        self.lagDeadline = None
+
+    def recordRequest(self, handler, duration, requestBytes, responseBytes):
+        key = (handler.__class__.__name__, handler.request.method)
+        route = self.routes.get(key)
+        if route is None:
+            route = self.routes[key] = RouteMetrics()
+        route.latency.observe(duration)
+        route.requestBytes += requestBytes
+        route.responseBytes += responseBytes
+        code = handler.get_status()
+        route.codes[code] = route.codes.get(code, 0) + 1
+
+        if duration >= singletonconfig.get('CORE', 'SLOW_REQUEST_THRESHOLD', 1.0):
+            self.slowRequests += 1
+            LOGGER.warning("Slow request: %s %s handled by %s in %.3fs (status %d, %d bytes in, %d bytes out)" % (
+                handler.request.method, handler.request.uri, key[0], duration, code, requestBytes, responseBytes))
+
+    ## IOLoop lag, measured with a timeout rescheduled after each run
+    #
+    def startLagMonitor(self):
+        if self.lagDeadline is None:
+            self._scheduleLagCheck()
+
+    def _scheduleLagCheck(self):
+        self.lagDeadline = time.time() + singletonconfig.get('CORE', 'IOLOOP_LAG_INTERVAL', 0.5)
+        IOLoop.instance().add_timeout(self.lagDeadline, self._checkLag)
+
+    def _checkLag(self):
+        lag = max(time.time() - self.lagDeadline, 0.0)
+        self.ioLoopLag.observe(lag)
+        self.maxIOLoopLag = max(self.maxIOLoopLag, lag)
+        self._scheduleLagCheck()
+
+    ## Prometheus text format
+    #
+    def toPrometheus(self):
+        lines = []
+        lines.append("# HELP puli_http_request_duration_seconds Duration of the requests, by route.")
+        lines.append("# TYPE puli_http_request_duration_seconds histogram")
+        for ((handler, method), route) in sorted(self.routes.iteritems()):
+            labels = 'handler="%s",method="%s"' % (handler, method)
+            lines.extend(self._histogramLines("puli_http_request_duration_seconds", labels, route.latency))
+
+        lines.append("# HELP puli_http_request_duration_quantile_seconds Quantiles of the duration of the requests, estimated from the histogram.")
+        lines.append("# TYPE puli_http_request_duration_quantile_seconds gauge")
+        for ((handler, method), route) in sorted(self.routes.iteritems()):
+            for q in QUANTILES:
+                lines.append('puli_http_request_duration_quantile_seconds{handler="%s",method="%s",quantile="%s"} %r' % (handler, method, q, route.latency.quantile(q)))
+
+        lines.append("# HELP puli_http_requests_total Number of requests, by route and status code.")
+        lines.append("# TYPE puli_http_requests_total counter")
+        for ((handler, method), route) in sorted(self.routes.iteritems()):
+            for (code, count) in sorted(route.codes.iteritems()):
+                lines.append('puli_http_requests_total{handler="%s",method="%s",code="%d"} %d' % (handler, method, code, count))
+
+        for (name, attribute, description) in (("puli_http_request_bytes_total", "requestBytes", "Size of the request bodies"),
+                                               ("puli_http_response_bytes_total", "responseBytes", "Size of the response bodies")):
+            lines.append("# HELP %s %s, by route." % (name, description))
+            lines.append("# TYPE %s counter" % name)
+            for ((handler, method), route) in sorted(self.routes.iteritems()):
+                lines.append('%s{handler="%s",method="%s"} %d' % (name, handler, method, getattr(route, attribute)))
+
+        lines.append("# HELP puli_http_slow_requests_total Number of requests longer than CORE.SLOW_REQUEST_THRESHOLD.")
+        lines.append("# TYPE puli_http_slow_requests_total counter")
+        lines.append("puli_http_slow_requests_total %d" % self.slowRequests)
+
+        lines.append("# HELP puli_ioloop_lag_seconds Delay of the timeouts of the IOLoop.")
+        lines.append("# TYPE puli_ioloop_lag_seconds histogram")
+        lines.extend(self._histogramLines("puli_ioloop_lag_seconds", "", self.ioLoopLag))
+        lines.append("# HELP puli_ioloop_lag_max_seconds Maximum delay of the timeouts of the IOLoop.")
+        lines.append("# TYPE puli_ioloop_lag_max_seconds gauge")
+        lines.append("puli_ioloop_lag_max_seconds %r" % self.maxIOLoopLag)
+        return "\n".join(lines) + "\n"
+
+    def _histogramLines(self, name, labels, histogram):
+        separator = "," if labels else ""
+        cumulated = 0
+        for (bound, count) in zip(histogram.bounds, histogram.counts):
+            cumulated += count
+            yield '%s_bucket{%s%sle="%r"} %d' % (name, labels, separator, bound, cumulated)
+        yield '%s_bucket{%s%sle="+Inf"} %d' % (name, labels, separator, histogram.count)
+        labels = "{%s}" % labels if labels else ""
+        yield '%s_sum%s %r' % (name, labels, histogram.sum)
+        yield '%s_count%s %d' % (name, labels, histogram.count)
+
+
+theMetrics = WebServiceMetrics()
+
@@ -98,52 +98,18 @@ class NodeNameResource(NodesResource):
 class NodeCancelResource(NodesResource):
     '''
     A webservice dedicated to cancelling nodes.
-    It handles the process in 2 steps:
-    - reset node and commands on the dispatch tree (server side)
-    - send "DELETE" request to the rendernode on which a command was assigned
-    The 2nd step is executed in a dedicated thread to avoir blocking tornado
+    The node and its commands are cancelled on the dispatch tree (server side), the "DELETE" requests to the
+    rendernodes on which a command was running are sent in the background by the shared kill sender (see
+    octopus.dispatcher.killsender).
     '''
 
     def put(self, nodeId):
-        # If user action is CANCEL, we use asynchronous webservice to avoid the timeout that 
-        # might occur when sending requests to each render node.
-        
         node = self._findNode( int(nodeId) )
-        self.interruptedRnList = []
-
+        node.cancelPendingCommands()
         for cmd in node.cmdIterator():
-            if cmd.status == CMD_RUNNING:
-                self.interruptedRnList.append( (cmd.renderNode, cmd.id) )
-                cmd.status = CMD_CANCELED
-
-        if len(self.interruptedRnList) > 0:
-            from threading import Thread
-            t = Thread(target=self.sendCancelRequests)
-            t.start()
+            cmd.cancel()
 
-        # logger.debug("Done updating server")
         self.writeCallback("New status has been taken into account. Change will be effective soon")
-        self.finish()
-
-
-    def sendCancelRequests( self ):
-        '''
-        Send a specific request to each rendernodes. It uses the 
-        '''
-        for rn,cmdId in self.interruptedRnList:
-            # For each RN marked as having a running command
-            try:
-                rn.request("DELETE", "/commands/" + str(cmdId) + "/")
-            except:
-                logger.warning("Problem occured interruption of %s for command %s (however command has already been reseted on the server)" % (cmdId, rn))
-
-            # Reset RN assignment to make it available for a future assignment
-            rn.clearAssignment(self)
-
-        # Clean rn list after process
-        self.interruptedRnList = []
-
-        
 
 
 class NodeStatusResource(NodesResource):
@@ -178,6 +144,7 @@ class NodeStatusResource(NodesResource):
             # handles the case of retry all commands on error
             #
             if "cmdStatus" in arguments.keys() and nodeStatus == NODE_READY:
+                self.dispatcher.coldStorage.thaw(node)
                 filterfunc = lambda command: command.status in [int(s) for s in arguments['cmdStatus']]
                 # get the list of commands that are in the requested status
                 if isinstance(node, FolderNode):
@@ -193,6 +160,9 @@ class NodeStatusResource(NodesResource):
                             tasks.append(child)
                     else:
                         commands += [c for c in task.commands if filterfunc(c)]
+                        # the commands not created yet share the status of the pending commands
+                        if task.hasPendingCommands() and filterfunc(task.pendingCommands):
+                            task.setPendingCommandsStatus(CMD_READY)
                 # reset the completion of the commands and mark them as ready
                 for cmd in commands:
                     # cmd.completion = 0
@@ -217,12 +187,12 @@ class NodeStatusResource(NodesResource):
                 if nodeStatus not in NODE_STATUS:
                     raise Http400("Invalid status value %r" % nodeStatus)
                 elif nodeStatus == NODE_CANCELED:
-                    # If user action is CANCEL, we use asynchronous webservice to avoid the timeout that 
-                    # might occur when sending requests to each render node.
-                    self.gen = node.cmdIterator()
-                    tornado.ioloop.IOLoop.instance().add_callback(self.iterOnCommands)
-
+                    # the kill requests are sent to the render nodes in the background
+                    node.cancelPendingCommands()
+                    for cmd in node.cmdIterator():
+                        cmd.cancel()
                     self.writeCallback("New status (CANCEL) has been taken into account. Change will be effective soon")
+                    self.finish()
                 else:
                     if node.setStatus(nodeStatus, cascadeUpdate):
                         self.writeCallback("Status set to %r" % nodeStatus)
@@ -231,21 +201,6 @@ class NodeStatusResource(NodesResource):
                         self.writeCallback("Status was not changed.")
                         self.finish()
 
-    
-    def iterOnCommands( self ):
-        """
-        Cancel each command in a node hierarchy (command is given by a generator on the node)
-        Each command might be blocked by network pb (or machine swapping) but asynchronous mecanism will
-        allow other request to be treated between each command cancelation.
-        """
-        try:
-            # Get next command in generator
-            cmd = self.gen.next()
-            cmd.cancel()
-            tornado.ioloop.IOLoop.instance().add_callback(self.iterOnCommands)
-        except StopIteration:
-            self.finish()
-
 
 class NodePausedResource(NodesResource):
     ##@queue
@@ -397,6 +352,7 @@ class NodeProdResource(NodesResource):
             nodeId = int(nodeId)
             node = self._findNode(nodeId)
             node.tags["prod"] = str(prod)
+            self.dispatcher.dispatchTree.jobIndex.update(node, "tags")
             self.dispatcher.dispatchTree.toModifyElements.append(node)
 
 
@@ -11,6 +11,10 @@ Le webservice prend en charge les requêtes de la forme:
 http://localhost:8004/query?attr=id
 http://localhost:8004/query?constraint_user=jsa
 http://localhost:8004/query?attr=id&attr=name&attr=user&constraint_user=jsa&constraint_prod=ddd
+http://localhost:8004/query?constraint_user=jsa&limit=100&after_id=1234
+
+Les jobs sont tries par id. Avec "limit", seuls les "limit" premiers jobs sont renvoyes et "nextCursor" donne l'id
+a passer dans "after_id" pour obtenir la page suivante (null s'il n'y a plus de resultat).
 
 Les champs sur lesquels peuvent porter les requetes: user,prod,date
 
@@ -19,7 +23,9 @@ On retourne un objet json au format:
     'summary':
     {
         'count': int,
+        'totalMatching': int,
         'totalInDispatcher': int, 
+        'nextCursor': int,
         'requestTime': datetime,
         'requestDate': datetime,
     } 
@@ -55,14 +61,18 @@ except ImportError:
     import json
 import logging
 import time
+from bisect import bisect_right
 from datetime import datetime
+from operator import attrgetter
 
+import tornado
 from tornado.web import HTTPError
 
 from octopus.dispatcher.model import FolderNode
 from octopus.dispatcher.model.nodequery import IQueryNode
 
 from octopus.core.communication.http import Http404, Http400, Http500, HttpConflict
+from octopus.core import singletonconfig
 from octopus.core.framework import queue
 from octopus.dispatcher.webservice import DispatcherBaseResource
 
@@ -77,56 +87,81 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
                      'startTime', 'creationTime', 'endTime', 'updateTime', \
                      'averageTimeByFrame', 'maxTimeByFrame', 'minTimeByFrame', \
                      'maxRN', 'allocatedRN', 'maxAttempt']
+    DEFAULT_CHUNK_SIZE = 500
 
 
-    def createTaskRepr( self, pNode, pAttributes, pTree=False ):
+    def getProjection( self, pAttributes ):
         """
-        Create a json representation for a given node hierarchy and user attributes.
-        Recursive call to represent the FolderNode/TaskNode tree
-        param: node to explore
+        Create the list of (key, getter) used to represent each node, it is computed once per request and only the
+        requested attributes are read on the nodes.
         param: attributes to retrieve on each node
-        param: flag to indicate if user wants to retrieve subtasks (enable recursive call)
-        return: a json dict
+        return: a list of tuples (key in the json dict, function returning the value for a node)
         """
-        currTask = {}
+        projection = []
         for currArg in pAttributes:
-            #
-            # Get value of additionnally supported field
-            #
             if currArg.startswith("tags:"):
                 # Attribute name references a "tags" item
-                tag = unicode(currArg[5:])
-                value = unicode(pNode.tags.get(tag,''))
-                currTask[tag] = value
+                key = unicode(currArg[5:])
+                getter = lambda pNode, tag=key: unicode(pNode.tags.get(tag,''))
             elif currArg == "pool":
                 # Attribute 'pool' is a specific item
-                currTask[currArg] = pNode.poolShares.keys()[0].name
+                key = currArg
+                getter = lambda pNode: pNode.poolShares.keys()[0].name
             elif currArg == "userDefinedMaxRn":
                 # Attribute 'userDefiniedMaxRN' is a specific item
-                currTask[currArg] = pNode.poolShares.values()[0].userDefinedMaxRN
-
-            #
-            # Get value of standard field
-            #
+                key = currArg
+                getter = lambda pNode: pNode.poolShares.values()[0].userDefinedMaxRN
+            elif currArg.startswith("_"):
+                logger.warning('Error retrieving data, invalid attribute requested : %s', currArg )
+                raise Http400( "Invalid attribute requested: %s" % currArg )
             else:
                 # Attribute is a standard attribute of a Node
-                currTask[currArg] =  getattr(pNode, currArg, 'undefined')
+                key = currArg
+                getter = lambda pNode, attr=currArg: getattr(pNode, attr, 'undefined')
+            projection.append( (key, getter) )
+        return projection
 
-        if pTree and hasattr(pNode, 'children'):
-            childTasks = []
-            for child in pNode.children:
-                childTasks.append( self.createTaskRepr( child, pAttributes, pTree ) )
 
-            currTask['items'] = childTasks
+    def createTaskRepr( self, pNode, pProjection, pTree=False ):
+        """
+        Create a json representation for a given node hierarchy and user attributes.
+        Recursive call to represent the FolderNode/TaskNode tree
+        param: node to explore
+        param: projection of the attributes to retrieve on each node (see getProjection)
+        param: flag to indicate if user wants to retrieve subtasks (enable recursive call)
+        return: a json dict
+        """
+        currTask = {}
+        for key, getter in pProjection:
+            currTask[key] = getter(pNode)
+
+        if pTree and hasattr(pNode, 'children'):
+            currTask['items'] = [self.createTaskRepr( child, pProjection, pTree ) for child in pNode.children]
         return currTask
 
+
+    def getIntArgument( self, pName ):
+        """
+        Returns the value of an optionnal integer argument of the request or None
+        """
+        if pName not in self.request.arguments:
+            return None
+        try:
+            return int(self.request.arguments[pName][0])
+        except ValueError:
+            raise Http400( "Invalid value for argument %s: %s" % (pName, self.request.arguments[pName][0]) )
+
+
+    @tornado.web.asynchronous
     def get(self):
         """
         Handle user query request.
           1. init timer and result struct
           2. check attributes to retrieve
           3. limit nodes list regarding the given query filters
-          4. for each filtered node: add info in result
+          4. select the requested page: jobs are sorted by id, "after_id" is the id of the last job of the previous
+             page and "limit" the maximum number of jobs to return
+          5. stream the result, chunk by chunk, the dispatcher can handle other events between two chunks
         """
         args = self.request.arguments
         
@@ -137,75 +172,48 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
 
         try:
             start_time = time.time()
-            resultData = []
-            filteredNodes = []
 
-            nodes = self.getDispatchTree().nodes[1].children
-            totalNodes = len(nodes)
+            limit = self.getIntArgument( 'limit' )
+            afterId = self.getIntArgument( 'after_id' )
+            if limit is not None and limit <= 0:
+                raise Http400( "Invalid value for argument limit: %d" % limit )
 
             #
-            # --- Check if result list (without filtering) is already empty
-            #
-            if len(nodes) == 0:
-                content = { 'summary': { \
-                                'count':0, \
-                                'totalInDispatcher':0, \
-                                'requestTime':time.time() - start_time, \
-                                'requestDate':time.ctime() }, \
-                            'items':resultData }
-            
-                self.writeCallback( json.dumps(content) )
-                return
-
-
-            #
-            # --- Check if display attributes are valid
-            #     We handle 2 types of attributes: 
-            #       - simple node attributes
+            # --- Retrieve only requested attributes
+            #     We handle 2 types of attributes:
+            #       - simple node attributes (undefined if the node does not have it)
             #       - "tags" node attributes (no verification, it is not mandatory)
             #
-            # if 'attr' in args:
-            #     for currAttribute in args['attr']:
-            #         if not currAttribute.startswith("tags:"):
-            #             if not hasattr(nodes[0],currAttribute):
-            #                 if currAttribute not in QueryResource.ADDITIONNAL_SUPPORTED_FIELDS :
-            #                     logger.warning('Error retrieving data, invalid attribute requested : %s', currAttribute )
-            #                     raise HTTPError( 500, "Invalid attribute requested: %s" % (currAttribute) )
-            # else:
-            #     # Using default result attributes
-            #     args['attr'] = QueryResource.DEFAULT_FIELDS
             if 'attr' not in args:
                 # Using default result attributes
                 args['attr'] = QueryResource.DEFAULT_FIELDS
+            projection = self.getProjection( args['attr'] )
 
+            nodes = self.getDispatchTree().nodes[1].children
+            totalNodes = len(nodes)
 
             #
-            # --- filtering
+            # --- filtering and sorting (the index returns nodes already sorted by id)
             #
-            filteredNodes = self.filterNodes( args, nodes )
-
+            filteredNodes = self.filterNodes( args, nodes, self.getDispatchTree().jobIndex )
+            filteredNodes = sorted( filteredNodes, key=attrgetter('id') )
 
             #
-            # --- Prepare the result json object
+            # --- pagination
             #
-            for currNode in filteredNodes:
-                currTask = self.createTaskRepr(currNode, args['attr'], tree)
-                resultData.append( currTask )
-
-            content = { 
-                        'summary': 
-                            { 
-                            'count':len(filteredNodes), 
-                            'totalInDispatcher':totalNodes, 
-                            'requestTime':time.time() - start_time,
-                            'requestDate':time.ctime()
-                            }, 
-                        'items':resultData 
-                        }
-
-            # Create response and callback
-            self.writeCallback( json.dumps(content) )
-
+            begin = 0
+            if afterId is not None:
+                begin = bisect_right( [node.id for node in filteredNodes], afterId )
+            end = len(filteredNodes) if limit is None else min(begin + limit, len(filteredNodes))
+            page = filteredNodes[begin:end]
+
+            summary = {
+                        'count':len(page),
+                        'totalMatching':len(filteredNodes),
+                        'totalInDispatcher':totalNodes,
+                        'nextCursor':page[-1].id if end < len(filteredNodes) else None,
+                        'requestDate':time.ctime()
+                      }
 
         except KeyError:
             raise Http404('Error unknown key')
@@ -217,7 +225,40 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
             logger.warning('Impossible to retrieve result for query: %s', self.request.uri)
             raise HTTPError( 500, "Internal error")
 
+        self.set_header( 'Content-Type', 'application/json' )
+        self.response = self.responseGenerator( page, projection, tree, summary, start_time )
+        self.loop()
+
+
+    def loop( self ):
+        try:
+            self.response.next()
+        except StopIteration:
+            self.finish()
+        except Exception, e:
+            logger.warning('Impossible to send result for query: %s - %r', self.request.uri, e)
+            self.finish()
+        else:
+            # wait for the chunk to be sent, the IOLoop can process other requests meanwhile
+            self.flush( callback=self.loop )
+
+
+    def responseGenerator( self, pNodes, pProjection, pTree, pSummary, pStartTime ):
+        """
+        Generator writing the json result by chunks of nodes, only one chunk is represented in memory at a time.
+        The "summary" is written after the "items", once the request time is known.
+        """
+        callback = self.request.arguments.get('callback')
+        chunkSize = singletonconfig.get( 'CORE', 'QUERY_CHUNK_SIZE', QueryResource.DEFAULT_CHUNK_SIZE )
+
+        self.write( ('%s(' % callback[0] if callback else '') + '{"items": [' )
+        for begin in xrange( 0, len(pNodes), chunkSize ):
+            items = [json.dumps( self.createTaskRepr(currNode, pProjection, pTree) ) for currNode in pNodes[begin:begin + chunkSize]]
+            self.write( (', ' if begin else '') + ', '.join(items) )
+            yield begin
 
+        pSummary['requestTime'] = time.time() - pStartTime
+        self.write( '], "summary": %s}' % json.dumps(pSummary) + (');' if callback else '') )
 
 
 
@@ -280,6 +280,50 @@ class RenderNodeSysInfosResource(DispatcherBaseResource):
 
         renderNode.lastAliveTime = time.time()
         renderNode.isRegistered = True
+        self.getDispatchTree().renderNodeTelemetry.sample(renderNode, renderNode.lastAliveTime, dct.get("systemLoad"))
+
+
+class RenderNodeHistoryResource(DispatcherBaseResource):
+    """
+    Recent samples of the free RAM, swap and load and status transitions of a render node (see
+    octopus.dispatcher.model.telemetry).
+    """
+
+    def get(self, computerName):
+        computerName = computerName.lower()
+        try:
+            renderNode = self.getDispatchTree().renderNodes[computerName]
+        except KeyError:
+            raise Http404("RenderNode not found")
+        content = self.getDispatchTree().renderNodeTelemetry.history(renderNode)
+        content['name'] = renderNode.name
+        content['statusNames'] = RN_STATUS_NAMES
+        self.writeCallback(json.dumps(content))
+
+
+class RenderNodesTelemetryResource(DispatcherBaseResource):
+    """
+    Summary of the recent system infos of every render node, over the last "window" seconds (1 hour by default).
+    The nodes whose mean swap is above "swap" percent and the nodes with at least "transitions" status changes in the
+    window are listed in "swapping" and "flapping".
+    """
+
+    def get(self):
+        try:
+            window = float(self.get_argument('window', 3600))
+            swapThreshold = float(self.get_argument('swap', 10))
+            transitionsThreshold = int(self.get_argument('transitions', 10))
+        except ValueError:
+            raise Http400("Invalid window, swap or transitions value")
+        summary = self.getDispatchTree().renderNodeTelemetry.summary(window)
+        names = summary['name']
+        content = {
+            'window': window,
+            'rendernodes': summary,
+            'swapping': [name for (name, swap) in zip(names, summary['meanSwap']) if swap is not None and swap > swapThreshold],
+            'flapping': [name for (name, count) in zip(names, summary['transitions']) if count >= transitionsThreshold],
+        }
+        self.writeCallback(json.dumps(content))
 
 
 class RenderNodesPerfResource(DispatcherBaseResource):
@@ -40,6 +40,10 @@ class TasksResource(DispatcherBaseResource):
 
 
 class DeleteTasksResource(DispatcherBaseResource):
+    """
+    | Archives a list of tasks. The tasks are queued in the archiver of the dispatcher (see octopus.dispatcher.archiver)
+    | and archived by batches during the next cycles, the tasks which are not done or canceled are not archived.
+    """
     #@queue
     def post(self):
         data = self.getBodyAsJSON()
@@ -49,26 +53,16 @@ class DeleteTasksResource(DispatcherBaseResource):
             return HTTPError(400, 'Missing entry: "taskids".')
         else:
             taskidsList = taskids.split(",")
+            validIds = []
             for taskId in taskidsList:
                 try:
-                    taskId = int(taskId)
+                    validIds.append(int(taskId))
                 except ValueError,e:
                     logger.warning("A task id to delete is not a correct integer %r (from list: %r)." % (taskId, taskidsList))
                     continue
 
-                try:
-                    task = self.getDispatchTree().tasks[taskId]
-                except KeyError:
-                    logger.warning("Trying to archive task %s that no longer exists." % str(taskId))
-                    continue
-
-                if task.nodes.values()[0].status not in ALLOWED_STATUS_VALUES:
-                    logger.warning("Preventing archiving of task %s [Bad status]." % str(taskId))
-                    continue
-                    #return BadStatusValueResponse()
-
-                task.archive()
-            self.writeCallback("Tasks archived successfully.")
+            count = self.dispatcher.archiver.enqueue(validIds)
+            self.writeCallback("%d tasks queued for archiving." % count)
 
 
 class TaskResource(DispatcherBaseResource):
@@ -83,9 +77,12 @@ class TaskResource(DispatcherBaseResource):
     def _findTask(self, taskId):
         taskId = int(taskId)
         try:
-            return self.getDispatchTree().tasks[taskId]
+            task = self.getDispatchTree().tasks[taskId]
         except KeyError:
             raise TaskNotFoundError(taskId)
+        # the details of a task include its commands, they are loaded back if the job is cold
+        self.dispatcher.coldStorage.thawTask(task)
+        return task
 
 
 class TaskCommentResource(TaskResource):
@@ -20,11 +20,12 @@ from tornado.web import Application
 
 from octopus.dispatcher.webservice import commands, rendernodes, graphs, nodes,\
     tasks, poolshares, pools, licenses, \
-    query, edit
+    query, edit, changes
 
 from octopus.core.communication.http import Http404, Http400, Http500, HttpConflict
-from octopus.core.enums.command import *
 from octopus.dispatcher.webservice import DispatcherBaseResource
+from octopus.dispatcher.webservice.metrics import theMetrics
+from octopus.dispatcher.profiler import theProfiler
 from octopus.core import singletonconfig
 from octopus.dispatcher import settings
 
@@ -33,7 +34,9 @@ from octopus.dispatcher import settings
 class WebServiceDispatcher(Application):
     def __init__(self, framework, port):
         super(WebServiceDispatcher, self).__init__([
+            (r'/stats/aggregate/?$', StatsAggregateResource, dict(framework=framework)),
             (r'/stats/?$', StatsResource, dict(framework=framework)),
+            (r'/metrics/?$', MetricsResource, dict(framework=framework)),
 
             (r'/licenses/?$', licenses.LicensesResource, dict(framework=framework)),
             (r'/licenses/([\w.-]+)/?$', licenses.LicenseResource, dict(framework=framework)),
@@ -44,13 +47,16 @@ class WebServiceDispatcher(Application):
             (r'/rendernodes/?$', rendernodes.RenderNodesResource, dict(framework=framework)),
             (r'/rendernodes/performance/?$', rendernodes.RenderNodesPerfResource, dict(framework=framework)),
             (r'/rendernodes/quarantine/?$', rendernodes.RenderNodeQuarantineResource, dict(framework=framework)),
+            (r'/rendernodes/telemetry/?$', rendernodes.RenderNodesTelemetryResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/?$', rendernodes.RenderNodeResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/commands/(\d+)/?$', rendernodes.RenderNodeCommandsResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/sysinfos/?$', rendernodes.RenderNodeSysInfosResource, dict(framework=framework)),
+            (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/history/?$', rendernodes.RenderNodeHistoryResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/paused/?$', rendernodes.RenderNodePausedResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/reset/?$', rendernodes.RenderNodeResetResource, dict(framework=framework)),
 
             (r'^/graphs/?$', graphs.GraphesResource, dict(framework=framework)),
+            (r'^/graphs/tickets/([\w-]+)/?$', graphs.GraphTicketResource, dict(framework=framework)),
 
             (r'^/nodes/?$', nodes.NodesResource, dict(framework=framework)),
             (r'^/nodes/(\d+)/?$', nodes.NodeResource, dict(framework=framework)),
@@ -99,13 +105,19 @@ class WebServiceDispatcher(Application):
             (r'^/edit/prio$', edit.EditPrioResource, dict(framework=framework)),
             (r'^/pause$', edit.PauseResource, dict(framework=framework)),
             (r'^/resume$', edit.ResumeResource, dict(framework=framework)),
+            (r'^/edit/bulk$', edit.BulkEditResource, dict(framework=framework)),
 
             (r'^/query/rn$', query.RenderNodeQueryResource, dict(framework=framework)),
             (r'^/edit/rn$', edit.RenderNodeEditResource, dict(framework=framework)),
 
             (r'^/query/command$', commands.CommandQueryResource, dict(framework=framework)),
+
+            # Changes of nodes, commands and rendernodes since a revision (long-poll or server-sent events)
+            (r'^/changes/?$', changes.ChangesResource, dict(framework=framework)),
+            (r'^/changes/stream/?$', changes.ChangesStreamResource, dict(framework=framework)),
             
             (r'^/reconfig$', ReconfigResource, dict(framework=framework)),
+            (r'^/profile/?$', ProfileResource, dict(framework=framework)),
             (r'^/dbg$', DbgResource, dict(framework=framework)),
 
             # Standard WS to retrieve log file from server
@@ -115,6 +127,8 @@ class WebServiceDispatcher(Application):
 
         self.listen(port, "0.0.0.0")
         self.framework = framework
+        theMetrics.startLagMonitor()
+        theProfiler.configure()
 
 class DbgResource(DispatcherBaseResource):
     """
@@ -135,6 +149,18 @@ class DbgResource(DispatcherBaseResource):
 
 
 class StatsResource(DispatcherBaseResource):
+    '''
+    | Farm-wide statistics. The commands can also be counted by group of tasks, e.g.:
+    |     http://localhost:8004/stats?groupBy=user&groupBy=prod
+    | adds a "commandsBy" entry: { "user": { "jsa": {"commands": {"DONE": 12, ...}, "total": 20, "completion": 13.5}, ...}, "prod": {...} }
+    '''
+    # functions giving the group of a task for each "groupBy" value
+    GROUP_KEYS = {
+        'user': lambda task: task.user,
+        'prod': lambda task: task.tags.get('prod'),
+        'task': lambda task: task.id,
+    }
+
     def get(self):
         from octopus.core.enums.rendernode import RN_UNKNOWN, RN_STATUS_NAMES
         from octopus.core.enums.node import NODE_STATUS_NAMES
@@ -144,15 +170,15 @@ class StatsResource(DispatcherBaseResource):
         #
         # Get info on commands
         #
-        commandsByStatus = {}
-        for name in CMD_STATUS_NAME:
-            commandsByStatus[name] = 0
-        for command in tree.commands.values():
-            status = CMD_STATUS_NAME[command.status]
-            commandsByStatus[status] += 1
-
+        commandsByStatus = tree.commandStore.getStatusCounts()
         commandsByStatus['TOTAL'] = len(tree.commands)
 
+        commandsBy = {}
+        for groupBy in self.request.arguments.get('groupBy', []):
+            if groupBy not in self.GROUP_KEYS:
+                raise Http400("Invalid groupBy value: %s (valid values: %s)" % (groupBy, ", ".join(sorted(self.GROUP_KEYS))))
+            commandsBy[groupBy] = tree.commandStore.aggregate(tree.tasks, self.GROUP_KEYS[groupBy])
+
         #
         # Get info rendernodes
         #        
@@ -186,25 +212,61 @@ class StatsResource(DispatcherBaseResource):
         stats = {
             'date': time.time(),
             'commands': commandsByStatus,
+            'commandsBy': commandsBy,
             'rendernodes': renderNodeStats,
             'jobs': jobsByStatus,
+            'pools': tree.getPoolStats(),
             'licenses': repr(self.dispatcher.licenseManager),
             'licensesDict': self.dispatcher.licenseManager.stats()
         }
         self.writeCallback(stats)
 
 
+class StatsAggregateResource(DispatcherBaseResource):
+    '''
+    | Counters of the active jobs (not done nor canceled) grouped by prod, user, pool, step, type or shot, e.g.:
+    |     http://localhost:8004/stats/aggregate?by=prod,user,pool
+    | returns { "prod": { "ddd": {"jobs": 15, "err": 1, "paused": 2, "ready": 10, "running": 2, "allocatedRN": 5,
+    |           "readyCommandCount": 15}, ...}, "user": {...}, "pool": {...}, "total": {...}, "requestDate": 1396433761.0 }
+    | The counters are kept up to date by the job index of the dispatch tree (see nodeindex.JobStats), the jobs are
+    | not serialized nor scanned.
+    '''
+    def get(self):
+        from octopus.dispatcher.model.nodeindex import JobStats
+
+        dimensions = []
+        for value in self.request.arguments.get('by', []):
+            for dimension in value.split(','):
+                dimension = dimension.strip()
+                if not dimension or dimension in dimensions:
+                    continue
+                if dimension not in JobStats.DIMENSIONS:
+                    raise Http400("Invalid aggregation: %s (valid values: %s)" % (dimension, ", ".join(JobStats.DIMENSIONS)))
+                dimensions.append(dimension)
+
+        stats = self.getDispatchTree().jobIndex.stats.getStats(dimensions)
+        stats['requestDate'] = time.time()
+        self.writeCallback(stats)
+
+
+class MetricsResource(DispatcherBaseResource):
+    '''
+    Latency histograms and sizes of the requests by route, lag of the IOLoop (see octopus.dispatcher.webservice.metrics)
+    and render nodes and queue pressure of the pools (see octopus.dispatcher.model.capacity), in the Prometheus text
+    format.
+    '''
+    def get(self):
+        tree = self.getDispatchTree()
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(theMetrics.toPrometheus() + tree.poolCapacity.toPrometheus(tree.getPoolStats()))
+
+
 class MobileResource(DispatcherBaseResource):
     def get(self):
         from octopus.core.enums.rendernode import RN_STATUS_NAMES
         html = "<meta name = \"viewport\" content = \"width = device-width\">\n<meta name = \"viewport\" content = \"width = 320\">"
         tree = self.getDispatchTree()
-        commandsByStatus = {}
-        for name in CMD_STATUS_NAME:
-            commandsByStatus[name] = 0
-        for command in tree.commands.values():
-            status = CMD_STATUS_NAME[command.status]
-            commandsByStatus[status] += 1
+        commandsByStatus = tree.commandStore.getStatusCounts()
         del commandsByStatus["FINISHING"]
         commandsByStatus['TOTAL'] = len(tree.commands)
 
@@ -265,9 +327,17 @@ class SystemResource(DispatcherBaseResource):
 
 
 class ReconfigResource(DispatcherBaseResource):
+    '''
+    | Reloads the config file. The profiler can also be switched without editing the file:
+    |     curl -X POST http://localhost:8004/reconfig?profile=on
+    '''
     def post(self):
+        profile = self.get_argument('profile', None)
+        if profile not in (None, 'on', 'off'):
+            raise Http400("Invalid profile value: %s (valid values: on, off)" % profile)
         try:
             singletonconfig.reload()
+            theProfiler.configure(None if profile is None else profile == 'on')
 
             # FIXME on est oblige de changer le loglevel de tous les loggers du projet...
             # Il faudrait pouvoir affecter tous les log d'un seul coup
@@ -316,6 +386,30 @@ class ReconfigResource(DispatcherBaseResource):
         self.writeCallback("done")
 
 
+class ProfileResource(DispatcherBaseResource):
+    '''
+    | Data of the profiler of the dispatch cycle as folded stacks, to be rendered with flamegraph.pl (see
+    | octopus.dispatcher.profiler):
+    |     http://localhost:8004/profile?mode=spans     self time of the spans, in microseconds
+    |     http://localhost:8004/profile?mode=samples   number of samples of each python stack
+    | DELETE clears the collected data.
+    '''
+    def get(self):
+        mode = self.get_argument('mode', 'spans')
+        if mode == 'spans':
+            folded = theProfiler.foldedSpans()
+        elif mode == 'samples':
+            folded = theProfiler.foldedSamples()
+        else:
+            raise Http400("Invalid mode: %s (valid values: spans, samples)" % mode)
+        self.set_header('Content-Type', 'text/plain')
+        self.write(folded)
+
+    def delete(self):
+        theProfiler.clear()
+        self.writeCallback("done")
+
+
 class SystemResourceJson(DispatcherBaseResource):
     def get(self):
         """
@@ -0,0 +1,312 @@
+'''
+Helpers to handle the log files of the commands executed on a worker.
+
+Each command writes its output in <LOGDIR>/<taskId>/<commandId>.log. Once the command is finished, the log
+is compressed in the background to <commandId>.log.gz, with the size of the log in the header (see writeGzip).
+When a command is restarted on the same worker, the logs of the previous executions are rotated to
+<commandId>.log.1.gz, <commandId>.log.2.gz...
+
+The functions here are also used by the worker webservice to serve a part of a log (byte range or last lines)
+without reading the whole file.
+'''
+
+import os
+import zlib
+import struct
+import time
+import heapq
+import logging
+from collections import deque
+from threading import Thread, Condition
+
+LOGGER = logging.getLogger("worker.commandlog")
+
+GZIP_SUFFIX = ".gz"
+BLOCK_SIZE = 65536
+MAX_DEFLATE_RATIO = 1032
+# flag and id of the subfield of the gzip header "extra field" holding the size of the uncompressed log
+FEXTRA = 4
+SIZE_SUBFIELD = "PS"
+
+
+def findLog(path):
+    '''
+    Returns the file actually holding the log for the given path: the raw log if the command is running or
+    not yet compressed, the compressed log otherwise.
+
+    :return: a tuple (filePath, compressed), filePath is None if no log exists
+    '''
+    if os.path.isfile(path):
+        return path, False
+    if os.path.isfile(path + GZIP_SUFFIX):
+        return path + GZIP_SUFFIX, True
+    return None, False
+
+
+def rotateLog(path, backups):
+    '''
+    Moves the logs of a previous execution of the command before a new one is started.
+    <path> or <path>.gz becomes <path>.1(.gz), <path>.1(.gz) becomes <path>.2(.gz) and so on. Logs older than
+    "backups" executions are removed.
+    '''
+    def existing(base):
+        for candidate in (base + GZIP_SUFFIX, base):
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    oldest = existing("%s.%d" % (path, backups) if backups > 0 else path)
+    if oldest is not None:
+        os.remove(oldest)
+    for index in xrange(backups - 1, -1, -1):
+        source = existing("%s.%d" % (path, index) if index else path)
+        if source is None:
+            continue
+        suffix = GZIP_SUFFIX if source.endswith(GZIP_SUFFIX) else ""
+        os.rename(source, "%s.%d%s" % (path, index + 1, suffix))
+
+
+def compressLog(path, level=6, inode=None):
+    '''
+    Compresses <path> into <path>.gz and removes <path>. The raw file is only removed if it has not been
+    replaced in the meantime (e.g. by the log of a new execution of the same command). If an inode is given,
+    nothing is done unless <path> is still this file.
+
+    :return: the size of the compressed file or None if there was nothing to compress
+    '''
+    try:
+        source = open(path, "rb")
+    except IOError:
+        return None
+
+    tmpPath = path + GZIP_SUFFIX + ".tmp"
+    try:
+        if inode is None:
+            inode = os.fstat(source.fileno()).st_ino
+        elif os.fstat(source.fileno()).st_ino != inode:
+            return None
+        target = open(tmpPath, "wb")
+        try:
+            writeGzip(source, target, level)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    try:
+        if os.stat(path).st_ino != inode:
+            os.remove(tmpPath)
+            return None
+    except OSError:
+        os.remove(tmpPath)
+        return None
+    os.rename(tmpPath, path + GZIP_SUFFIX)
+    os.remove(path)
+    return os.path.getsize(path + GZIP_SUFFIX)
+
+
+def writeGzip(source, target, level=6):
+    '''
+    Compresses a file in the gzip format (as gzip.open), the size of the uncompressed data is written in the extra
+    field of the header: the trailer only stores it modulo 4Go. The extra field is skipped by the gzip readers.
+    The target must be seekable, the size is written once the whole source is read.
+    '''
+    target.write(struct.pack("<BBBBIBB", 0x1f, 0x8b, zlib.DEFLATED, FEXTRA, int(time.time()), 0, 255))
+    target.write(struct.pack("<H", 12) + SIZE_SUBFIELD + struct.pack("<H", 8))
+    sizeOffset = target.tell()
+    target.write(struct.pack("<Q", 0))
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = zlib.crc32("")
+    size = 0
+    while True:
+        block = source.read(BLOCK_SIZE)
+        if not block:
+            break
+        size += len(block)
+        crc = zlib.crc32(block, crc)
+        target.write(compressor.compress(block))
+    target.write(compressor.flush())
+    target.write(struct.pack("<II", crc & 0xffffffff, size & 0xffffffff))
+
+    target.seek(sizeOffset)
+    target.write(struct.pack("<Q", size))
+
+
+def parseRange(header, size):
+    '''
+    Parses a single range "Range" http header (e.g. "bytes=0-1023", "bytes=1024-", "bytes=-500").
+
+    :return: a tuple (start, end) with end excluded, or None if the header is not a valid single range.
+    :raise ValueError: if the range can not be satisfied
+    '''
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    try:
+        first, last = header[len("bytes="):].strip().split("-", 1)
+        if first:
+            start = int(first)
+            end = int(last) + 1 if last else size
+        else:
+            start = max(0, size - int(last))
+            end = size
+    except ValueError:
+        return None
+    end = min(end, size)
+    if start >= end:
+        raise ValueError("Range not satisfiable: %r for %d bytes" % (header, size))
+    return start, end
+
+
+def tailOffset(fileObj, lines, size):
+    '''
+    Returns the offset of the first byte of the last "lines" lines of a file, reading blocks from its end.
+    A trailing newline does not count as an additional line.
+    '''
+    if lines <= 0:
+        return size
+    offset = size
+    count = 0
+    trailing = True
+    while offset > 0:
+        blockStart = max(0, offset - BLOCK_SIZE)
+        fileObj.seek(blockStart)
+        block = fileObj.read(offset - blockStart)
+        end = len(block)
+        if trailing and block.endswith("\n"):
+            end -= 1
+        trailing = False
+        while True:
+            index = block.rfind("\n", 0, end)
+            if index == -1:
+                break
+            count += 1
+            if count == lines:
+                return blockStart + index + 1
+            end = index
+        offset = blockStart
+    return 0
+
+
+def uncompressedSize(path):
+    '''
+    Returns the size of the data stored in a gzip file, read from the extra field of its header (see writeGzip).
+    The logs compressed by an older worker only have the size modulo 4Go of their trailer: None is returned if
+    such a file is large enough to hold more than 4Go of data (deflate does not compress more than
+    MAX_DEFLATE_RATIO to 1).
+    '''
+    with open(path, "rb") as gzFile:
+        header = gzFile.read(12)
+        if len(header) == 12 and ord(header[3]) & FEXTRA:
+            extra = gzFile.read(struct.unpack("<H", header[10:12])[0])
+            while len(extra) >= 4:
+                length = struct.unpack("<H", extra[2:4])[0]
+                if extra[:2] == SIZE_SUBFIELD and length == 8:
+                    return struct.unpack("<Q", extra[4:12])[0]
+                extra = extra[4 + length:]
+        if os.path.getsize(path) * MAX_DEFLATE_RATIO >= 1 << 32:
+            return None
+        gzFile.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", gzFile.read(4))[0]
+
+
+def tailLines(fileObj, lines):
+    '''
+    Returns the last "lines" lines of a file that can only be read forward (i.e. a compressed log).
+    Only these lines are kept in memory while the file is read.
+    '''
+    if lines <= 0:
+        return ""
+    result = deque(maxlen=lines)
+    remainder = ""
+    while True:
+        block = fileObj.read(BLOCK_SIZE)
+        if not block:
+            break
+        block = remainder + block
+        end = block.rfind("\n") + 1
+        remainder = block[end:]
+        if end:
+            result.extend(line + "\n" for line in block[:end - 1].split("\n")[-lines:])
+    if remainder:
+        result.append(remainder)
+    return "".join(result)
+
+
+class LogCompressor(Thread):
+    '''
+    Background thread compressing the logs of the finished commands, so that the main loop of the worker is
+    never blocked by the compression of a large log. Each log is compressed after a delay, to let the command
+    watcher write its last lines and exit. The inode of the log is recorded when it is scheduled, so that the
+    log of a new execution of the command written at the same path in the meantime is never compressed.
+    '''
+
+    def __init__(self, delay=10.0, level=6):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.setName("logCompressor")
+        self.delay = delay
+        self.level = level
+        self.pending = []
+        self.condition = Condition()
+        self.stopFlag = False
+
+    def schedule(self, path):
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            return
+        self.condition.acquire()
+        try:
+            heapq.heappush(self.pending, (time.time() + self.delay, path, inode))
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def cancel(self, path):
+        '''Removes the pending compression of a log, returns True if it was scheduled.'''
+        self.condition.acquire()
+        try:
+            pending = [entry for entry in self.pending if entry[1] != path]
+            if len(pending) == len(self.pending):
+                return False
+            heapq.heapify(pending)
+            self.pending = pending
+            return True
+        finally:
+            self.condition.release()
+
+    def stop(self):
+        self.condition.acquire()
+        try:
+            self.stopFlag = True
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def run(self):
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.stopFlag:
+                    if self.pending:
+                        timeout = self.pending[0][0] - time.time()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self.condition.wait(timeout)
+                if self.stopFlag:
+                    return
+                dueTime, path, inode = heapq.heappop(self.pending)
+            finally:
+                self.condition.release()
+
+            try:
+                startTime = time.time()
+                rawSize = os.path.getsize(path) if os.path.isfile(path) else 0
+                compressedSize = compressLog(path, self.level, inode)
+                if compressedSize is not None:
+                    LOGGER.info("Compressed %s: %d -> %d bytes in %.2fs" % (path, rawSize, compressedSize, time.time() - startTime))
+            except Exception, e:
+                LOGGER.error("Impossible to compress log %s (%r)" % (path, e))
@@ -35,6 +35,15 @@ LOG_SIZE = 2097152
 LOG_BACKUPS = 2
 
 
+#
+# COMMAND LOGS
+#
+COMPRESS_COMMAND_LOGS = True                       # gzip the log of a command once it is finished
+COMPRESS_COMMAND_LOGS_DELAY = 10                   # wait 10s after the end of a command before compressing its log
+COMMAND_LOG_BACKUPS = 2                            # nb of logs kept for the previous executions of a command
+LOG_CHUNK_SIZE = 262144                            # size in bytes of the chunks sent when serving a log (256Ko)
+
+
 #
 # HACK
 #
@@ -21,7 +21,7 @@ from octopus.core.enums.command import CMD_RUNNING
 #
 class Command(object):
 
-    def __init__(self, id, runner, arguments={}, validationExpression="VAL_TRUE", taskName="", relativePathToLogDir="", message="", environment={}):
+    def __init__(self, id, runner, arguments={}, validationExpression="VAL_TRUE", taskName="", relativePathToLogDir="", message="", environment={}, assignment=None):
         '''
         :param id: command id
         :param arguments: command arguments as a dict
@@ -30,6 +30,7 @@ class Command(object):
         :param relativePathToLogDir: relative path to log
         :param message:
         :param environment: A dict of env vars which will be added to current os.environ
+        :param assignment: id of the assignment of the command by the dispatcher, None for an old dispatcher
         '''
         self.status = CMD_RUNNING
         self.id = id
@@ -44,3 +45,4 @@ class Command(object):
         self.message = message
         self.environment = os.environ.copy()
         self.environment.update(environment)
+        self.assignment = assignment
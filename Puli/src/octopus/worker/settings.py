@@ -68,3 +68,10 @@ RUN_AS = ""
 LOGDIR = "/var/log/puli"
 
 LIMIT_OPEN_FILES = 32768
+
+#
+# Local channel (unix socket) used by the command watchers to send their updates to the worker.
+# The "port" key is replaced by the worker port. An empty value disables the channel: updates are then
+# sent via the worker webservice only.
+#
+CHANNEL_SOCKET = "/var/run/puli/worker%(port)d.sock"
@@ -22,6 +22,8 @@ except ImportError:
 
 from octopus.core.framework.mainloopapplication import MainLoopApplication
 from octopus.core.communication.requestmanager import RequestManager
+from octopus.core.communication.channel import ChannelServer
+from octopus.core.timers import TimerQueue
 from octopus.core.enums import command as COMMAND
 from octopus.core.enums import rendernode
 from octopus.core.enums.rendernode import *
@@ -30,6 +32,7 @@ from octopus.worker import settings
 from octopus.worker import config
 
 from octopus.worker.model.command import Command
+from octopus.worker.commandlog import LogCompressor, rotateLog
 from octopus.worker.process import spawnCommandWatcher
 
 LOGGER = logging.getLogger("worker")
@@ -62,8 +65,10 @@ class Worker(MainLoopApplication):
             self.startTime = None
             self.processObj = None
             self.timeOut = None
+            self.timeOutTimer = None
             self.commandId = None
             self.command = None
+            self.logFile = None
             self.modified = True
             self.finished = False
 
@@ -111,8 +116,7 @@ class Worker(MainLoopApplication):
                                                       settings.PORT)
 
         self.createDate = time.time()
-        self.lastSysInfosMessageTime = 0
-        self.lastFullSysInfoUpdate = 0
+        self.timers = TimerQueue()
         self.registerDate = 0
 
         self.httpconn = httplib.HTTPConnection(settings.DISPATCHER_ADDRESS, settings.DISPATCHER_PORT)
@@ -137,13 +141,75 @@ class Worker(MainLoopApplication):
         self.distrib = ""
         self.mikdistrib = ""
         self.openglversion = ""
+        self.channel = None
+        self.logCompressor = None
 
     def prepare(self):
         LOGGER.info("Before registering: prepare worker.")
         for name in (name for name in dir(settings) if name.isupper()):
             LOGGER.info("settings.%s = %r", name, getattr(settings, name))
+        self.startChannel()
+        self.logCompressor = LogCompressor(delay=getattr(config, 'COMPRESS_COMMAND_LOGS_DELAY', 10))
+        self.logCompressor.start()
         self.registerWorker()
 
+        # Every WORKER_MAX_SYSINFO_DELAY a request is sent to ensure a complete set of data is present on the server
+        # - WORKER_MAX_SYSINFO_DELAY should be higher that WORKER_SYSINFO_DELAY
+        # - WORKER_MAX_SYSINFO_DELAY could be several minutes to avoid flooding the network
+        self.timers.schedulePeriodic(lambda: config.WORKER_MAX_SYSINFO_DELAY, self.updateSysInfos, 0, first=0)
+        # Every WORKER_SYSINFO_DELAY, sends a minimal set of data to the server
+        self.timers.schedulePeriodic(lambda: config.WORKER_SYSINFO_DELAY, self.sendSysInfosMessage, first=0)
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+        if self.logCompressor is not None:
+            self.logCompressor.stop()
+
+    def startChannel(self):
+        '''
+        Opens the local unix socket used by the command watchers to stream their updates (completion, message,
+        stats, status and license release). If the socket can not be created, command watchers will only use
+        the worker's webservice.
+        '''
+        if not settings.CHANNEL_SOCKET:
+            return
+        path = settings.CHANNEL_SOCKET % {"port": self.port}
+        try:
+            channel = ChannelServer(path, self.onChannelMessage)
+            channel.bind()
+        except Exception, e:
+            LOGGER.warning("Impossible to open command watchers channel on %s, using http only (%r)" % (path, e))
+            return
+        channel.start()
+        self.channel = channel
+        LOGGER.info("Command watchers channel listening on %s" % path)
+
+    def onChannelMessage(self, message):
+        '''
+        Called from the channel thread for each message received from a command watcher.
+        Like the webservice handlers, it only queues an order that will be executed in the main loop.
+        '''
+        kind = message.get("type")
+        if kind == "update":
+            if not any(key in message for key in ("status", "completion", "message", "stats")):
+                return
+            self.framework.addOrder(self.updateCommandApply,
+                                    commandId=int(message["id"]),
+                                    status=message.get("status", None),
+                                    completion=message.get("completion", None),
+                                    message=message.get("message", None),
+                                    stats=message.get("stats", None))
+        elif kind == "validation":
+            self.framework.addOrder(self.updateCommandValidationApply,
+                                    commandId=int(message["id"]),
+                                    validatorMessage=message.get("validatorMessage", None),
+                                    errorInfos=message.get("errorInfos", None))
+        elif kind == "license":
+            self.framework.addOrder(self.releaseLicenseApply, licenseName=message["licenseName"])
+        else:
+            LOGGER.warning("Unknown message received on channel: %r" % message)
+
     def getNbCores(self):
         import multiprocessing
         return multiprocessing.cpu_count()
@@ -210,6 +276,16 @@ class Worker(MainLoopApplication):
 
         return swapUsage
 
+    def getLoadAverage(self):
+        """
+        | Load average of the system over the last minute, None if it is not available on the system (windows).
+        :return: A float indicating the number of processes running or waiting for the cpu
+        """
+        try:
+            return os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return None
+
 
     def getCpuInfo(self):
         if os.path.isfile('/proc/cpuinfo'):
@@ -501,11 +577,9 @@ class Worker(MainLoopApplication):
         | - check kill file and set new status (paused, toberestartted...)
         | - update every modified command watcher for this RN
         | - remove finished commandWatchers for this RN
-        | - clean "dead" commandWatchers ("dead" means a timeout val is set on the command and RUNNING time is more thant timeout val)
-        | - check ping delay and resync with server if enough time elapsed
+        | - run the timers whose deadline is reached: commands timeout ("dead" commandWatchers i.e. a timeout val is set on
+        |   the command and RUNNING time is more than timeout val) and periodic sysinfos updates to the server
         """
-        # try:
-        now = time.time()
 
         #
         # check if the killfile is present
@@ -600,40 +674,14 @@ class Worker(MainLoopApplication):
             self.removeCommandWatcher(commandWatcher)
 
         #
-        # Kill watchers that timeout and remove dead command watchers
-        # that are not flagged as modified.
+        # Kill watchers that timeout, send sysinfos to the server
         #
-        for commandWatcher in self.commandWatchers.values():
-            # add the test on running state because a non running command can not timeout (Olivier Derpierre 17/11/10)
-            if commandWatcher.timeOut and commandWatcher.command.status == COMMAND.CMD_RUNNING:
-                responding = (now - commandWatcher.startTime) <= commandWatcher.timeOut
-                if not responding:
-                    # time out has been reached
-                    LOGGER.warning("Timeout on command %d", commandWatcher.commandId)
-                    commandWatcher.processObj.kill()
-                    commandWatcher.finished = True
-                    self.updateCompletionAndStatus(commandWatcher.commandId, None, COMMAND.CMD_CANCELED, None)
-
-        # time resync
-        now = time.time()
-
-        if (now - self.lastFullSysInfoUpdate) > config.WORKER_MAX_SYSINFO_DELAY:
-            # Every WORKER_MAX_SYSINFO_DELAY a request is sent to ensure a complete set of data is present on the server
-            # - WORKER_MAX_SYSINFO_DELAY should be higher that WORKER_SYSINFO_DELAY
-            # - WORKER_MAX_SYSINFO_DELAY could be several minutes to avoid flooding the network
-            self.updateSysInfos(0)
-            self.lastFullSysInfoUpdate = now
-
-        if (now - self.lastSysInfosMessageTime) > config.WORKER_SYSINFO_DELAY:
-            # Every WORKER_SYSINFO_DELAY, sends a minimal set of data to the server
-            self.sendSysInfosMessage()
-            self.lastSysInfosMessageTime = now
-
+        self.timers.run()
 
         self.httpconn.close()
 
-        # let's be CPU friendly
-        time.sleep(0.05)
+        # let's be CPU friendly, but wake up on time for the next deadline
+        time.sleep(min(0.05, self.timers.timeUntilNext(default=0.05)))
         # except:
         #     LOGGER.error("A problem occured : " + repr(sys.exc_info()))
 
@@ -659,6 +707,7 @@ class Worker(MainLoopApplication):
         infos['status'] = self.status
         infos['systemFreeRam'] = self.getFreeMem()
         infos['systemSwapPercentage'] = self.getSwapUsage()
+        infos['systemLoad'] = self.getLoadAverage()
 
         dct = json.dumps(infos)
         headers = {}
@@ -688,6 +737,13 @@ class Worker(MainLoopApplication):
 
         del self.commandWatchers[commandWatcher.commandId]
         del self.commands[commandWatcher.commandId]
+        if commandWatcher.timeOutTimer is not None:
+            commandWatcher.timeOutTimer.cancel()
+
+        # The log will not grow anymore, it is compressed in the background
+        if commandWatcher.logFile is not None and self.logCompressor is not None \
+                and getattr(config, 'COMPRESS_COMMAND_LOGS', False):
+            self.logCompressor.schedule(commandWatcher.logFile)
         try:
             os.remove(commandWatcher.processObj.pidfile)
             if self.status is not rendernode.RN_PAUSED:
@@ -701,6 +757,25 @@ class Worker(MainLoopApplication):
             if err != ENOENT:
                 raise
 
+    def onCommandTimeOut(self, commandId):
+        '''
+        Called by the timers when the time out of a command is reached, the command watcher is killed if the command
+        is still running.
+        '''
+        try:
+            commandWatcher = self.commandWatchers[commandId]
+        except KeyError:
+            return
+        # a non running command can not timeout (Olivier Derpierre 17/11/10)
+        if commandWatcher.command.status == COMMAND.CMD_RUNNING:
+            LOGGER.warning("Timeout on command %d", commandId)
+            commandWatcher.processObj.kill()
+            commandWatcher.finished = True
+            self.updateCompletionAndStatus(commandId, None, COMMAND.CMD_CANCELED, None)
+        elif not COMMAND.isFinalStatus(commandWatcher.command.status):
+            # not started yet, check again later
+            commandWatcher.timeOutTimer = self.timers.schedule(1.0, self.onCommandTimeOut, commandId)
+
     def updateCompletionAndStatus(self, commandId, completion, status, message, stats=None):
         try:
             commandWatcher = self.commandWatchers[commandId]
@@ -724,10 +799,10 @@ class Worker(MainLoopApplication):
             # The stats value is None when no update need to be updated on the server.
             commandWatcher.command.stats = stats
 
-    def addCommandApply(self, ticket, commandId, runner, arguments, validationExpression, taskName, relativePathToLogDir, environment):
+    def addCommandApply(self, ticket, commandId, runner, arguments, validationExpression, taskName, relativePathToLogDir, environment, assignment=None):
         if not self.isPaused:
             try:
-                newCommand = Command(commandId, runner, arguments, validationExpression, taskName, relativePathToLogDir, environment=environment)
+                newCommand = Command(commandId, runner, arguments, validationExpression, taskName, relativePathToLogDir, environment=environment, assignment=assignment)
                 self.commands[commandId] = newCommand
                 self.addCommandWatcher(newCommand)
                 LOGGER.info("Added command %d {runner: %s, arguments: %s}", commandId, runner, repr(arguments))
@@ -745,12 +820,16 @@ class Worker(MainLoopApplication):
     # @todo find a clean way to stop the processes so that they \
     #       can call their after-execution scripts
     #
-    def stopCommandApply(self, ticket, commandId):
+    def stopCommandApply(self, ticket, commandId, assignment=None):
         try:
             commandWatcher = self.commandWatchers[commandId]
         except KeyError:
             LOGGER.warning("attempt to update completion and status of unregistered  command %d", commandId)
         else:
+            # a kill sent for a previous execution of the command must not stop the new one
+            if assignment is not None and commandWatcher.command.assignment not in (None, assignment):
+                LOGGER.warning("Ignored kill of command %d: sent for assignment %d, running assignment %d", commandId, assignment, commandWatcher.command.assignment)
+                return
             commandWatcher.processObj.kill()
             self.updateCompletionAndStatus(commandId, 0, COMMAND.CMD_CANCELED, "killed")
             LOGGER.info("Stopped command %r", commandId)
@@ -759,6 +838,21 @@ class Worker(MainLoopApplication):
         self.updateCompletionAndStatus(commandId, completion, status, message, stats)
         # LOGGER.info("Updated command id=%r status=%r completion=%r message=%r stats=%r" % (commandId, status, completion, message, stats))
 
+    def releaseLicenseApply(self, ticket, licenseName):
+        '''
+        | Releases a license token for this RN on the dispatcher, on behalf of a command watcher.
+        | req: DELETE /licenses/<licenseName>
+        '''
+        body = json.dumps({"rns": self.computerName})
+        headers = {'content-length': len(body)}
+        try:
+            self.requestManager.delete("/licenses/%s" % licenseName, body, headers)
+            LOGGER.info("Released license %s" % licenseName)
+        except RequestManager.RequestError, e:
+            LOGGER.error("Impossible to release license %s (%r)" % (licenseName, e))
+            ticket.status = ticket.ERROR
+            ticket.message = str(e)
+
     def updateCommandValidationApply(self, ticket, commandId, validatorMessage, errorInfos):
         try:
             commandWatcher = self.commandWatchers[commandId]
@@ -797,6 +891,17 @@ class Worker(MainLoopApplication):
                 err = e.args[0]
                 if err != errno.EEXIST:
                     raise
+
+        # keep the logs of the previous executions of this command on the worker, the previous log not compressed
+        # yet is compressed under its rotated name
+        backups = getattr(config, 'COMMAND_LOG_BACKUPS', 0)
+        compressPrevious = self.logCompressor is not None and self.logCompressor.cancel(outputFile)
+        try:
+            rotateLog(outputFile, backups)
+        except OSError, e:
+            LOGGER.warning("Impossible to rotate log %s (%r)" % (outputFile, e))
+        if compressPrevious and backups > 0:
+            self.logCompressor.schedule("%s.1" % outputFile)
         logFile = file(outputFile, "w")
 
         d = os.path.dirname(pidFile)
@@ -814,6 +919,8 @@ class Worker(MainLoopApplication):
         command.environment["PULI_TASK_NAME"] = command.taskName
         command.environment["PULI_TASK_ID"] = command.relativePathToLogDir
         command.environment["PULI_LOG"] = outputFile
+        if self.channel is not None:
+            command.environment["PULI_WORKER_CHANNEL"] = self.channel.path
 
         args = [
             pythonExecutable,
@@ -844,14 +951,19 @@ class Worker(MainLoopApplication):
             # Starts a new process (via CommandWatcher script) with current command info and environment.
             # The command environment is derived from the current os.env
             watcherProcess = spawnCommandWatcher(pidFile, logFile, args, command.environment)
+            # the command watcher has its own descriptor on the log
+            logFile.close()
             newCommandWatcher.processObj = watcherProcess
             newCommandWatcher.startTime = time.time()
             newCommandWatcher.timeOut = None
             newCommandWatcher.command = command
+            newCommandWatcher.logFile = outputFile
             newCommandWatcher.processId = watcherProcess.pid
 
             self.commandWatchers[command.id] = newCommandWatcher
             self.status = rendernode.RN_WORKING
+            if newCommandWatcher.timeOut:
+                newCommandWatcher.timeOutTimer = self.timers.schedule(newCommandWatcher.timeOut, self.onCommandTimeOut, command.id)
 
             LOGGER.info("Started command %d", command.id)
         except Exception, e:
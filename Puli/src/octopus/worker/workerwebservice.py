@@ -1,5 +1,5 @@
 import os
-import os
+import gzip
 from Queue import Queue
 try:
     import simplejson as json
@@ -10,10 +10,12 @@ import subprocess
 
 from octopus.core.communication.http import Http400, Http404
 from octopus.worker import settings
+from octopus.worker import config
+from octopus.worker.commandlog import findLog, parseRange, tailOffset, tailLines, uncompressedSize
 
 from octopus.worker.worker import WorkerInternalException
 
-from tornado.web import Application, RequestHandler
+from tornado.web import Application, RequestHandler, asynchronous
 
 # /commands/ [GET] { commands: [ { id, status, completion } ] }
 # /commands/ [POST] { id, jobtype, arguments }
@@ -32,7 +34,7 @@ class WorkerWebService(Application):
     /commands
     /commands/<id command>
     /log
-    /log/command/<path>
+    /log/command/<path>  (both accept a "Range" header or a "tail=N" argument)
     /updatesysinfos
     /pause
     /ramInUse
@@ -156,7 +158,8 @@ class CommandsResource(BaseResource):
                     dct['validationExpression'],
                     dct['taskName'],
                     dct['relativePathToLogDir'],
-                    dct['environment']
+                    dct['environment'],
+                    dct.get('assignment')
                 )
         except WorkerInternalException, e:
             LOGGER.error("Impossible to add command %r, the RN status is 'paused' (%r)" % (dct['commandId'],e) )
@@ -240,8 +243,9 @@ class CommandResource(BaseResource):
         """
         | Called when cancelling a running command.
         | The process is interrupted and final status is set to CANCEL (with a default completion and message to display)
+        | The kill is ignored if it is sent for another assignment of the command than the running one.
         |
-        | URL: DELETE http://host:port/commands/<id>
+        | URL: DELETE http://host:port/commands/<id>[?assignment=<assignment id>]
 
         """
 
@@ -249,6 +253,9 @@ class CommandResource(BaseResource):
         dct = {
                 'commandId': int(id)
             }
+        assignment = self.get_argument('assignment', None)
+        if assignment is not None:
+            dct['assignment'] = int(assignment)
 
         self.framework.addOrder(self.framework.application.stopCommandApply, **dct)
         self.set_status(202)
@@ -261,30 +268,125 @@ class DebugResource(BaseResource):
         self.write(content)
 
 
-class WorkerLogResource(RequestHandler):
+class LogResource(RequestHandler):
+    '''
+    | Base class for the resources serving a log file. The log is streamed by chunks and never loaded entirely
+    | in memory. Two options allow to only retrieve a part of the log:
+    | - a "Range: bytes=<start>-<end>" header: only the requested bytes are sent (206 Partial Content)
+    | - a "tail=N" argument: only the last N lines are sent, the file is read from its end
+    |
+    | The log of a finished command is stored compressed: it is sent as is to clients accepting the gzip
+    | encoding, and decompressed on the fly otherwise.
+    '''
+    logFile = None
+    remaining = 0
+
+    def sendLog(self, path):
+        logPath, compressed = findLog(path)
+        if logPath is None:
+            raise Http404('no log file')
+
+        tail = self.get_argument('tail', None)
+        if tail is not None:
+            try:
+                tail = int(tail)
+            except ValueError:
+                raise Http400("Invalid tail value: %r" % tail)
+        rangeHeader = self.request.headers.get('Range', None)
+
+        self.set_header('Content-Type', 'text/plain')
+        self.set_header('Accept-Ranges', 'bytes')
+
+        if compressed:
+            if tail is None and rangeHeader is None and 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+                self.set_header('Content-Encoding', 'gzip')
+                self.startStreaming(open(logPath, 'rb'), os.path.getsize(logPath))
+                return
+            logFile = gzip.open(logPath, 'rb')
+            if tail is not None:
+                try:
+                    content = tailLines(logFile, tail)
+                finally:
+                    logFile.close()
+                self.finish(content)
+                return
+            size = uncompressedSize(logPath)
+            if size is None:
+                # the size of a large log compressed by an older worker is unknown, it is streamed without ranges
+                self.startStreaming(logFile, None)
+                return
+        else:
+            logFile = open(logPath, 'rb')
+            # a running command may still be writing, only the current content is sent
+            size = os.fstat(logFile.fileno()).st_size
+            if tail is not None:
+                start = tailOffset(logFile, tail, size)
+                logFile.seek(start)
+                self.startStreaming(logFile, size - start)
+                return
+
+        start, end = 0, size
+        if rangeHeader is not None:
+            try:
+                byteRange = parseRange(rangeHeader, size)
+            except ValueError:
+                logFile.close()
+                self.set_status(416)
+                self.set_header('Content-Range', 'bytes */%d' % size)
+                self.finish()
+                return
+            if byteRange is not None:
+                start, end = byteRange
+                logFile.seek(start)
+                self.set_status(206)
+                self.set_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size))
+        self.startStreaming(logFile, end - start)
+
+    def startStreaming(self, logFile, length):
+        '''Streams length bytes of the log, the whole log (chunked encoding) if the length is None.'''
+        self.logFile = logFile
+        self.remaining = length
+        if length is not None:
+            self.set_header('Content-Length', length)
+        self.sendChunk()
+
+    def sendChunk(self):
+        '''Sends the next chunk of the log once the previous one has been written on the socket.'''
+        data = ""
+        chunkSize = getattr(config, 'LOG_CHUNK_SIZE', 262144)
+        if self.remaining is None:
+            data = self.logFile.read(chunkSize)
+        elif self.remaining > 0:
+            data = self.logFile.read(min(chunkSize, self.remaining))
+        if not data:
+            self.closeLog()
+            self.finish()
+            return
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        self.write(data)
+        self.flush(callback=self.sendChunk)
+
+    def closeLog(self):
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+    def on_connection_close(self):
+        self.closeLog()
+
+
+class WorkerLogResource(LogResource):
+    @asynchronous
     def get(self):
-
         logFileName = "worker%d.log" % settings.PORT
-        logFilePath = os.path.join(settings.LOGDIR, logFileName)
-        if os.path.isfile(logFilePath):
-            logFile = open(logFilePath, 'r')
-            logFileContent = logFile.read()
-            logFile.close()
-            self.set_header('Content-Type', 'text/plain')
-            self.write(logFileContent)
-        return Http404('no log file')
+        self.sendLog(os.path.join(settings.LOGDIR, logFileName))
 
 
-class CommandLogResource(RequestHandler):
+class CommandLogResource(LogResource):
+    @asynchronous
     def get(self, path):
-        logFilePath = os.path.join(settings.LOGDIR, path)
-        if os.path.isfile(logFilePath):
-            logFile = open(logFilePath, 'r')
-            logFileContent = logFile.read()
-            logFile.close()
-            self.set_header('Content-Type', 'text/plain')
-            self.write(logFileContent)
-        return Http404('no log file')
+        self.sendLog(os.path.join(settings.LOGDIR, path))
 
 
 class UpdateSysResource(BaseResource):
@@ -15,6 +15,11 @@ import os
 import subprocess
 import time
 import copy
+import multiprocessing
+import gzip
+from cStringIO import StringIO
+from collections import deque
+from itertools import izip
 
 from datetime import datetime, timedelta, date
 
@@ -27,6 +32,7 @@ except ImportError:
 from puliclient import jobs
 
 from octopus.core.enums.command import *
+from octopus.core import commandrange
 
 __all__ = ['jobs', 'Error', 'GraphSubmissionError', 'TaskAlreadyDecomposedError', 'Task', 'Graph', 'TaskGroup', 'Command']
 
@@ -598,13 +604,14 @@ class Graph(object):
         return True
 
 
-    def _toRepresentation(self):
+    def _toRepresentation(self, compact=False):
         """
         Creates a JSON representation of the graph using the GraphDumper Utility class.
         
+        :param compact: use the compact form for tasks decomposed by the default decomposer (see GraphDumper)
         :rtype: string
         """
-        return GraphDumper().dumpGraph(self)
+        return GraphDumper(compact).dumpGraph(self)
 
 
     def __repr__(self):
@@ -617,12 +624,15 @@ class Graph(object):
 
 
 
-    def prepareGraphRepresentation(self):
+    def prepareGraphRepresentation(self, compact=False):
         """
         | Prepare a graph representation to be sent to the server or executed locally.
         | Several steps must be taken:
         | - parse graph to resolve dependencies on taskgroups
         | - parse graph to expand/decompose tasks and taskgroups
+
+        :param compact: use the compact form for tasks decomposed by the default decomposer, only understood by the
+                        server (see GraphDumper)
         """
 
         print("---------------------")
@@ -638,7 +648,7 @@ class Graph(object):
             self.root = self.root.decompose()
 
         # Create JSON representation
-        repr = self._toRepresentation()
+        repr = self._toRepresentation(compact)
 
         # Precompile dependencies on a taskgroup
         print " - Checking dependencies on taskgroups..."
@@ -657,32 +667,53 @@ class Graph(object):
 
 
 
-    def submit(self, host="puliserver", port=8004):
+    def submit(self, host="puliserver", port=8004, wait=True, pollInterval=1.0, compact=False):
         """
         | Prepare a graph representation and send it to the server.
         | - prepare graph
         | - use GraphDumper class to serialize the graph to a JSON representation
         | - submit data via http  
+        |   with compact=True, the commands of the tasks decomposed by the default decomposer are replaced by their
+        |   frame range and the data is compressed with gzip, the server expands the commands
+        | - the server registers the graph in the background and answers with a ticket, the ticket is polled
+        |   until the graph is registered (unless wait is False)
 
         :param host: server name to connect to
         :type host: string
         :param port: server port to connect to
         :type port: int
+        :param wait: if False, return as soon as the graph is queued by the server
+        :type wait: bool
+        :param pollInterval: delay in seconds between two requests on the submission ticket
+        :type pollInterval: float
+        :param compact: send a compact and compressed representation of the graph
+        :type compact: bool
         :return: the server response ie. ('SERVER_URL/nodes/Id', 'Graph created.\nCreated nodes: ...')
+                 or ('SERVER_URL/graphs/tickets/Id', ticket) if wait is False
         :rtype: tuple
         :raise: GraphSubmissionError
         """
 
-        repr = self.prepareGraphRepresentation()
+        repr = self.prepareGraphRepresentation(compact)
 
         print ""
         print("---------------------")
         print "Sending graph: %s:%r" % (host, port)
         print("---------------------")
         jsonRepr = json.dumps(repr)
+        headers = {}
+        if compact:
+            buf = StringIO()
+            gzipFile = gzip.GzipFile(fileobj=buf, mode="wb")
+            gzipFile.write(jsonRepr)
+            gzipFile.close()
+            print "Compressed graph: %d -> %d bytes" % (len(jsonRepr), buf.tell())
+            jsonRepr = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = len(jsonRepr)
 
         conn = httplib.HTTPConnection(host, port)
-        conn.request('POST', '/graphs/', jsonRepr, {'Content-Length': len(jsonRepr)})
+        conn.request('POST', '/graphs/', jsonRepr, headers)
         response = conn.getresponse()
 
         # print "---"
@@ -692,147 +723,259 @@ class Graph(object):
 
         if response.status in (200, 201):
             return response.getheader('Location'), response.read()
-        else:
+        elif response.status != 202:
             raise GraphSubmissionError((response.status, response.reason))
 
+        ticketURL = response.getheader('Location')
+        ticket = json.loads(response.read())['ticket']
+        if not wait:
+            return ticketURL, ticket
+
+        ticketPath = '/graphs/tickets/%s' % ticket['id']
+        while ticket['status'] == 'OPENED':
+            time.sleep(pollInterval)
+            conn = httplib.HTTPConnection(host, port)
+            conn.request('GET', ticketPath)
+            response = conn.getresponse()
+            if response.status != 200:
+                raise GraphSubmissionError((response.status, response.reason))
+            ticket = json.loads(response.read())['ticket']
+
+        if ticket['status'] != 'CLOSED':
+            raise GraphSubmissionError((ticket['status'], ticket['message']))
+        return ticket['resultURL'], ticket['message']
+
 
-    def execute(self):
+    def execute(self, slots=1, cores=None):
         """
-        | Prepare a graph representation to execute locally:
+        | Prepare a graph representation and execute it locally, like a render node would do:
         |   1. Prepare the graph representation with GraphDumper
-        |   2. Parse the representation to extract all commands in a single list in "id" order
-        |      Several attribute of the task are stored with each command (taksid, end, dependencies...)
-        |   3. While there are some "ready" command
-        |      3.1 Parse ready commands
-        |            Execute command
-        |      3.2 Parse blocked commands
-        |            Check dependencies and increment "nbReadyAfterCheck" counter
-        |      3.3 If nbReadyAfterCheck == 0 
-        |            BREAK the while loop
-        |   4. Write summary and return
-
+        |   2. Index the representation: commands of each task or taskgroup and commands depending on each node
+        |      Several attribute of the task are stored with each command (taskid, runner, dependencies...)
+        |      Like on the dispatcher, the dependencies of a task include the ones of its taskgroups
+        |   3. Start the commands whose dependencies are resolved, as long as a slot and enough cores are free
+        |      With several slots, the commands are executed concurrently in a pool of processes
+        |   4. Each time a command ends, print its result and unblock the commands depending on its task
+        |      (or taskgroup) once every command of this task is finished with one of the expected status
+        |   5. Write summary and return
+        |
+        | Commands with a dependency that can not be resolved anymore (e.g. a task in error when DONE is expected)
+        | are never started and reported as blocked.
+
+        :param slots: maximum number of commands executed at the same time
+        :type slots: int
+        :param cores: number of cores available for the execution, each command uses the "minNbCores" of its
+                      task. Default is the number of cores of the current host.
+        :type cores: int
         :return: the final state of the graph
         :rtype: int
         :raise: GraphExecError
-        
         """
 
         # Prepare graph
         repr = self.prepareGraphRepresentation()
-
-        # Parse graph to create exec order list
+        nodes = repr["tasks"]
+        if cores is None:
+            cores = multiprocessing.cpu_count()
+        slots = max(1, slots)
+
+        # Parent of each node, to add the dependencies of the taskgroups to the ones of their tasks (the ones already
+        # reported on the tasks by prepareGraphRepresentation are only counted once)
+        parents = {}
+        for nodeId, node in enumerate(nodes):
+            for childId in node.get("tasks", []):
+                parents[childId] = nodeId
+
+        def dependenciesOf(nodeId):
+            dependencies = []
+            while nodeId is not None:
+                for (targetId, statusList) in nodes[nodeId]["dependencies"]:
+                    if (targetId, statusList) not in dependencies:
+                        dependencies.append((targetId, statusList))
+                nodeId = parents.get(nodeId)
+            return dependencies
+
+        # Index commands by task, and by taskgroup for the taskgroups with dependents
         executionList = []
+        nodeCommands = {}
+        commandId = 1
+        for taskId, node in enumerate(nodes):
+            if node["type"] != "Task":
+                continue
+            nodeCommands[taskId] = []
+            taskDependencies = dependenciesOf(taskId)
+            for command in node["commands"]:
+                command["execid"] = commandId
+                command["taskid"] = taskId
+                command["runner"] = node["runner"]
+                command["validationExpression"] = node["validationExpression"]
+                command["tags"] = node["tags"]
+                command["environment"] = node["environment"]
+                command["dependencies"] = taskDependencies
+                command["cores"] = min(max(1, node["minNbCores"]), cores)
+                command["status"] = BLOCKED
+                executionList.append(command)
+                nodeCommands[taskId].append(command)
+                commandId += 1
+
+        def commandsOf(nodeId):
+            if nodeId not in nodeCommands:
+                nodeCommands[nodeId] = []
+                for childId in nodes[nodeId].get("tasks", []):
+                    nodeCommands[nodeId].extend(commandsOf(childId))
+            return nodeCommands[nodeId]
+
+        # Adjacency index: for each node that is a dependency, the commands waiting for it and the number of
+        # its commands not finished yet
+        dependents = {}
+        unfinished = {}
+        targetsOfCommand = {}
+        for command in executionList:
+            command["blockers"] = len(command["dependencies"])
+            for (targetId, statusList) in command["dependencies"]:
+                dependents.setdefault(targetId, []).append((command, statusList))
+                if targetId not in unfinished:
+                    unfinished[targetId] = len(commandsOf(targetId))
+                    for targetCommand in commandsOf(targetId):
+                        targetsOfCommand.setdefault(targetCommand["execid"], []).append(targetId)
+
+        readyCommands = deque()
+
+        def resolve(targetId):
+            status = self._aggregateStatus(commandsOf(targetId))
+            for (command, statusList) in dependents.get(targetId, []):
+                if status not in statusList:
+                    # the command will never be started
+                    continue
+                command["blockers"] -= 1
+                if command["blockers"] == 0:
+                    command["status"] = READY
+                    readyCommands.append(command)
+
+        for command in executionList:
+            if command["blockers"] == 0:
+                command["status"] = READY
+                readyCommands.append(command)
+        for targetId, count in unfinished.items():
+            if count == 0:
+                resolve(targetId)
 
-        taskId=1
-        commandId=1
-        for node in repr["tasks"]:
-
-            if node["type"] == "TaskGroup":
-                # Parse children
-                # print "TG - %s" % node["name"]
-                pass
-
-            elif node["type"] == "Task":
-                # print "T - %s" % node["name"]
-
-                # Parse commands
-                for command in node["commands"]:
-                    # print "  C - %r" % command["description"]
-                    command["execid"] = commandId
-                    command["taskid"] = taskId
-                    command["runner"] = node["runner"]
-                    command["validationExpression"] = node["validationExpression"]
-                    command["tags"] = node["tags"]
-                    command["environment"] = node["environment"]
-
-                    command["status"] = BLOCKED
-                    
-                    if "dependencies" in node.keys() and 0<len(node["dependencies"]):
-                        command["dependencies"] = node["dependencies"]
-                    else:
-                        command["status"] = READY
-                        command["dependencies"] = None
-
-                    executionList.append( command )
-                    commandId += 1
-
-                taskId += 1
+        print ""
+        print("---------------------")
+        print "Executing %d commands locally (%d slot(s), %d core(s)):" % (len(executionList), slots, cores)
+        print("---------------------")
+        results = {DONE: 0, ERROR: 0, CANCELED: 0}
+        startDate = time.time()
 
+        def commandEnded(command, result, elapsed):
+            # Beware: we consider the command result (cmdStatus) and the corresponding task result (status)
+            if result in (CMD_ERROR, CMD_TIMEOUT):
+                command["status"] = ERROR
+            elif result == CMD_CANCELED:
+                command["status"] = CANCELED
+            elif result == CMD_DONE:
+                command["status"] = DONE
+            else:
+                print "WARNING a command has ended but it final state is invalid: %r" % result
+                command["status"] = ERROR
+            command["cmdStatus"] = result
+            results[command["status"]] += 1
+
+            print "  [%s] %s (task %s) in %s" % (CMD_STATUS_NAME[result] if result in CMD_STATUS else result,
+                                                 command["description"], nodes[command["taskid"]]["name"],
+                                                 timedelta(seconds=int(elapsed)))
+
+            for targetId in targetsOfCommand.get(command["execid"], []):
+                unfinished[targetId] -= 1
+                if unfinished[targetId] == 0:
+                    resolve(targetId)
+
+        pool = multiprocessing.Pool(slots, maxtasksperchild=1) if slots > 1 else None
+        running = {}
+        usedCores = 0
+        try:
+            while readyCommands or running:
+                # Start as many ready commands as possible
+                while readyCommands and len(running) < slots:
+                    command = readyCommands[0]
+                    if running and usedCores + command["cores"] > cores:
+                        break
+                    readyCommands.popleft()
+                    command["status"] = RUNNING
+                    commandStart = time.time()
+
+                    if pool is None:
+                        try:
+                            result = self.execNode(command)
+                        except GraphExecInterrupt:
+                            return CANCELED
+                        commandEnded(command, result, time.time() - commandStart)
+                    else:
+                        asyncResult = pool.apply_async(_execCommandInProcess, (command["execid"], command["runner"], command["validationExpression"], command["arguments"]))
+                        running[command["execid"]] = (command, asyncResult, commandStart)
+                        usedCores += command["cores"]
+
+                # Wait for the end of at least one command
+                finished = [execId for (execId, (command, asyncResult, commandStart)) in running.items() if asyncResult.ready()]
+                if running and not finished:
+                    time.sleep(0.1)
+                for execId in finished:
+                    command, asyncResult, commandStart = running.pop(execId)
+                    usedCores -= command["cores"]
+                    try:
+                        result = asyncResult.get()
+                    except Exception, e:
+                        print "WARNING command %r failed in execution pool: %r" % (command["description"], e)
+                        result = CMD_ERROR
+                    commandEnded(command, result, time.time() - commandStart)
 
+        except KeyboardInterrupt:
+            print("\n")
+            print("Exit event caught: stopping %d running command(s)...\n" % len(running))
+            if pool is not None:
+                pool.terminate()
+                pool = None
+            return CANCELED
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        numBLOCKED = len([command for command in executionList if command["status"] in (BLOCKED, READY)])
+        endDate = time.time()
+        elapsedTime = endDate - startDate
         print ""
         print("---------------------")
-        print "Executing %d commands locally:" % len(executionList)
+        print "FINISHED"
+        print "  Commands result:"
+        print "      DONE........ %d" % results[DONE]
+        print "      ERROR....... %d" % results[ERROR]
+        print "      CANCELED.... %d" % results[CANCELED]
+        print "      BLOCKED..... %d" % numBLOCKED
+        print ""
+        print "  End date:     %16s" % datetime.fromtimestamp(endDate).strftime('%b %d %H:%M:%S')
+        print "  Elapsed time: %16s" % timedelta(seconds=int(elapsedTime))
         print("---------------------")
-        numDONE, numERROR, numCANCELED = 0, 0, 0
-        startDate = time.time()
-        
-        # Loop while there are no ready commands left
-        while True:
-            readyCommands = ( command for command in executionList if command["status"] == READY )
-            for command in readyCommands:
-
-                # Executing node and getting result
-                # Beware: we consider the command result (cmdStatus) and the corresponding task result (status)
-                try:
-                    result = self.execNode( command )
-                except GraphExecInterrupt:
-                    return CANCELED
-
-                if result in (CMD_ERROR, CMD_TIMEOUT):
-                    command["status"] = ERROR
-                    numERROR += 1
-                elif result is CMD_CANCELED:
-                    command["status"] = CANCELED
-                    numCANCELED += 1
-                elif result is CMD_DONE:
-                    command["status"] = DONE
-                    numDONE += 1
-                else:
-                    print "WARNING a command has ended but it final state is invalid: %r" % CMD_STATUS_NAME[self.finalState]
-                    command["status"] = ERROR
-                    numERROR += 1
-
-                command["cmdStatus"] = result
-
-            # Check dependencies
-            nbReadyAfterCheck = 0
-            blockedCommands = ( command for command in executionList if command["status"] == BLOCKED )
-            for command in blockedCommands :
-
-                # print "dep:%r" % command["dependencies"]
-                targetId = command["dependencies"][0][0]
-                statuses = command["dependencies"][0][1]
-
-                for node in executionList:
-                    if node["taskid"]== targetId and node["status"] in statuses:
-                        command["status"] = READY
-                        nbReadyAfterCheck += 1
-
-            if nbReadyAfterCheck == 0:
-                endDate = time.time()
-                elapsedTime = endDate - startDate
-                print ""
-                print("---------------------")
-                print "FINISHED"
-                print "  Commands result:"
-                print "      DONE........ %d" % numDONE
-                print "      ERROR....... %d" % numERROR
-                print "      CANCELED.... %d" % numCANCELED
-                print ""
-                print "  End date:     %16s" % datetime.fromtimestamp(endDate).strftime('%b %d %H:%M:%S')
-                print "  Elapsed time: %16s" % timedelta(seconds=int(elapsedTime))
-                print("---------------------")
-                print ""
-                break
-
-            pass  # END WHILE there are ready commands
-
-        # Define a return status regarding the overall 
+        print ""
+
+        # Define a return status regarding the overall
         # number of errors, cancelation and succes in commands
-        if numCANCELED:
+        if results[CANCELED]:
             return CANCELED
-        if numERROR:
+        if results[ERROR]:
+            return ERROR
+        return DONE
+
+    def _aggregateStatus(self, commands):
+        """
+        Returns the status of a task or taskgroup whose commands are all finished, the same way the server does:
+        error if at least one command is in error, canceled if one is canceled, done otherwise.
+        """
+        statuses = set(command["status"] for command in commands)
+        if ERROR in statuses:
             return ERROR
+        if CANCELED in statuses:
+            return CANCELED
         return DONE
 
 
@@ -912,6 +1055,10 @@ class Graph(object):
             result = CommandWatcher("", "0", commandId, runner, validationExpression, pCommand["arguments"])
             return result.finalState
 
+        except SystemExit:
+            # the command watcher exits when the runner can not be loaded or fails unexpectedly
+            return CMD_ERROR
+
         except KeyboardInterrupt:
             print("\n")
             print("Exit event caught: exiting CommandWatcher...\n")
@@ -959,6 +1106,19 @@ class Graph(object):
     
     
 
+def _execCommandInProcess(commandId, runner, validationExpression, arguments):
+    """
+    Executes a command in a process of the pool used by Graph.execute() and returns its final state.
+    """
+    from octopus.commandwatcher.commandwatcher import CommandWatcher
+    try:
+        return CommandWatcher("", "0", commandId, runner, validationExpression, arguments).finalState
+    except KeyboardInterrupt:
+        return CMD_CANCELED
+    except SystemExit:
+        return CMD_ERROR
+
+
 def _hasCycles(node, visited_nodes):
     visited_nodes = visited_nodes + [node]
     for dep in node.dependencies:
@@ -976,7 +1136,12 @@ class GraphDumper():
     During the process, some validity checks can be done: no cycle, consistency etc
     """
 
-    def __init__(self):
+    def __init__(self, compact=False):
+        """
+        :param compact: if True, a task whose commands are those of the default decomposer is represented with a
+                        "commandRange" instead of its list of commands (see octopus.core.commandrange)
+        """
+        self.compact = compact
         self.clear()
 
     def clear(self):
@@ -1048,7 +1213,12 @@ class GraphDumper():
         if ("plan" not in task.tags) and ("shot" in task.tags):
             task.tags["plan"] = task.tags["shot"]
 
-        return {
+        commands = []
+        commandRange = self.computeCommandRange(task) if self.compact else None
+        if commandRange is None:
+            commands = [self.computeCommandRepresentation(command) for command in task.commands]
+
+        repr = {
             'name': task.name,
             'type': 'Task',
             'runner': task.runner,
@@ -1063,13 +1233,33 @@ class GraphDumper():
             'minNbCores': task.minNbCores,
             'maxNbCores': task.maxNbCores,
             'ramUse': task.ramUse,
-            'commands': [self.computeCommandRepresentation(command) for command in task.commands],
+            'commands': commands,
             'lic': task.lic,
             'licence': task.lic,
             'tags': task.tags,
             'timer': task.timer,
             'maxAttempt': task.maxAttempt,
         }
+        if commandRange is not None:
+            repr['commandRange'] = commandRange
+        return repr
+
+    def computeCommandRange(self, task):
+        """
+        Returns the command range of a task if its commands are exactly the ones the server would create from it,
+        i.e. the task has been decomposed by the default decomposer and its commands have not been modified.
+        """
+        commandRange = commandrange.getCommandRange(task.arguments)
+        if commandRange is None or not task.commands:
+            return None
+        expectedCount = 0
+        for (command, (description, arguments)) in izip(task.commands, commandrange.iterCommands(task.name, task.arguments, commandRange)):
+            if command.description != description or command.arguments != arguments:
+                return None
+            expectedCount += 1
+        if expectedCount != len(task.commands) or expectedCount != commandrange.countCommands(commandRange):
+            return None
+        return commandRange
 
     def computeTaskGroupRepresentation(self, taskGroup):
 
@@ -5,12 +5,12 @@ Created on Nov 23, 2010
 '''
 import subprocess
 import os
-import re
 import sys
 import shutil
 import datetime
 import time
 from puliclient.jobs import CommandRunner, TaskDecomposer
+from puliclient.logscanner import LogScanner
 from puliclient.contrib.helper.helper import PuliActionHelper
 
 
@@ -200,7 +200,7 @@ class MtoaDecomposer(TaskDecomposer):
 class MtoaRunner(CommandRunner):
 
     def execute(self, arguments, updateCompletion, updateMessage):
-        frameCompletionPattern = re.compile("\| (.*)% done .* rays/pixel")
+        frameCompletionPattern = "\| (.*)% done .* rays/pixel"
 
         # init the helper
         helper = PuliActionHelper(cleanTemp=True)
@@ -351,19 +351,15 @@ class MtoaRunner(CommandRunner):
             #kickret = helper.execute(argList, env=env)
             os.umask(2)
             out = subprocess.Popen(argList, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, env=env)
-            rc = None
-            while rc is None:
-                line = out.stdout.readline()
-                if not line:
-                    break
-                print line,
-                sys.stdout.flush()
-                fcp = frameCompletionPattern.search(line)
-                if fcp:
-                    framecomp = float(fcp.group(1).strip())
-                    fc = float(framecomp / 100) / float(totalFrames)
-                    updateCompletion(comp + fc)
-                rc = out.poll()
+
+            def onFrameCompletion(match, comp=comp):
+                framecomp = float(match.group(1).strip())
+                fc = float(framecomp / 100) / float(totalFrames)
+                updateCompletion(comp + fc)
+
+            scanner = LogScanner(interval=1.0)
+            scanner.addPattern("frameCompletion", frameCompletionPattern, onFrameCompletion)
+            scanner.scanStream(out.stdout, echo=sys.stdout)
 
             out.communicate()
             rc = out.poll()
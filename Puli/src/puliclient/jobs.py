@@ -10,6 +10,8 @@ import traceback
 import logging
 import subprocess
 
+from octopus.core.commandrange import iterPackets
+
 class TimeoutError ( Exception ):
     ''' Raised when helper execution is too long. '''
 
@@ -394,47 +396,8 @@ class DefaultTaskDecomposer(TaskDecomposer):
         :param callback: A specific callback given to replace default's "addCommand" if necessary
         :param framesList: A string representing a list of frames
         '''
-        packetSize = int(packetSize)
-        if len(framesList) != 0:
-            frames = framesList.split(",")
-            for frame in frames:
-                if "-" in frame:
-                    frameList = frame.split("-")
-                    start = int(frameList[0])
-                    end = int(frameList[1])
-
-                    length = end - start + 1
-                    fullPacketCount, lastPacketCount = divmod(length, packetSize)
-
-                    if length < packetSize:
-                        callback.addCommand(start, end)
-                    else:
-                        for i in range(fullPacketCount):
-                            packetStart = start + i * packetSize
-                            packetEnd = packetStart + packetSize - 1
-                            callback.addCommand(packetStart, packetEnd)
-                        if lastPacketCount:
-                            packetStart = start + (i + 1) * packetSize
-                            callback.addCommand(packetStart, end)
-                else:
-                    callback.addCommand(int(frame), int(frame))
-        else:
-            start = int(start)
-            end = int(end)
-
-            length = end - start + 1
-            fullPacketCount, lastPacketCount = divmod(length, packetSize)
-
-            if length < packetSize:
-                callback.addCommand(start, end)
-            else:
-                for i in range(fullPacketCount):
-                    packetStart = start + i * packetSize
-                    packetEnd = packetStart + packetSize - 1
-                    callback.addCommand(packetStart, packetEnd)
-                if lastPacketCount:
-                    packetStart = start + (i + 1) * packetSize
-                    callback.addCommand(packetStart, end)
+        for (packetStart, packetEnd) in iterPackets(start, end, packetSize, framesList):
+            callback.addCommand(packetStart, packetEnd)
 
 
 
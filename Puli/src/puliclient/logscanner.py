@@ -0,0 +1,238 @@
+'''
+Streaming log scanner used by command runners to extract progress and stats from a renderer output.
+
+Instead of looping over every line in python, the output is read by large blocks and each registered
+regular expression is applied once on the whole block (compiled with re.MULTILINE). The python code is
+then only executed for actual matches, and the callbacks are throttled so that a verbose renderer
+does not flood the command watcher with updates.
+
+Basic usage in a runner::
+
+    from puliclient.logscanner import LogScanner
+
+    def execute(self, arguments, updateCompletion, updateMessage, updateStats, updateLicense):
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        scanner = LogScanner(interval=2.0)
+        scanner.addPattern("progress", r"\\| (.*)% done", lambda m: updateCompletion(float(m.group(1)) / 100))
+        scanner.addPattern("warning", r"^WARNING.*$", self.countWarning, throttle=False)
+        scanner.scanStream(process.stdout, echo=sys.stdout)
+
+        process.wait()
+'''
+
+import os
+import re
+import sys
+import time
+import select
+import logging
+
+LOGGER = logging.getLogger('puli.runner')
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+
+class LogPattern(object):
+    '''A regular expression and the callback to call with its matches.'''
+
+    def __init__(self, name, regex, callback, throttle=True, flags=0):
+        self.name = name
+        self.regex = re.compile(regex, re.MULTILINE | flags)
+        self.callback = callback
+        self.throttle = throttle
+        self.lastMatch = None
+        self.matchCount = 0
+
+    def __repr__(self):
+        return "LogPattern(%r, %r, throttle=%r)" % (self.name, self.regex.pattern, self.throttle)
+
+
+class LogScanner(object):
+    '''
+    | Scans a log (pipe, file object or file path) by blocks and reports the matches of the registered patterns.
+    | For a "throttled" pattern (default), only the most recent match is reported, at most once every
+    | "interval" seconds (and once more when the scan ends). Other patterns report every match immediately.
+    | A match held back by the throttle is reported when the interval has elapsed even if no more output comes
+    | (see poll), e.g. during a long render frame.
+    '''
+
+    def __init__(self, interval=1.0, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        :param interval: minimum delay in seconds between two calls of a throttled pattern callback
+        :param blockSize: maximum number of bytes read at once
+        '''
+        self.interval = interval
+        self.blockSize = blockSize
+        self.patterns = []
+        self.lastEmitTime = 0.0
+        self.bytesRead = 0
+        self._remainder = ""
+
+    def addPattern(self, name, regex, callback, throttle=True, flags=0):
+        '''
+        Registers a regular expression, it is compiled only once.
+
+        :param name: label of the pattern, used to retrieve its match count
+        :param regex: regular expression string, "^" and "$" match the start and end of each line
+        :param callback: called with a re.MatchObject
+        :param throttle: if True only the last match of each interval is given to the callback
+        :param flags: additional re flags
+        '''
+        pattern = LogPattern(name, regex, callback, throttle, flags)
+        self.patterns.append(pattern)
+        return pattern
+
+    def getMatchCount(self, name):
+        for pattern in self.patterns:
+            if pattern.name == name:
+                return pattern.matchCount
+        raise KeyError(name)
+
+    def feed(self, data):
+        '''
+        Processes a chunk of raw output. Only complete lines are scanned, an incomplete last line is kept
+        and prepended to the next chunk.
+        '''
+        self.bytesRead += len(data)
+        data = self._remainder + data
+        lastEol = data.rfind("\n")
+        if lastEol == -1:
+            self._remainder = data
+            return
+        self._remainder = data[lastEol + 1:]
+        self._scan(data[:lastEol + 1])
+        self._emit()
+
+    def poll(self):
+        '''
+        Reports the throttled matches held back if the interval has elapsed. To be called regularly by the code
+        feeding the scanner itself, scanStream calls it while waiting for the output.
+        '''
+        self._emit()
+
+    def pollTimeout(self):
+        '''Returns the delay in seconds before the held throttled matches are due, None if no match is held.'''
+        if not any(pattern.lastMatch is not None for pattern in self.patterns):
+            return None
+        return max(0.0, self.lastEmitTime + self.interval - time.time())
+
+    def flush(self):
+        '''Scans the pending incomplete line, if any, and reports every remaining throttled match.'''
+        if self._remainder:
+            self._scan(self._remainder)
+            self._remainder = ""
+        self._emit(force=True)
+
+    def scanStream(self, stream, echo=None):
+        '''
+        Reads a pipe or a file object until EOF, e.g. the stdout of a renderer process.
+        On a pipe, the data is handled as soon as it is available (no need to wait for a full block), and the
+        held throttled matches are reported when they are due while the process writes nothing.
+
+        :param stream: a file object with a fileno() or a read() method
+        :param echo: an optional file object on which every block read is written (e.g. sys.stdout to keep
+                     the renderer output in the command log)
+        '''
+        try:
+            fd = stream.fileno()
+        except (AttributeError, IOError, ValueError):
+            fd = None
+
+        while True:
+            if fd is not None:
+                timeout = self.pollTimeout()
+                if timeout is not None and not select.select([fd], [], [], timeout)[0]:
+                    self.poll()
+                    continue
+                data = os.read(fd, self.blockSize)
+            else:
+                data = stream.read(self.blockSize)
+            if not data:
+                break
+            if echo is not None:
+                echo.write(data)
+                echo.flush()
+            self.feed(data)
+        self.flush()
+
+    def scanFile(self, path):
+        '''Scans a whole log file.'''
+        with open(path, "rb") as logFile:
+            self.scanStream(logFile)
+
+    def _scan(self, block):
+        for pattern in self.patterns:
+            if pattern.throttle:
+                # Only the last match of the block is useful
+                lastMatch = None
+                for lastMatch in pattern.regex.finditer(block):
+                    pattern.matchCount += 1
+                if lastMatch is not None:
+                    pattern.lastMatch = lastMatch
+            else:
+                for match in pattern.regex.finditer(block):
+                    pattern.matchCount += 1
+                    self._call(pattern, match)
+
+    def _emit(self, force=False):
+        now = time.time()
+        if not force and (now - self.lastEmitTime) < self.interval:
+            return
+        self.lastEmitTime = now
+        for pattern in self.patterns:
+            if pattern.lastMatch is not None:
+                match = pattern.lastMatch
+                pattern.lastMatch = None
+                self._call(pattern, match)
+
+    def _call(self, pattern, match):
+        try:
+            pattern.callback(match)
+        except Exception, e:
+            LOGGER.warning("Error in log pattern callback %r: %r" % (pattern, e))
+
+
+def _benchmark(sizeMb=1024, path="/tmp/logscanner_benchmark.log"):
+    '''
+    Compares a classic line by line parsing with the LogScanner on a generated arnold-like log.
+    Usage: python -m puliclient.logscanner [size in MB]
+    '''
+    progressLine = "00:01:02  1024MB         |    %d%% done - 12 rays/pixel\n"
+    noiseLine = "00:01:02  1024MB         | [ass] loading node /scene/geo/shape%d of type polymesh\n"
+    if not os.path.isfile(path) or os.path.getsize(path) < sizeMb * 1024 * 1024:
+        print "Generating %d MB log in %s..." % (sizeMb, path)
+        chunk = "".join(noiseLine % i for i in xrange(999)) + progressLine
+        with open(path, "wb") as logFile:
+            written = 0
+            percent = 0
+            while written < sizeMb * 1024 * 1024:
+                block = chunk % (percent % 100)
+                logFile.write(block)
+                written += len(block)
+                percent += 1
+
+    regex = r"\| (.*)% done .* rays/pixel"
+    results = []
+
+    startTime = time.time()
+    pattern = re.compile(regex)
+    with open(path, "rb") as logFile:
+        for line in logFile:
+            match = pattern.search(line)
+            if match:
+                results.append(float(match.group(1)))
+    lineTime = time.time() - startTime
+
+    startTime = time.time()
+    scanner = LogScanner(interval=1.0)
+    scanner.addPattern("progress", regex, lambda m: results.append(float(m.group(1))))
+    scanner.scanFile(path)
+    scanTime = time.time() - startTime
+
+    print "per line: %.2fs (%.1f MB/s)" % (lineTime, sizeMb / lineTime)
+    print "scanner:  %.2fs (%.1f MB/s), %d matches" % (scanTime, sizeMb / scanTime, scanner.getMatchCount("progress"))
+
+
+if __name__ == '__main__':
+    _benchmark(*[int(arg) for arg in sys.argv[1:2]])
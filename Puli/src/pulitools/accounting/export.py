@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+"""
+Incremental export of the archived commands of PuliDB in an accounting warehouse (see pulitools.accounting.warehouse).
+It is usually croned after the job cleaner:
+    python -m pulitools.accounting.export -w /s/apps/lin/vfx_test_apps/pulistats/accounting
+
+The commands are archived by job, not in the order of their ids. The export keeps a watermark: every command below
+it is archived and already exported. Each run reads the archived commands above the watermark, skips the ones
+already exported (their ids are kept in the warehouse and saved after each batch), and moves the watermark up to
+the oldest command not archived yet. A job never archived holds the watermark: its later commands are read again at
+each run.
+"""
+
+import time
+import logging
+from optparse import OptionParser
+
+import numpy as np
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from pulitools.accounting.warehouse import Warehouse
+
+LOGGER = logging.getLogger('accounting')
+
+TAG_COLUMNS = ('prod', 'step', 'type', 'shot')
+
+
+def toTimestamp(date):
+    '''The dates of PuliDB are naive datetimes in the local time of the dispatcher.'''
+    if date is None:
+        return None
+    return time.mktime(date.timetuple()) + date.microsecond / 1e6
+
+
+def toUnicode(value):
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        return value.decode('utf8', 'replace')
+    return unicode(value)
+
+
+def loadTags(text):
+    try:
+        tags = json.loads(text) if text else {}
+    except ValueError:
+        return {}
+    return tags if isinstance(tags, dict) else {}
+
+
+class AccountingExporter(object):
+    '''
+    | Reads the archived commands with raw queries on a database connection (the connection of sqlobject, or
+    | anything with a queryAll(sql) method), joins them with their task and render node, and appends them to the
+    | warehouse by batches of batchSize commands.
+    '''
+
+    def __init__(self, connection, warehouse, batchSize=10000):
+        self.connection = connection
+        self.warehouse = warehouse
+        self.batchSize = batchSize
+        self.renderNodes = None
+
+    def run(self):
+        '''Exports the commands archived since the last run, returns the number of exported commands.'''
+        watermark, exported = self.warehouse.loadState()
+        # read before the archived commands: the commands archived during the export stay above the new watermark
+        minLive = self.connection.queryAll("select min(id) from commands where archived = 0")[0][0]
+        maxId = self.connection.queryAll("select max(id) from commands")[0][0] or 0
+
+        count = 0
+        lastId = watermark
+        while True:
+            commands = self.connection.queryAll(
+                "select id, task_id, status, attempt, creation_time, start_time, end_time, assigned_rn_id, stats "
+                "from commands where archived = 1 and id > %d and id <= %d order by id limit %d" % (lastId, maxId, self.batchSize))
+            if not commands:
+                break
+            lastId = commands[-1][0]
+            ids = np.array([command[0] for command in commands], dtype=np.int64)
+            commands = [command for (command, done) in zip(commands, np.in1d(ids, exported)) if not done]
+            if commands:
+                self.warehouse.append(self.buildRows(commands))
+                # saved after each batch, an interrupted run does not export the batch again
+                exported = np.union1d(exported, np.array([command[0] for command in commands], dtype=np.int64))
+                self.warehouse.saveState(watermark, exported)
+                count += len(commands)
+                LOGGER.info("exported %d commands (last id %d)" % (count, lastId))
+
+        newWatermark = max(watermark, (minLive - 1) if minLive is not None else maxId)
+        self.warehouse.saveState(newWatermark, exported[exported > newWatermark])
+        return count
+
+    def buildRows(self, commands):
+        tasks = self._queryByIds("select id, parent_id, name, user, tags, max_nb_cores from tasks where id in (%s)",
+                                 set(command[1] for command in commands))
+        taskGroups = self._queryByIds("select id, tags from task_groups where id in (%s)",
+                                      set(task[1] for task in tasks.itervalues()))
+        renderNodes = self._renderNodes()
+
+        rows = []
+        for (id, taskId, status, attempt, creationTime, startTime, endTime, renderNodeId, stats) in commands:
+            task = tasks.get(taskId)
+            row = {
+                'id': id,
+                'taskId': taskId,
+                'status': status,
+                'attempt': attempt or 0,
+                'creationTime': toTimestamp(creationTime),
+                'startTime': toTimestamp(startTime),
+                'endTime': toTimestamp(endTime),
+                'stats': toUnicode(stats),
+            }
+            renderNode = renderNodes.get(renderNodeId)
+            if renderNode is not None:
+                row['renderNode'] = toUnicode(renderNode[0])
+                # same reservation as RenderNode.reserveRessources
+                maxNbCores = task[5] if task is not None else 0
+                row['cores'] = min(renderNode[1], maxNbCores) if maxNbCores else renderNode[1]
+            if task is not None:
+                row['user'] = toUnicode(task[3])
+                row['taskName'] = toUnicode(task[2])
+                tags = loadTags(taskGroups[task[1]][1]) if task[1] in taskGroups else {}
+                tags.update(loadTags(task[4]))
+                for key in TAG_COLUMNS:
+                    row[key] = toUnicode(tags.get(key))
+            rows.append(row)
+        return rows
+
+    def _queryByIds(self, query, ids):
+        ids = sorted(id for id in ids if id is not None)
+        result = {}
+        for first in xrange(0, len(ids), 1000):
+            for row in self.connection.queryAll(query % ",".join(str(int(id)) for id in ids[first:first + 1000])):
+                result[row[0]] = row
+        return result
+
+    def _renderNodes(self):
+        if self.renderNodes is None:
+            self.renderNodes = dict((id, (name, cores)) for (id, name, cores) in
+                                    self.connection.queryAll("select id, name, cores_number from render_nodes"))
+        return self.renderNodes
+
+
+if __name__ == '__main__':
+    from sqlobject import connectionForURI
+    from octopus.dispatcher import settings
+
+    parser = OptionParser("usage: %prog -w <warehouse directory> [options]",
+                          description="Exports the archived commands of PuliDB in an accounting warehouse.")
+    parser.add_option("-w", "--warehouse", action="store", dest="warehouse", help="Warehouse directory")
+    parser.add_option("--db", action="store", dest="dbUrl", default=settings.DB_URL, help="Database url [%default]")
+    parser.add_option("-b", "--batch", action="store", dest="batchSize", type="int", default=10000, help="Number of commands read per query [%default]")
+    parser.add_option("-v", action="store_true", dest="verbose", help="Verbose output", default=False)
+    options, args = parser.parse_args()
+    if options.warehouse is None:
+        parser.error("the warehouse directory is required")
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s: %(message)s', level=logging.DEBUG if options.verbose else logging.INFO)
+    connection = connectionForURI(options.dbUrl)
+    try:
+        count = AccountingExporter(connection, Warehouse(options.warehouse), options.batchSize).run()
+        LOGGER.info("%d commands exported" % count)
+    finally:
+        connection.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+"""
+Reports on the accounting warehouse (see pulitools.accounting.export), without any access to the database:
+
+    # core-hours used per prod and per week over the last 8 weeks
+    python -m pulitools.accounting.query corehours -w <warehouse> -s 56 --by prod --period week
+
+    # failure rate of each render node over the last 7 days, worst first
+    python -m pulitools.accounting.query failures -w <warehouse> -s 7 --by renderNode
+
+The reports are computed on the columns of the partitions with numpy: the groups are indexed with np.unique and
+summed with np.bincount.
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from octopus.core.enums.command import CMD_DONE, CMD_ERROR, CMD_TIMEOUT
+from pulitools.accounting.warehouse import Warehouse, COLUMN_NAMES, DAY
+
+# the epoch is a thursday, the weeks start on monday (UTC)
+WEEK_OFFSET = 4 * DAY
+PERIODS = {
+    'day': (DAY, 0, "%Y-%m-%d"),
+    'week': (7 * DAY, WEEK_OFFSET, "%Y-%m-%d"),
+}
+
+
+def periodStart(dates, period):
+    '''Returns the start of the period of each date.'''
+    length, offset, format = PERIODS[period]
+    return np.floor((dates - offset) / length) * length + offset
+
+
+def groupSums(keys, values):
+    '''
+    Returns the unique values of each array of keys and the sums of values by combination of keys, as an array with
+    one dimension per array of keys.
+    '''
+    uniques = []
+    index = np.zeros(len(values), dtype=np.int64)
+    shape = []
+    for key in keys:
+        unique, inverse = np.unique(key, return_inverse=True)
+        index = index * len(unique) + inverse
+        uniques.append(unique)
+        shape.append(len(unique))
+    size = int(np.prod(shape)) if shape else 1
+    return uniques, np.bincount(index, weights=values, minlength=size).reshape(shape)
+
+
+def coreHours(warehouse, start, end, by, period):
+    '''
+    Core-hours of the commands ended in the range (duration multiplied by the reserved cores), by period and group.
+    Returns a list of (period start, group, core-hours) sorted by period and decreasing core-hours.
+    '''
+    data = warehouse.read(start, end, columns=('startTime', 'endTime', 'cores', by))
+    ran = ~np.isnan(data['startTime']) & ~np.isnan(data['endTime'])
+    hours = (data['endTime'][ran] - data['startTime'][ran]) * data['cores'][ran] / 3600.0
+    (periods, groups), sums = groupSums((periodStart(data['endTime'][ran], period), data[by][ran]), hours)
+    result = []
+    for i, periodDate in enumerate(periods):
+        for j in np.argsort(-sums[i]):
+            if sums[i, j] > 0:
+                result.append((periodDate, groups[j], sums[i, j]))
+    return result
+
+
+def failures(warehouse, start, end, by):
+    '''
+    Failure rate of the commands finished in the range (done, error or timeout), by group.
+    Returns a list of (group, finished commands, failed commands, rate) sorted by decreasing rate.
+    '''
+    data = warehouse.read(start, end, columns=('status', by))
+    status = data['status']
+    finished = (status == CMD_DONE) | (status == CMD_ERROR) | (status == CMD_TIMEOUT)
+    failed = ((status == CMD_ERROR) | (status == CMD_TIMEOUT))[finished]
+    (groups,), totals = groupSums((data[by][finished],), np.ones(failed.shape))
+    (groups,), fails = groupSums((data[by][finished],), failed.astype(np.float64))
+    rates = fails / np.maximum(totals, 1)
+    order = np.lexsort((-totals, -rates))
+    return [(groups[i], int(totals[i]), int(fails[i]), rates[i]) for i in order]
+
+
+def process_args():
+    usage = "usage: %prog corehours|failures -w <warehouse directory> [options]"
+    desc = """Reports on the accounting warehouse filled by pulitools.accounting.export.
+  corehours: core-hours used by group and period
+  failures: failure rate by group (e.g. --by renderNode)
+"""
+    parser = OptionParser(usage=usage, description=desc)
+    parser.add_option("-w", "--warehouse", action="store", dest="warehouse", help="Warehouse directory")
+    parser.add_option("-s", action="store", dest="rangeIn", type="float", help="Start range is N days in past [%default]", default=7)
+    parser.add_option("-e", action="store", dest="rangeOut", type="float", help="End range is N days in past [%default]", default=0)
+    parser.add_option("--startTime", action="store", dest="timeIn", type="int", help="Start range is at timestamp", default=0)
+    parser.add_option("--endTime", action="store", dest="timeOut", type="int", help="End range is at timestamp", default=0)
+    parser.add_option("--by", action="store", dest="by", help="Column to group by: %s" % ", ".join(COLUMN_NAMES), default=None)
+    parser.add_option("--period", action="store", dest="period", type="choice", choices=sorted(PERIODS), default="week", help="Period of the corehours report [%default]")
+    parser.add_option("-n", action="store", dest="limit", type="int", help="Max number of lines of the failures report", default=0)
+    options, args = parser.parse_args()
+
+    if len(args) != 1 or args[0] not in ('corehours', 'failures'):
+        parser.error("a report is required: corehours or failures")
+    if options.warehouse is None:
+        parser.error("the warehouse directory is required")
+    if options.by is None:
+        options.by = 'prod' if args[0] == 'corehours' else 'renderNode'
+    if options.by not in COLUMN_NAMES:
+        parser.error("invalid column: %s" % options.by)
+    return options, args[0]
+
+
+if __name__ == '__main__':
+    options, report = process_args()
+
+    if options.timeIn:
+        startDate, endDate = options.timeIn, options.timeOut or time.time()
+    else:
+        startDate = time.time() - DAY * options.rangeIn
+        endDate = time.time() - DAY * options.rangeOut
+    if endDate < startDate:
+        print "Invalid start/end range"
+        sys.exit(1)
+
+    warehouse = Warehouse(options.warehouse)
+    if report == 'corehours':
+        print "%-12s %-30s %12s" % (options.period, options.by, "core-hours")
+        for (periodDate, group, hours) in coreHours(warehouse, startDate, endDate, options.by, options.period):
+            print "%-12s %-30s %12.1f" % (time.strftime(PERIODS[options.period][2], time.gmtime(periodDate)), unicode(group).encode('utf8') or '-', hours)
+    else:
+        print "%-30s %10s %10s %8s" % (options.by, "finished", "failed", "rate")
+        lines = failures(warehouse, startDate, endDate, options.by)
+        for (group, total, failed, rate) in lines[:options.limit or len(lines)]:
+            print "%-30s %10d %10d %7.2f%%" % (unicode(group).encode('utf8') or '-', total, failed, rate * 100)
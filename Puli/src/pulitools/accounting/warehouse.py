@@ -0,0 +1,170 @@
+# -*- coding: utf8 -*-
+
+"""
+Columnar store of the accounting of the archived commands, filled by pulitools.accounting.export and read by
+pulitools.accounting.query without touching the database.
+
+The commands are partitioned by the day (UTC) they ended: one compressed numpy archive per day, holding one array
+per column. A query only loads the partitions of its date range.
+
+Layout of the warehouse directory::
+
+    <path>/commands/2014-04-02.npz      columns of the commands ended this day (see COLUMNS)
+    <path>/state.json                   progress of the export (see AccountingExporter)
+    <path>/exported.npy                 ids of the commands already exported above the watermark
+"""
+
+import os
+import time
+import calendar
+
+import numpy as np
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+DAY = 86400
+
+# name and dtype of the columns, the strings are fixed width unicode arrays (no pickle in the archives)
+COLUMNS = (
+    ('id', np.int64),
+    ('taskId', np.int64),
+    ('status', np.int32),
+    ('attempt', np.int32),
+    ('creationTime', np.float64),
+    ('startTime', np.float64),      # NaN if the command never started
+    ('endTime', np.float64),
+    ('cores', np.int32),            # cores reserved on the render node
+    ('renderNode', np.unicode_),    # empty if the command was never assigned
+    ('user', np.unicode_),
+    ('prod', np.unicode_),
+    ('step', np.unicode_),
+    ('type', np.unicode_),
+    ('shot', np.unicode_),
+    ('taskName', np.unicode_),
+    ('stats', np.unicode_),         # stats of the command as a json string
+)
+COLUMN_NAMES = tuple(name for (name, dtype) in COLUMNS)
+
+
+class Warehouse(object):
+    '''
+    | A single exporter is expected to write in a warehouse, any number of processes can read it: a partition is
+    | rewritten in a temporary file renamed over the previous one.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.partitionsPath = os.path.join(path, 'commands')
+
+    ## Write
+    #
+    def append(self, rows):
+        '''
+        Adds a list of commands, a command is a dict of values by column name (see COLUMNS).
+        The commands are partitioned by their end time, or creation time if they never ended. The commands already
+        in their partition (same id) are skipped, returns the number of added commands.
+        '''
+        byDay = {}
+        for row in rows:
+            date = row['endTime']
+            if date is None or date != date:
+                date = row['creationTime']
+            byDay.setdefault(int(date // DAY), []).append(row)
+
+        count = 0
+        for day, dayRows in byDay.iteritems():
+            columns = {}
+            for (name, dtype) in COLUMNS:
+                columns[name] = np.array([self._value(row.get(name), dtype) for row in dayRows], dtype=dtype)
+            ids, first = np.unique(columns['id'], return_index=True)
+            previous = self._load(self._partitionPath(day))
+            if previous is not None:
+                first = first[~np.in1d(ids, previous['id'])]
+            if not len(first):
+                continue
+            first.sort()
+            columns = dict((name, columns[name][first]) for name in COLUMN_NAMES)
+            if previous is not None:
+                columns = dict((name, np.concatenate((previous[name], columns[name]))) for name in COLUMN_NAMES)
+            self._save(day, columns)
+            count += len(first)
+        return count
+
+    def _value(self, value, dtype):
+        if value is None:
+            return u'' if dtype is np.unicode_ else (np.nan if dtype is np.float64 else 0)
+        return value
+
+    def _save(self, day, columns):
+        if not os.path.isdir(self.partitionsPath):
+            os.makedirs(self.partitionsPath)
+        path = self._partitionPath(day)
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.rename(tmpPath, path)
+
+    ## Read
+    #
+    def read(self, start, end, columns=None):
+        '''
+        Returns the commands ended (or created, if they never ended) in [start, end) as a dict of numpy arrays by
+        column name, only the given columns are returned if any.
+        '''
+        names = COLUMN_NAMES if columns is None else tuple(columns)
+        parts = []
+        for day in self.days():
+            if day < start // DAY or end <= day * DAY:
+                continue
+            data = self._load(self._partitionPath(day))
+            if data is None:
+                continue
+            dates = np.where(np.isnan(data['endTime']), data['creationTime'], data['endTime'])
+            inRange = (start <= dates) & (dates < end)
+            parts.append(dict((name, data[name][inRange]) for name in names))
+
+        if not parts:
+            return dict((name, np.empty(0, dtype=dict(COLUMNS)[name])) for name in names)
+        return dict((name, np.concatenate([part[name] for part in parts])) for name in names)
+
+    def days(self):
+        if not os.path.isdir(self.partitionsPath):
+            return []
+        return sorted(calendar.timegm(time.strptime(name[:-len('.npz')], "%Y-%m-%d")) // DAY
+                      for name in os.listdir(self.partitionsPath) if name.endswith('.npz'))
+
+    def _partitionPath(self, day):
+        return os.path.join(self.partitionsPath, time.strftime("%Y-%m-%d", time.gmtime(day * DAY)) + '.npz')
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as archive:
+            return dict((name, archive[name]) for name in archive.files)
+
+    ## Export state
+    #
+    def loadState(self):
+        '''Returns the watermark of the export and the array of the ids exported above it.'''
+        statePath = os.path.join(self.path, 'state.json')
+        exportedPath = os.path.join(self.path, 'exported.npy')
+        watermark = 0
+        if os.path.exists(statePath):
+            with open(statePath) as f:
+                watermark = json.load(f)['watermark']
+        exported = np.load(exportedPath) if os.path.exists(exportedPath) else np.empty(0, dtype=np.int64)
+        return watermark, exported
+
+    def saveState(self, watermark, exported):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        exportedPath = os.path.join(self.path, 'exported.npy')
+        with open(exportedPath + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(exported, dtype=np.int64))
+        os.rename(exportedPath + '.tmp', exportedPath)
+        statePath = os.path.join(self.path, 'state.json')
+        with open(statePath + '.tmp', 'w') as f:
+            json.dump({'watermark': watermark, 'date': time.time()}, f)
+        os.rename(statePath + '.tmp', statePath)
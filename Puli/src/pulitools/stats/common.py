@@ -11,17 +11,31 @@ from pygal.style import *
 
 import pygal
 import os
+import re
+import sys
 import time
+import datetime
 
+import numpy as np
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from octopus.core.timeseries import TimeSeriesStore, flatten
 from pulitools.common import roundTime
 
+# date of a line of the json logs, read before parsing the line to skip the lines out of the range
+DATE_PATTERN = re.compile( r'"(?:date|requestDate)":\s*([-+0-9.eE]+)' )
+
+
 def createCommonParser():
     """
     Create a OptionParser object to handle common params for stats commands
     """
     parser = OptionParser()
 
-    parser.add_option( "-f", action="store", dest="sourceFile", help="Source file" )
+    parser.add_option( "-f", action="store", dest="sourceFile", help="Source file or time-series store directory" )
     parser.add_option( "-o", action="store", dest="outputFile", help="Target output file." )
     parser.add_option( "--render-mode", action="store", dest="renderMode", type="string", help="render destination: inline, svg or png", default="svg" )
 
@@ -76,21 +90,160 @@ def getRangeDates( options ):
     return startDate, endDate
 
 
-def prepareScale( npArrScale, options ):
+def isStore( sourceFile ):
+    """
+    Indicates if the source is a time-series store (see octopus.core.timeseries) instead of a json log file
+    """
+    return os.path.isdir( sourceFile )
+
+
+def loadLog( sourceFile, startDate, endDate, prefix=None ):
+    """
+    Parses the samples of a json log (one dict per line, dated by "date" or "requestDate") in the range [startDate, endDate).
+    The date of a line is found with a regexp, only the lines in the range are parsed. The values are gathered in
+    flat lists and put in a single 2D array (one row per sample, one column per field) with one assignment.
+    Returns a numpy array of timestamps and a dict of numpy arrays by field (see loadSeries)
+    """
+    dates = []
+    rows = []
+    cols = []
+    values = []
+    fieldIndexes = {}
+
+    with open( sourceFile, "r" ) as f:
+        for line in f:
+            match = DATE_PATTERN.search( line )
+            if match is not None:
+                date = float( match.group(1) )
+                if date < startDate or endDate <= date:
+                    continue
+            data = json.loads( line )
+            date = data.pop( 'date' if 'date' in data else 'requestDate' )
+            if date < startDate or endDate <= date:
+                continue
+
+            row = len(dates)
+            dates.append( date )
+            for field, value in flatten( data ).iteritems():
+                if prefix is not None and not field.startswith( prefix ):
+                    continue
+                index = fieldIndexes.get( field )
+                if index is None:
+                    index = fieldIndexes[ field ] = len( fieldIndexes )
+                rows.append( row )
+                cols.append( index )
+                values.append( value )
+
+    matrix = np.empty( (len(dates), len(fieldIndexes)), dtype=np.float64 )
+    matrix.fill( np.nan )
+    if values:
+        matrix[ rows, cols ] = values
+
+    # the lines of a log are not guaranteed to be in order (e.g. logs of several grab processes concatenated)
+    dates = np.array( dates, dtype=np.float64 )
+    order = np.argsort( dates, kind='mergesort' )
+    return dates[order], dict( (field, matrix[order, index]) for field, index in fieldIndexes.iteritems() )
+
+
+def loadSeries( sourceFile, startDate, endDate, nbPoints, prefix=None ):
+    """
+    Reads the samples in the date range of a time-series store or a json log file.
+    For a store, the largest rollup giving at least nbPoints samples is used and only the days of the range are read.
+    Returns a numpy array of timestamps and a dict of numpy arrays by field (e.g. "rendernodes/renderNodesByStatus/Idle"),
+    a field missing in a sample is NaN
+    """
+    if not isStore( sourceFile ):
+        return loadLog( sourceFile, startDate, endDate, prefix=prefix )
+    store = TimeSeriesStore( sourceFile )
+    resolution = store.resolutionFor( startDate, endDate, nbPoints )
+    return store.query( startDate, endDate, prefix=prefix, resolution=resolution )
+
+
+def loadGroups( sourceFile, startDate, endDate, nbPoints, groupField, graphValue ):
+    """
+    Reads a value of each group of a dimension in the queue stats, e.g. the "jobs" of each "prod".
+    Returns a numpy array of timestamps and a dict of numpy arrays by group, a group missing in a sample counts 0
+    """
+    prefix = groupField + "/"
+    suffix = "/" + graphValue
+    dates, columns = loadSeries( sourceFile, startDate, endDate, nbPoints, prefix=prefix )
+    groups = {}
+    for field, values in columns.items():
+        if field.endswith( suffix ):
+            groups[ field[len(prefix):-len(suffix)] ] = np.nan_to_num( values )
+    return dates, groups
+
+
+def resample( dates, columns, nbBins ):
+    """
+    Averages every series in nbBins bins of the same duration, from the first to the last sample.
+    All the samples are kept (nothing is truncated to a multiple of nbBins), the NaN values are ignored and an empty
+    bin is NaN. The sums and counts of all the series are computed with a single bincount: the index of the bin b of
+    the series j is j * nbBins + b.
+    Returns the list of the start datetime of each bin and a dict of numpy arrays of nbBins means by field
+    """
+    nbBins = min( nbBins, len(dates) )
+    if not nbBins:
+        return [], dict( (field, np.empty(0)) for field in columns )
+
+    first = dates[0]
+    step = ( dates[-1] - first ) / float( nbBins ) or 1.0
+    bins = np.minimum( ((dates - first) / step).astype(np.int64), nbBins - 1 )
+    scale = [ datetime.datetime.fromtimestamp( first + i * step ) for i in xrange( nbBins ) ]
+
+    fields = columns.keys()
+    if not fields:
+        return scale, {}
+    matrix = np.column_stack( [ columns[field] for field in fields ] )
+    valid = ~np.isnan( matrix )
+    indexes = ( bins[:, np.newaxis] + nbBins * np.arange( len(fields) ) ).ravel()
+    size = nbBins * len(fields)
+    sums = np.bincount( indexes, weights=np.where( valid, matrix, 0.0 ).ravel(), minlength=size )
+    counts = np.bincount( indexes, weights=valid.ravel(), minlength=size )
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        means = ( sums / counts ).reshape( len(fields), nbBins )
+    return scale, dict( zip( fields, means ) )
+
+
+def toSeries( values, decimals=None ):
+    """
+    Converts an array of resample() in a list for pygal, an empty bin (NaN) is None and displayed as a gap
+    """
+    if decimals is not None:
+        values = np.around( values, decimals=decimals )
+    return [ None if np.isnan(value) else value for value in values.tolist() ]
+
+
+def scaleLabels( scale, scaleEvery ):
+    """
+    Returns the x labels of the bins of resample(): the time of one bin out of len(scale)/scaleEvery, the first and
+    last ones with their date
+    """
+    if not scale:
+        return []
+    labels = [''] * len(scale)
+    for i in xrange( 0, len(scale), max( len(scale) / max(scaleEvery, 1), 1 ) ):
+        labels[i] = scale[i].strftime('%H:%M')
+    labels[0] = scale[0].strftime('%Y-%m-%d %H:%M')
+    labels[-1] = scale[-1].strftime('%Y-%m-%d %H:%M')
+    return labels
 
-    result = [''] * options.resolution
-    tmpscale = []
 
-    for i, date in enumerate(npArrScale):
-        tmpscale.append(date[0])
-    
-    # print tmpscale
+def prepareScale( tmpscale, options ):
+    """
+    Returns the x labels of the bins of resample() (list of the start datetime of each bin), rounded to
+    options.scaleRound seconds
+    """
+    if not tmpscale:
+        return []
+
+    result = [''] * len(tmpscale)
 
-    options.scaleEvery = min(options.scaleEvery, options.resolution )
+    options.scaleEvery = min(options.scaleEvery, len(tmpscale) )
 
     #########################################################################################
     # Methode 2
-    padding = len(npArrScale)/options.scaleEvery
+    padding = max( len(tmpscale)/options.scaleEvery, 1 )
     dayChanged = False
     for i, date in enumerate(tmpscale):
         # print "i: %d - %s " % (i, date)
@@ -12,20 +12,15 @@ import time
 import datetime
 from optparse import OptionParser
 
-import numpy as np
 import pygal
 from pygal.style import *
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
 from pulitools.common import roundTime
 from pulitools.common import lowerQuartile, higherQuartile
+from pulitools.stats.common import loadGroups, resample, toSeries, scaleLabels
 
 ###########################################################################################################################
 # Data example:
@@ -62,7 +57,7 @@ def process_args():
 
     parser = OptionParser(usage=usage, description=desc, version="%prog 0.1" )
 
-    parser.add_option( "-f", action="store", dest="sourceFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Source file" )
+    parser.add_option( "-f", action="store", dest="sourceFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Source file or time-series store directory" )
     parser.add_option( "-o", action="store", dest="outputFile", default="./queue_avg.svg", help="Target output file." )
     parser.add_option( "-v", action="store_true", dest="verbose", help="Verbose output" )
     parser.add_option( "-s", action="store", dest="rangeIn", type="int", help="Start range is N hours in past", default=3 )
@@ -111,87 +106,25 @@ if __name__ == "__main__":
         print "Start."
 
 
-    strScale=[]
-    scale=[]
-    data2Dim = {}
-    log = []
-
     #
-    # Load json log and filter by date
+    # Read the range in the time-series store or the json log, and average all the groups by bins
     #
-    with open(options.sourceFile, "r" ) as f:
-        for line in f:
-            data = json.loads(line)
-            if (startDate < data['requestDate']  and data['requestDate'] <= endDate):
-                log.append( json.loads(line) )
-
-
-    for i, data in enumerate(log):
-        eventDate = datetime.datetime.fromtimestamp( data['requestDate'] )
-
-        for key, val in data[ groupField ].items():
-            if key not in data2Dim:
-                data2Dim[key] = np.array( [0]*len(log) )
-            data2Dim[key][i] = val[ graphValue ]
-
-        scale.append( eventDate )
-
-
-    stepSize = len(scale) / options.resolution
-    newshape = (options.resolution, stepSize)
-    useableSize = len(scale) - ( len(scale) % options.resolution )
-
-    avgData = {}
-
-    if VERBOSE:
-        print "stepSize=%d" % stepSize
-        print "useableSize=%d" % useableSize
-
-    for dataset in data2Dim.keys():
-        # print "%s = %d - %r" % (dataset, len(data2Dim[dataset]), data2Dim[dataset])
-        avgData[dataset] = np.mean( np.reshape(data2Dim[dataset][-useableSize:], newshape), axis=1)
-
-    # working = np.array(nb_working[-useableSize:])
-    # unknown = np.array(nb_unknown[-useableSize:])
-    # paused = np.array(nb_paused[-useableSize:])
-
-
-    # # print ("working %d = %r" % (len(working), working) )
-    # # print ("reshape %d = %r" % (len(newshape), newshape) )
+    dates, data2Dim = loadGroups( options.sourceFile, startDate, endDate, options.resolution, groupField, graphValue )
 
-    # avg_working= np.mean( np.reshape(working, newshape), axis=1)
-    # avg_paused= np.mean( np.reshape(paused, newshape), axis=1)
-    # avg_unknown= np.mean( np.reshape(unknown, newshape), axis=1)
-
-
-    # # med= np.median(data, axis=1)
-    # # amin= np.min(data, axis=1)
-    # # amax= np.max(data, axis=1)
-    # # q1= lowerQuartile(data)
-    # # q2= higherQuartile(data)
-    # # std= np.std(data, axis=1)
-
-    strScale = [''] * options.resolution
-    tmpscale = np.reshape(scale[-useableSize:], newshape)
-    # # print ("tmp scale %d = %r" % (len(tmpscale), tmpscale) )
-    # # print ("str scale %d = %r" % (len(strScale), strScale) )
-
-    for i,date in enumerate(tmpscale[::len(tmpscale)/options.scaleEvery]):
-        newIndex = i*len(tmpscale)/options.scaleEvery
+    if not len(dates):
+        print "No stats in the range"
+        sys.exit(1)
 
-        if newIndex < len(strScale):
-            strScale[newIndex] = date[0].strftime('%H:%M')
+    scale, avgData = resample( dates, data2Dim, options.resolution )
 
-    strScale[0] = scale[0].strftime('%Y-%m-%d %H:%M')
-    strScale[-1] = scale[-1].strftime('%Y-%m-%d %H:%M')
+    strScale = scaleLabels( scale, options.scaleEvery )
 
     if VERBOSE:
-        print ("newshape %d = %r" % (len(newshape), newshape) )
         print ("data2Dim %d = %r" % (len(data2Dim), data2Dim) )
         print ("scale %d = %r" % (len(strScale), strScale) )
 
     if VERBOSE:
-        print "Num events: %d" % len(scale)
+        print "Num events: %d" % len(dates)
         print "Creating graph."
 
 
@@ -225,7 +158,7 @@ if __name__ == "__main__":
     avg_usage.x_labels = strScale
 
     for key,val in avgData.items():
-        avg_usage.add(key, val )
+        avg_usage.add(key, toSeries(val) )
 
     avg_usage.render_to_file( options.outputFile )
 
@@ -16,16 +16,12 @@ import numpy as np
 import pygal
 from pygal.style import *
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
 from pulitools.common import roundTime
 from pulitools.common import lowerQuartile, higherQuartile
+from pulitools.stats.common import loadSeries, resample, toSeries, scaleLabels
 
 ###########################################################################################################################
 # Data example:
@@ -62,7 +58,7 @@ def process_args():
 
     parser = OptionParser(usage=usage, description=desc, version="%prog 0.1" )
 
-    parser.add_option( "-f", action="store", dest="sourceFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Source file" )
+    parser.add_option( "-f", action="store", dest="sourceFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Source file or time-series store directory" )
     parser.add_option( "-o", action="store", dest="outputFile", default="./queue_avg.svg", help="Target output file." )
     parser.add_option( "-v", action="store_true", dest="verbose", help="Verbose output" )
     parser.add_option( "-s", action="store", dest="rangeIn", type="int", help="Start range is N hours in past", default=3 )
@@ -104,65 +100,21 @@ if __name__ == "__main__":
         print "Start."
 
 
-    strScale=[]
-    scale=[]
-    tot=[]
-    totErr=[]
-    totRun=[]
-    totPaused=[]
-    totReady=[]
-    
-    # arrRnByProd = np.array()
-    rnByProd = {}
-    log = []
-
     #
-    # Load json log and filter by date
+    # Read the range in the time-series store or the json log, and average all the series by bins
     #
-    with open(options.sourceFile, "r" ) as f:
-        for line in f:
-            data = json.loads(line)
-            if (startDate < data['requestDate']  and data['requestDate'] <= endDate):
-                log.append( json.loads(line) )
-
-
-    for i, data in enumerate(log):
-        eventDate = datetime.datetime.fromtimestamp( data['requestDate'] )
-
-        # tot.append(data["total"]["jobs"])
-        totErr.append(data["total"]["err"])
-        totPaused.append(data["total"]["paused"])
-        totReady.append(data["total"]["ready"])
-        totRun.append(data["total"]["running"])
-
-        # for key, val in data["prod"].items():
-        #     if key not in rnByProd:
-        #         rnByProd[key] = np.array( [0]*len(log) )
-        #     rnByProd[key][i] = val["allocatedRN"]
-
-        scale.append( eventDate )
+    dates, columns = loadSeries( options.sourceFile, startDate, endDate, options.resolution, prefix="total/" )
 
     if VERBOSE:
-        print "Num events: %d" % len(scale)
-        # for key,val in rnByProd.items():
-        #     print "%s - %r - %s" % (key, len(val), val)
+        print "Num events: %d" % len(dates)
         print "Creating graph."
 
+    if not len(dates):
+        print "No stats in the range"
+        sys.exit(1)
 
-    stepSize = len(scale) / options.resolution
-    newshape = (options.resolution, stepSize)
-    useableSize = len(scale) - ( len(scale) % options.resolution )
-
-    
-    err = np.array(totErr[-useableSize:])
-    paused = np.array(totPaused[-useableSize:])
-    ready = np.array(totReady[-useableSize:])
-    run = np.array(totRun[-useableSize:])
-
-    avg_err= np.mean( np.reshape(err, newshape), axis=1)
-    avg_paused= np.mean( np.reshape(paused, newshape), axis=1)
-    avg_ready= np.mean( np.reshape(ready, newshape), axis=1)
-    avg_run= np.mean( np.reshape(run, newshape), axis=1)
+    total = lambda counter: columns.get( "total/" + counter, np.zeros(len(dates)) )
+    scale, avg = resample( dates, dict( (counter, total(counter)) for counter in ('err', 'paused', 'ready', 'running') ), options.resolution )
 
     # # med= np.median(data, axis=1)
     # # amin= np.min(data, axis=1)
@@ -171,24 +123,7 @@ if __name__ == "__main__":
     # # q2= higherQuartile(data)
     # # std= np.std(data, axis=1)
 
-    strScale = [''] * options.resolution
-    tmpscale = np.reshape(scale[-useableSize:], newshape)
-    # # print ("tmp scale %d = %r" % (len(tmpscale), tmpscale) )
-    # # print ("str scale %d = %r" % (len(strScale), strScale) )
-
-    for i,date in enumerate(tmpscale[::len(tmpscale)/options.scaleEvery]):
-        newIndex = i*len(tmpscale)/options.scaleEvery
-
-        if newIndex < len(strScale):
-            strScale[newIndex] = date[0].strftime('%H:%M')
-
-    strScale[0] = scale[0].strftime('%Y-%m-%d %H:%M')
-    strScale[-1] = scale[-1].strftime('%Y-%m-%d %H:%M')
-
-    # if VERBOSE:
-    #     print ("newshape %d = %r" % (len(newshape), newshape) )
-    #     print ("avg %d = %r" % (len(avg_working), avg_working) )
-    #     print ("scale %d = %r" % (len(strScale), strScale) )
+    strScale = scaleLabels( scale, options.scaleEvery )
 
 
     if options.stacked:
@@ -219,10 +154,10 @@ if __name__ == "__main__":
 
     avg_usage.title = options.title
     avg_usage.x_labels = strScale
-    avg_usage.add('Error', avg_err )
-    avg_usage.add('Paused', avg_paused )
-    avg_usage.add('Running', avg_run )
-    avg_usage.add('Ready', avg_ready )
+    avg_usage.add('Error', toSeries( avg['err'] ) )
+    avg_usage.add('Paused', toSeries( avg['paused'] ) )
+    avg_usage.add('Running', toSeries( avg['running'] ) )
+    avg_usage.add('Ready', toSeries( avg['ready'] ) )
 
     avg_usage.render_to_file( options.outputFile )
 
@@ -16,16 +16,12 @@ import numpy as np
 import pygal
 from pygal.style import *
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
 from pulitools.common import roundTime
 from pulitools.common import lowerQuartile, higherQuartile
+from pulitools.stats.common import loadSeries, resample, toSeries, scaleLabels
 # import matplotlib.pyplot as plt
 
 ###########################################################################################################################
@@ -79,7 +75,7 @@ def process_args():
 
     parser = OptionParser(usage=usage, description=desc, version="%prog 0.1" )
 
-    parser.add_option( "-f", action="store", dest="sourceFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Source file" )
+    parser.add_option( "-f", action="store", dest="sourceFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Source file or time-series store directory" )
     parser.add_option( "-o", action="store", dest="outputFile", default="./usage_avg.svg", help="Target output file." )
     parser.add_option( "--render-mode", action="store", dest="renderMode", type="string", help="render destination: inline, svg or png", default="svg" )
 
@@ -140,61 +136,26 @@ if __name__ == "__main__":
         print "  - to:   %r " % datetime.date.fromtimestamp(endDate)
         print "Start."
 
-    nbjobs=[]
-    nb_working=[]
-    nb_paused=[]
-    nb_idle=[]
-    nb_assigned=[]
-    nb_unknown=[]
-    nb_booting=[]
-    nb_finishing=[]
-    strScale=[]
-    scale=[]
-
-    log = []
-    with open(options.sourceFile, "r" ) as f:
-        for line in f:
-            log.append( json.loads(line) )
-
-    
-    for data in log:
-        eventDate = datetime.datetime.fromtimestamp( data['date'] )
-
-        if data['date'] < startDate or endDate <= data['date'] :
-            continue
-
-        nb_working.append(data["rendernodes"]["renderNodesByStatus"]['Working'] + data["rendernodes"]["renderNodesByStatus"]['Assigned'])
-        nb_paused.append(data["rendernodes"]["renderNodesByStatus"]['Paused'])
-        nb_unknown.append(data["rendernodes"]["renderNodesByStatus"]['Unknown'])
-        nb_idle.append(data["rendernodes"]["renderNodesByStatus"]['Idle'])
-
-        scale.append( eventDate )
+    #
+    # Read the range in the time-series store or the json log, and average all the series by bins
+    #
+    dates, columns = loadSeries( options.sourceFile, startDate, endDate, options.resolution, prefix="rendernodes/renderNodesByStatus/" )
 
     if VERBOSE:
-        print "Num events: %d" % len(scale)
-
-    if len(scale) < options.resolution:
-        if VERBOSE:
-            print "Too few events for resolution or scale: limit to %d" % len(scale)
-        options.resolution = len(scale)
+        print "Num events: %d" % len(dates)
 
+    if not len(dates):
+        print "No stats in the range"
+        sys.exit(1)
 
-    stepSize = len(scale) / options.resolution
-    newshape = (options.resolution, stepSize)
-    useableSize = len(scale) - ( len(scale) % options.resolution )
-
-    
-    working = np.array(nb_working[-useableSize:])
-    unknown = np.array(nb_unknown[-useableSize:])
-    paused = np.array(nb_paused[-useableSize:])
-    idle = np.array(nb_idle[-useableSize:])
-
-
-    avg_working= np.around( np.mean( np.reshape(working, newshape), axis=1), decimals=0)
-    avg_paused= np.around( np.mean( np.reshape(paused, newshape), axis=1), decimals=0)
-    avg_unknown= np.around( np.mean( np.reshape(unknown, newshape), axis=1), decimals=0)
-    avg_idle= np.around( np.mean( np.reshape(idle, newshape), axis=1), decimals=0)
-
+    byStatus = lambda status: columns.get( "rendernodes/renderNodesByStatus/" + status, np.zeros(len(dates)) )
+    series = {
+        'working': byStatus('Working') + byStatus('Assigned'),
+        'paused': byStatus('Paused'),
+        'unknown': byStatus('Unknown'),
+        'idle': byStatus('Idle'),
+    }
+    scale, avg = resample( dates, series, options.resolution )
 
     # med= np.median(data, axis=1)
     # amin= np.min(data, axis=1)
@@ -203,25 +164,10 @@ if __name__ == "__main__":
     # q2= higherQuartile(data)
     # std= np.std(data, axis=1)
 
-
-    strScale = [''] * options.resolution
-    tmpscale = np.reshape(scale[-useableSize:], newshape)
-    # print ("tmp scale %d = %r" % (len(tmpscale), tmpscale) )
-    # print ("str scale %d = %r" % (len(strScale), strScale) )
-
-    options.scaleEvery = min(options.scaleEvery, options.resolution )
-    for i,date in enumerate(tmpscale[::len(tmpscale)/options.scaleEvery]):
-        newIndex = i*len(tmpscale)/options.scaleEvery
-
-        if newIndex < len(strScale):
-            strScale[newIndex] = date[0].strftime('%H:%M')
-
-    strScale[0] = scale[0].strftime('%Y-%m-%d %H:%M')
-    strScale[-1] = scale[-1].strftime('%Y-%m-%d %H:%M')
+    strScale = scaleLabels( scale, options.scaleEvery )
 
     if VERBOSE:
-        print ("newshape %d = %r" % (len(newshape), newshape) )
-        print ("avg %d = %r" % (len(avg_working), avg_working) )
+        print ("avg %d = %r" % (len(avg['working']), avg['working']) )
         print ("scale %d = %r" % (len(strScale), strScale) )
 
     # sert a etablir une distribution des valeurs du tableau dans chaque "bin"
@@ -273,13 +219,13 @@ if __name__ == "__main__":
     avg_usage.x_labels = strScale
 
     if options.offline:
-        avg_usage.add('Offline', avg_unknown )
+        avg_usage.add('Offline', toSeries( avg['unknown'], decimals=0 ) )
     if options.paused:
-        avg_usage.add('Paused', avg_paused )
+        avg_usage.add('Paused', toSeries( avg['paused'], decimals=0 ) )
     if options.working:
-        avg_usage.add('Working', avg_working )
+        avg_usage.add('Working', toSeries( avg['working'], decimals=0 ) )
     if options.idle:
-        avg_usage.add('Idle', avg_idle )
+        avg_usage.add('Idle', toSeries( avg['idle'], decimals=0 ) )
 
     if options.renderMode == 'svg':
         avg_usage.render_to_file( options.outputFile )
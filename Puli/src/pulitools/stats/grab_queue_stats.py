@@ -10,12 +10,9 @@ import os
 import sys
 import csv
 import datetime
-import time
 import logging
 import copy
 
-from itertools import groupby, count
-
 from logging import handlers
 from optparse import OptionParser
 
@@ -29,6 +26,7 @@ except ImportError:
 from tornado.httpclient import HTTPClient, HTTPError
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
+from octopus.core.timeseries import TimeSeriesStore, flatten
 
 ###########################################################################################################################
 # Data example:
@@ -54,7 +52,7 @@ from octopus.core import singletonconfig
 #     ...
 #     }, 
 #     "total": { "jobs":15, "err":1, "paused":2, "ready/blocked":10, "running":2 , "allocatedRN":5, "readyCommandCount":150}
-#     "requestDate": "Wed Apr  2 12:16:01 2014"
+#     "requestDate": 1396433761.0
 # }
 
 
@@ -65,7 +63,7 @@ def process_args():
     '''
 
     usage = ""
-    desc="""Retrieves queue info of the server (http://puliserver:8004/query) and append it in the usage_stats.log file.
+    desc="""Retrieves queue info of the server (http://puliserver:8004/stats/aggregate) and append it in the usage_stats.log file and a time-series store.
 This is generally used in a cron script to grab queue usage data over time. It can then be processed to generate several graphs."""
 
     parser = OptionParser(usage=usage, description=desc, version="%prog 0.1" )
@@ -73,76 +71,11 @@ This is generally used in a cron script to grab queue usage data over time. It c
     parser.add_option( "-s", "--server", action="store", dest="hostname", default="pulitest", help="Specified a target host to send the request")
     parser.add_option( "-p", "--port", action="store", dest="port", type="int", default=8004, help="Specified a target port")
     parser.add_option( "-o", action="store", dest="outputFile", default=os.path.join(settings.LOGDIR, "queue_stats.log"), help="Target output file." )
+    parser.add_option( "--store", action="store", dest="storeDir", default=os.path.join(settings.LOGDIR, "queue_stats.tsdb"), help="Time-series store directory, read by the display tools." )
     options, args = parser.parse_args()
 
     return options, args
 
-def aggregate( field, jobs ):
-    res = {}
-    jobs = sorted( jobs, key=lambda n: n[ field ] )
-
-    for group, iterJobs in groupby(jobs, key= lambda n: n[field]) :
-        numBlock, numReady, numRun, numDone, numErr, numCancel, numPaused, numCommands, numAlloc, numJobs = 0,0,0,0,0,0,0,0,0,0
-        for job in list(iterJobs):
-            # print job
-            if job['status']==0:
-                numBlock += 1
-            elif job['status']==1:
-                numReady += 1 
-            elif job['status']==2:
-                numRun += 1
-            elif job['status']==3:
-                numDone += 1
-            elif job['status']==4:
-                numErr += 1
-            elif job['status']==5:
-                numCancel += 1
-            elif job['status']==6:
-                numPaused += 1
-
-            numCommands += job['readyCommandCount']
-            numAlloc += job['allocatedRN']
-            numJobs += 1
-
-        res[group] = { "jobs": numJobs, "err":numErr, "paused":numPaused, "ready":(numReady+numBlock), "running":numRun, "allocatedRN":numAlloc, "readyCommandCount": numCommands }
-    
-    return res
-
-def formatData( data ):
-    # Init result dict    
-    res = { "prod":{}, "user":{}, "step":{}, "type":{}, "total":{} }
-    jobs = data['items']
-
-    res['requestDate'] = time.mktime(time.strptime(data['summary']['requestDate']))
-    res['prod'] = aggregate( 'prod', jobs )
-    res['step'] = aggregate( 'step', jobs )
-    res['type'] = aggregate( 'type', jobs )
-    res['user'] = aggregate( 'user', jobs )
-    
-    #
-    # Get totals (slightly different from other aggregate
-    #
-    jobs = sorted( jobs, key=lambda n: n['status'] )
-    res['total'] = { 'jobs':len(jobs), "err":0, "paused":0, "ready":0, "running":0, "allocatedRN":0, "readyCommandCount": 0 }
-
-    for group, iterJobs in groupby(jobs, key= lambda n: n['status']) :
-        jobsBygroup = list(iterJobs)
-        if group in [0, 1]:
-            res['total']['ready'] += len(jobsBygroup)
-        elif group == 2:
-            res['total']['running'] = len(jobsBygroup)
-        elif group == 4:
-            res['total']['err'] = len(jobsBygroup)
-        elif group == 6:
-            res['total']['paused'] = len(jobsBygroup)
-        
-        for job in jobsBygroup:
-            res['total']['allocatedRN'] += job['allocatedRN']
-            res['total']['readyCommandCount'] += job['readyCommandCount']
-
-    return res
-
-
 if __name__ == "__main__":
 
     options, args = process_args()
@@ -151,18 +84,8 @@ if __name__ == "__main__":
     # 
     # Prepare request and store result in log file
     #
-    _param = "query?&constraint_status=0&constraint_status=1&constraint_status=2&constraint_status=4\
-&constraint_status=6\
-&attr=id\
-&attr=status\
-&attr=allocatedRN\
-&attr=readyCommandCount\
-&attr=user\
-&attr=tags%3Aprod\
-&attr=tags%3Astep\
-&attr=tags%3Ashot\
-&attr=tags%3Atype"
-
+    # the jobs are aggregated by the server, only the counters are transfered
+    _param = "stats/aggregate?by=prod,step,type,user"
 
     _request = "http://%s:%s/%s" % ( options.hostname, options.port, _param)
     _logPath = os.path.join( options.outputFile )
@@ -198,10 +121,9 @@ if __name__ == "__main__":
             if response.body == "":
                 print "Error: No stats retrieved"
             else:
-                data = json.loads(response.body)
-
-                aggregatedData = formatData( data )
+                aggregatedData = json.loads(response.body)
                 statsLogger.warning( json.dumps(aggregatedData) )
+                TimeSeriesStore( options.storeDir ).append( aggregatedData.pop("requestDate"), flatten(aggregatedData) )
                 # for key, val in aggregate.items():
                 #     print " -- %s" % key
                 #     for key2, val2 in val.items():
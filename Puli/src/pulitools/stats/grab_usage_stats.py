@@ -24,6 +24,7 @@ except ImportError:
 from tornado.httpclient import HTTPClient, HTTPError
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
+from octopus.core.timeseries import TimeSeriesStore, flatten
 
 ###########################################################################################################################
 # Data example:
@@ -72,7 +73,7 @@ def process_args():
     '''
 
     usage = ""
-    desc="""Retrieves stats info of the server (http://puliserver:8004/stats) and append it in the usage_stats.log file.
+    desc="""Retrieves stats info of the server (http://puliserver:8004/stats) and append it in the usage_stats.log file and a time-series store.
 This is generally used in a cron script to grab renderfarm usage data over time. It can then be processed to generate several graphs."""
 
     parser = OptionParser(usage=usage, description=desc, version="%prog 0.1" )
@@ -80,6 +81,7 @@ This is generally used in a cron script to grab renderfarm usage data over time.
     parser.add_option( "-s", "--server", action="store", dest="hostname", default="pulitest", help="Specified a target host to send the request")
     parser.add_option( "-p", "--port", action="store", dest="port", type="int", default=8004, help="Specified a target port")
     parser.add_option( "-o", action="store", dest="outputFile", default=os.path.join(settings.LOGDIR, "usage_stats.log"), help="Target output file." )
+    parser.add_option( "--store", action="store", dest="storeDir", default=os.path.join(settings.LOGDIR, "usage_stats.tsdb"), help="Time-series store directory, read by the display tools." )
     options, args = parser.parse_args()
 
     return options, args
@@ -129,6 +131,7 @@ if __name__ == "__main__":
                 for license in tmp["licensesDict"]:
                     del license["rns"]
                 statsLogger.warning( json.dumps(tmp) )
+                TimeSeriesStore( options.storeDir ).append( tmp.pop("date"), flatten(tmp) )
 
     except HTTPError, e:
         print "Error:", e
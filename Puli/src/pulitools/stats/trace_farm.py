@@ -16,16 +16,12 @@ import numpy as np
 import pygal
 from pygal.style import *
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
 from pulitools.common import lowerQuartile, higherQuartile
 from pulitools.stats.common import createCommonParser, getRangeDates, prepareGraph, prepareScale, renderGraph
+from pulitools.stats.common import loadSeries, resample, toSeries
 
 # import matplotlib.pyplot as plt
 
@@ -107,106 +103,40 @@ if __name__ == "__main__":
         print "  - to:   %r " % datetime.date.fromtimestamp(endDate)
         print "Start."
 
-    nbjobs=[]
-    nb_working=[]
-    nb_paused=[]
-    nb_idle=[]
-    nb_assigned=[]
-    nb_unknown=[]
-    nb_booting=[]
-    nb_finishing=[]
-    strScale=[]
-    scale=[]
-
-    log = []
-    with open(options.sourceFile, "r" ) as f:
-        for line in f:
-            item = json.loads(line)
-            if item['date'] < startDate or endDate <= item['date'] :
-                continue
-            log.append( item )
+    #
+    # Read the range in the time-series store or the json log, and average all the series by bins
+    #
+    dates, columns = loadSeries( options.sourceFile, startDate, endDate, options.resolution, prefix="rendernodes/renderNodesByStatus/" )
 
     # print "%s - %6.2f ms - load source complete" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
     # prevTime = time.time()
-    
-    for data in log:
-        eventDate = datetime.datetime.fromtimestamp( data['date'] )
-
-
-        if options.working:
-            nb_working.append(data["rendernodes"]["renderNodesByStatus"]['Working'] + data["rendernodes"]["renderNodesByStatus"]['Assigned'])
-
-        if options.paused:
-            nb_paused.append(data["rendernodes"]["renderNodesByStatus"]['Paused'])
-
-        if options.offline:
-            nb_unknown.append(data["rendernodes"]["renderNodesByStatus"]['Unknown'])
-
-        if options.idle:
-            nb_idle.append(data["rendernodes"]["renderNodesByStatus"]['Idle'])
-
-        scale.append( eventDate )
-
-    # print "%s - %6.2f ms - create temp array" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
-    # prevTime = time.time()
-
 
     if VERBOSE:
-        print "Num events: %d" % len(scale)
-
-    if len(scale) < options.resolution:
-        if VERBOSE:
-            print "Too few events for resolution or scale: limit to %d" % len(scale)
-        options.resolution = len(scale)
-
-
-    stepSize = len(scale) / options.resolution
-    newshape = (options.resolution, stepSize)
-    useableSize = len(scale) - ( len(scale) % options.resolution )
-
-    # print "%s - %6.2f ms - create newshape" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
-    # prevTime = time.time()
-
-    
-
-    if options.working:
-        working = np.array(nb_working[-useableSize:])
-        avg_working= np.around( np.mean( np.reshape(working, newshape), axis=1), decimals=0)
-
-    if options.offline:
-        unknown = np.array(nb_unknown[-useableSize:])
-        avg_unknown= np.around( np.mean( np.reshape(unknown, newshape), axis=1), decimals=0)
-
-    if options.paused:
-        paused = np.array(nb_paused[-useableSize:])
-        avg_paused= np.around( np.mean( np.reshape(paused, newshape), axis=1), decimals=0)
-
-    if options.idle:
-        idle = np.array(nb_idle[-useableSize:])
-        avg_idle= np.around( np.mean( np.reshape(idle, newshape), axis=1), decimals=0)
-
-    # print "%s - %6.2f ms - create and average numpy arrays" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
+        print "Num events: %d" % len(dates)
+
+    if not len(dates):
+        print "No stats in the range"
+        sys.exit(1)
+
+    byStatus = lambda status: columns.get( "rendernodes/renderNodesByStatus/" + status, np.zeros(len(dates)) )
+    series = {
+        'working': byStatus('Working') + byStatus('Assigned'),
+        'paused': byStatus('Paused'),
+        'unknown': byStatus('Unknown'),
+        'idle': byStatus('Idle'),
+    }
+    scale, avg = resample( dates, series, options.resolution )
+
+    # print "%s - %6.2f ms - resample" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
     # prevTime = time.time()
 
-    # med= np.median(data, axis=1)
-    # amin= np.min(data, axis=1)
-    # amax= np.max(data, axis=1)
-    # q1= lowerQuartile(data)
-    # q2= higherQuartile(data)
-    # std= np.std(data, axis=1)
-
-
     #
     # Prepare scale
     #
-    tmpscale = np.reshape(scale[-useableSize:], newshape)
-    strScale = prepareScale( tmpscale, options )
-    # print ("scale %d = %r" % (len(strScale), strScale) )
-
+    strScale = prepareScale( scale, options )
 
     if VERBOSE:
-        print ("newshape %d = %r" % (len(newshape), newshape) )
-        print ("avg %d = %r" % (len(avg_working), avg_working) )
+        print ("avg %d = %r" % (len(avg['working']), avg['working']) )
         print ("scale %d = %r" % (len(strScale), strScale) )
 
     graph = prepareGraph( options )
@@ -214,13 +144,13 @@ if __name__ == "__main__":
     graph.x_labels = strScale
 
     if options.offline:
-        graph.add('Offline', avg_unknown )
+        graph.add('Offline', toSeries( avg['unknown'], decimals=0 ) )
     if options.paused:
-        graph.add('Paused', avg_paused )
+        graph.add('Paused', toSeries( avg['paused'], decimals=0 ) )
     if options.working:
-        graph.add('Working', avg_working )
+        graph.add('Working', toSeries( avg['working'], decimals=0 ) )
     if options.idle:
-        graph.add('Idle', avg_idle )
+        graph.add('Idle', toSeries( avg['idle'], decimals=0 ) )
 
     # print "%s - %6.2f ms - prepare graph" % (datetime.datetime.now(), (time.time()-prevTime) * 1000)
     # prevTime = time.time()
@@ -12,21 +12,16 @@ import time
 import datetime
 from optparse import OptionParser
 
-import numpy as np
 import pygal
 from pygal.style import *
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
-
 
 from octopus.dispatcher import settings
 from octopus.core import singletonconfig
 from pulitools.common import roundTime
 from pulitools.common import lowerQuartile, higherQuartile
 from pulitools.stats.common import createCommonParser, getRangeDates, prepareGraph, prepareScale, renderGraph
+from pulitools.stats.common import loadGroups, resample, toSeries
 
 
 ###########################################################################################################################
@@ -82,109 +77,34 @@ if __name__ == "__main__":
         print "  - to:   %r " % datetime.date.fromtimestamp(endDate)
         print "Start."
 
-    strScale=[]
-    scale=[]
-    data2Dim = {}
-    log = []
-
     #
-    # Load json log and filter by date
-    # Optim done to have a fast dataset:
-    #  - read the whole file without parsing
-    #  - read resulting list in reversed order and parse each json line (mandatory due to the log format)
-    #  - filter and add data in range
-    #  - once we reached data too old: break the loop
-
-    with open(options.sourceFile, "r" ) as f:
-        raw_str = f.readlines()
-
-    # print "%s - %6.2f ms - load raw source complete, num lines: %d" % (datetime.datetime.now(), (time.time() - prevTime) * 1000,len(raw_str))
-    # prevTime = time.time()
-
-    # for line in reversed(raw_str):
-    #     date = float(re.search('"requestDate":(.+?),', line).group(1))
-    #     if (startDate < date  and date <= endDate):
-    #         log.insert( 0, json.loads(line) )
-    #     if date < startDate:
-    #         break
-
-    for line in reversed(raw_str):
-        data = json.loads(line)
-
-        if (startDate < data['requestDate']  and data['requestDate'] <= endDate):
-            log.insert( 0, data )
-
-        # We read by the end, if date is too old, no need to continue the parsing
-        if data['requestDate'] < startDate:
-            break
-
-    # print "%s - %6.2f ms - load source complete, num lines: %d" % (datetime.datetime.now(), (time.time() - prevTime) * 1000, len(log))
-    # prevTime = time.time()
-
-    for i, data in enumerate(log):
-        eventDate = datetime.datetime.fromtimestamp( data['requestDate'] )
-
-        for key, val in data[ groupField ].items():
-            if key not in data2Dim:
-                data2Dim[key] = np.array( [0]*len(log) )
-            data2Dim[key][i] = val[ graphValue ]
+    # Read the range in the time-series store or the json log, and average all the groups by bins
+    #
+    dates, data2Dim = loadGroups( options.sourceFile, startDate, endDate, options.resolution, groupField, graphValue )
 
-        scale.append( eventDate )
-    # print "%s - %6.2f ms - create tables" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
+    # print "%s - %6.2f ms - load source complete, num lines: %d" % (datetime.datetime.now(), (time.time() - prevTime) * 1000, len(dates))
     # prevTime = time.time()
 
-    stepSize = len(scale) / options.resolution
-    newshape = (options.resolution, stepSize)
-    useableSize = len(scale) - ( len(scale) % options.resolution )
-
-    avgData = {}
-
-    if options.verbose:
-        print "stepSize=%d" % stepSize
-        print "useableSize=%d" % useableSize
+    if not len(dates):
+        print "No stats in the range"
+        sys.exit(1)
 
-    for dataset in data2Dim.keys():
-        # print "%s = %d - %r" % (dataset, len(data2Dim[dataset]), data2Dim[dataset])
-        avgData[dataset] = np.mean( np.reshape(data2Dim[dataset][-useableSize:], newshape), axis=1)
+    scale, avgData = resample( dates, data2Dim, options.resolution )
 
     # print "%s - %6.2f ms - create avg data" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
     # prevTime = time.time()
 
-    # working = np.array(nb_working[-useableSize:])
-    # unknown = np.array(nb_unknown[-useableSize:])
-    # paused = np.array(nb_paused[-useableSize:])
-
-
-    # # print ("working %d = %r" % (len(working), working) )
-    # # print ("reshape %d = %r" % (len(newshape), newshape) )
-
-    # avg_working= np.mean( np.reshape(working, newshape), axis=1)
-    # avg_paused= np.mean( np.reshape(paused, newshape), axis=1)
-    # avg_unknown= np.mean( np.reshape(unknown, newshape), axis=1)
-
-
-    # # med= np.median(data, axis=1)
-    # # amin= np.min(data, axis=1)
-    # # amax= np.max(data, axis=1)
-    # # q1= lowerQuartile(data)
-    # # q2= higherQuartile(data)
-    # # std= np.std(data, axis=1)
-
-    # strScale = [''] * options.resolution
-
     #
     # Prepare scale
     #
-    tmpscale = np.reshape(scale[-useableSize:], newshape)
-    strScale = prepareScale( tmpscale, options )
+    strScale = prepareScale( scale, options )
 
     if options.verbose:
-        print ("newshape %d = %r" % (len(newshape), newshape) )
         print ("data2Dim %d = %r" % (len(data2Dim), data2Dim) )
         print ("scale %d = %r" % (len(strScale), strScale) )
 
     if options.verbose:
-        print "Num events: %d" % len(scale)
+        print "Num events: %d" % len(dates)
         print "Creating graph."
 
 
@@ -193,7 +113,7 @@ if __name__ == "__main__":
     avg_usage.x_labels = strScale
 
     for key,val in avgData.items():
-        avg_usage.add(key, val )
+        avg_usage.add(key, toSeries(val) )
     # print "%s - %6.2f ms - prepare graph" % (datetime.datetime.now(), (time.time() - prevTime) * 1000)
     # prevTime = time.time()
 
@@ -40,12 +40,12 @@ class StatsMainWindow(QMainWindow):
     reportDict={ 
         "RN usage": { 
             "cmd": BASEDIR + "scripts/util/update_usage_stats",
-            "source":"/s/apps/lin/vfx_test_apps/pulistats/logs/usage_stats.log"
+            "source":"/s/apps/lin/vfx_test_apps/pulistats/logs/usage_stats.tsdb"
             },
 
         "Job usage" : { 
             "cmd": BASEDIR + "scripts/util/update_queue_stats",
-            "source":"/s/apps/lin/vfx_test_apps/pulistats/logs/queue_stats.log"
+            "source":"/s/apps/lin/vfx_test_apps/pulistats/logs/queue_stats.tsdb"
         },
     }
 